@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+重排序模型基准测试 - 对比 BGEReranker（sentence-transformers, fp32）与 ONNXReranker（fp32 / int8）
+
+用法:
+    python scripts/benchmark_reranker.py --export                # 首次运行先导出ONNX模型（含int8量化）
+    python scripts/benchmark_reranker.py --pairs 12 --runs 50 --threads 4
+"""
+
+import sys
+import os
+import time
+import argparse
+import random
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from src.core.reranker import BGEReranker, ONNXReranker
+
+
+SENTENCES = [
+    "员工入职满一年后可享受带薪年假，年假天数随工龄增加。",
+    "差旅费用需在出差结束后十五个工作日内提交报销申请。",
+    "报销单据须附发票原件，金额超过五千元需部门负责人审批。",
+    "公司实行弹性工作制，核心工作时间为上午十点至下午四点。",
+    "信息安全规定禁止将客户数据复制到个人设备。",
+    "新员工试用期为三个月，试用期满后进行转正评估。",
+    "加班需提前在系统中申请，调休应在三个月内使用完毕。",
+    "采购金额在一万元以上的项目须经过比价或招标流程。",
+]
+
+QUERIES = ["年假怎么计算？", "差旅报销需要哪些材料", "试用期多久可以转正", "加班可以调休吗"]
+
+
+def build_pairs(num_pairs: int, seed: int = 0):
+    """生成长度不一的(查询, 文档)对，模拟线上重排序候选"""
+    rng = random.Random(seed)
+    query = rng.choice(QUERIES)
+    documents = [
+        "".join(rng.choice(SENTENCES) for _ in range(rng.randint(1, 12)))
+        for _ in range(num_pairs)
+    ]
+    return query, documents
+
+
+def bench(name: str, reranker, query, documents, runs: int, warmup: int):
+    for _ in range(warmup):
+        reranker.rerank(query, documents, top_k=len(documents))
+
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        reranker.rerank(query, documents, top_k=len(documents))
+        latencies.append(time.perf_counter() - started)
+
+    latencies = np.asarray(latencies) * 1000
+    print(
+        f"  {name:<18} p50 {np.percentile(latencies, 50):8.1f} ms   "
+        f"p95 {np.percentile(latencies, 95):8.1f} ms   "
+        f"{len(documents) * runs / (latencies.sum() / 1000):8.1f} pairs/s"
+    )
+    results = reranker.rerank(query, documents, top_k=len(documents))
+    scores = np.empty(len(documents))
+    for item in results:
+        scores[item['index']] = item['score']
+    return scores
+
+
+def compare(name: str, reference, scores, top_k: int):
+    """与BGEReranker的分数对比：Spearman秩相关、最大绝对误差、top_k重合率"""
+    from scipy.stats import spearmanr
+
+    rho = spearmanr(reference, scores).correlation
+    reference_top = set(np.argsort(-reference)[:top_k])
+    overlap = len(reference_top & set(np.argsort(-scores)[:top_k])) / top_k
+    print(
+        f"  {name:<18} spearman {rho:.4f}   max|Δ| {np.abs(reference - scores).max():.4f}   "
+        f"top{top_k}重合 {overlap:.0%}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重排序模型基准测试")
+    parser.add_argument("--model", default="BAAI/bge-reranker-v2-m3", help="HuggingFace模型名")
+    parser.add_argument("--onnx-path", default="./models/bge-reranker-onnx", help="ONNX模型导出目录")
+    parser.add_argument("--export", action="store_true", help="先导出ONNX模型并生成int8量化版本")
+    parser.add_argument("--pairs", type=int, default=12, help="每次重排序的候选数")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op线程数，0为按物理核数")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.export:
+        print(f"📦 导出ONNX模型: {args.model} -> {args.onnx_path}")
+        ONNXReranker.export(args.model, args.onnx_path, quantize=True)
+        print("✅ 导出完成")
+
+    query, documents = build_pairs(args.pairs)
+    print(f"⏱️  {args.pairs}对 × {args.runs}次，查询: {query}")
+
+    bge_scores = bench(
+        "bge (fp32)",
+        BGEReranker(model_name=args.model, device="cpu", batch_size=args.batch_size),
+        query, documents, args.runs, args.warmup
+    )
+
+    onnx_scores = {}
+    for name, quantized in [("onnx (fp32)", False), ("onnx (int8)", True)]:
+        try:
+            reranker = ONNXReranker(
+                model_path=args.onnx_path,
+                model_name=args.model,
+                quantized=quantized,
+                intra_op_threads=args.threads,
+                batch_size=args.batch_size
+            )
+            if quantized and not reranker._model_file().endswith(ONNXReranker.QUANTIZED_MODEL_FILE):
+                print(f"  {name:<18} 跳过：未找到量化模型，请使用 --export 生成")
+                continue
+            onnx_scores[name] = bench(name, reranker, query, documents, args.runs, args.warmup)
+        except Exception as e:
+            print(f"  {name:<18} 失败: {e}")
+
+    if onnx_scores:
+        print("🎯 与bge (fp32)的排序一致性")
+        for name, scores in onnx_scores.items():
+            compare(name, bge_scores, scores, min(args.top_k, args.pairs))
+
+
+if __name__ == "__main__":
+    main()
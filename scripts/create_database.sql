@@ -68,6 +68,7 @@ CREATE TABLE IF NOT EXISTS knowledge_bases (
     chunk_size INTEGER DEFAULT 1000,
     chunk_overlap INTEGER DEFAULT 200,
     retrieval_top_k INTEGER DEFAULT 4,
+    query_expansion_mode VARCHAR(20),
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -98,7 +99,10 @@ CREATE TABLE IF NOT EXISTS document_chunks (
     document_id VARCHAR(255) NOT NULL,
     chunk_index INTEGER NOT NULL,
     content TEXT NOT NULL,
+    vector_id VARCHAR(255),
     chunk_metadata JSONB,
+    tokens JSONB,
+    token_analyzer VARCHAR(100),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
 );
@@ -0,0 +1,11 @@
+-- ============================================
+-- 已有数据库升级脚本（可重复执行）
+-- 新部署直接使用 create_database.sql；服务启动时 DatabaseManager.create_tables 也会自动补齐这些列
+-- ============================================
+
+-- 分块保存入库时的分词结果，重建BM25索引时无需重新分词
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS tokens JSONB;
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS token_analyzer VARCHAR(100);
+
+-- 知识库级查询扩展模式（sync / speculative / off），为空时使用全局配置
+ALTER TABLE knowledge_bases ADD COLUMN IF NOT EXISTS query_expansion_mode VARCHAR(20);
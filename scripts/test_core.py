@@ -245,6 +245,41 @@ def test_requirements():
         return False
 
 
+def test_text_analyzer():
+    """测试中文分词：单字停用词不切开普通复合词"""
+    print("\n🔤 测试中文分词...")
+    
+    try:
+        from src.core.text_analyzer import ChineseAnalyzer
+        
+        analyzer = ChineseAnalyzer()
+        expected = {
+            "其他问题": "其他",
+            "就业政策": "就业",
+            "现在在线": "在线",
+            "和平发展": "和平",
+        }
+        for text, term in expected.items():
+            tokens = analyzer.analyze(text)
+            if term not in tokens:
+                print(f"❌ {text} 的分词结果缺少 {term}: {tokens}")
+                return False
+            print(f"✅ {text}: {tokens}")
+        
+        tokens = analyzer.analyze("我们的年假")
+        if "我们" in tokens or "的" in tokens:
+            print(f"❌ 停用词未过滤: {tokens}")
+            return False
+        print(f"✅ 停用词过滤: {tokens}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ 中文分词测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def main():
     """运行所有测试"""
     print("=" * 50)
@@ -261,6 +296,7 @@ def main():
     results.append(("项目结构", test_project_structure()))
     results.append(("Docker配置", test_docker_config()))
     results.append(("依赖配置", test_requirements()))
+    results.append(("中文分词", test_text_analyzer()))
     
     # 显示结果
     print("\n" + "=" * 50)
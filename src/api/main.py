@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
@@ -9,11 +9,13 @@ import os
 import json
 import uuid
 import time
+import asyncio
 from contextlib import asynccontextmanager
 from src.config.settings import get_settings, ensure_directories
 from src.services.knowledge_base_service import KnowledgeBaseService
 from src.services.auth_service import permission_service
 from src.services.file_storage_service import get_file_storage_service
+from src.core.tracing import start_trace, stage, export_metrics
 from src.models.schemas import (
     KnowledgeBaseCreate,
     KnowledgeBaseUpdate,
@@ -25,6 +27,8 @@ from src.models.schemas import (
     SearchResult,
     QARequest,
     QAResponse,
+    BatchSearchRequest,
+    BatchQARequest,
     StatsResponse,
     KnowledgeBasePermissionCreate,
     KnowledgeBasePermissionResponse,
@@ -145,6 +149,16 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标：rag_stage_duration_seconds{stage}为各阶段耗时直方图"""
+    try:
+        content, content_type = export_metrics()
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return Response(content=content, media_type=content_type)
+
+
 @app.post("/api/v1/knowledge-bases", response_model=KnowledgeBaseResponse)
 async def create_knowledge_base(
     kb_data: KnowledgeBaseCreate,
@@ -159,7 +173,8 @@ async def create_knowledge_base(
             llm_model=kb_data.llm_model,
             chunk_size=kb_data.chunk_size,
             chunk_overlap=kb_data.chunk_overlap,
-            retrieval_top_k=kb_data.retrieval_top_k
+            retrieval_top_k=kb_data.retrieval_top_k,
+            query_expansion_mode=kb_data.query_expansion_mode
         )
         return KnowledgeBaseResponse(
             id=kb.id,
@@ -170,6 +185,7 @@ async def create_knowledge_base(
             chunk_size=kb.chunk_size,
             chunk_overlap=kb.chunk_overlap,
             retrieval_top_k=kb.retrieval_top_k,
+            query_expansion_mode=kb.query_expansion_mode,
             is_active=kb.is_active,
             created_at=kb.created_at,
             updated_at=kb.updated_at,
@@ -206,6 +222,7 @@ async def list_knowledge_bases(
                 chunk_size=kb.chunk_size,
                 chunk_overlap=kb.chunk_overlap,
                 retrieval_top_k=kb.retrieval_top_k,
+                query_expansion_mode=kb.query_expansion_mode,
                 is_active=kb.is_active,
                 created_at=kb.created_at,
                 updated_at=kb.updated_at,
@@ -237,6 +254,7 @@ async def get_knowledge_base(
             chunk_size=kb.chunk_size,
             chunk_overlap=kb.chunk_overlap,
             retrieval_top_k=kb.retrieval_top_k,
+            query_expansion_mode=kb.query_expansion_mode,
             is_active=kb.is_active,
             created_at=kb.created_at,
             updated_at=kb.updated_at,
@@ -272,6 +290,7 @@ async def update_knowledge_base(
             chunk_size=kb.chunk_size,
             chunk_overlap=kb.chunk_overlap,
             retrieval_top_k=kb.retrieval_top_k,
+            query_expansion_mode=kb.query_expansion_mode,
             is_active=kb.is_active,
             created_at=kb.created_at,
             updated_at=kb.updated_at,
@@ -475,6 +494,48 @@ async def revoke_knowledge_base_permission(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _save_query_log(service: KnowledgeBaseService, **fields):
+    """写入问答日志（同步数据库会话，异步接口中通过线程调用）"""
+    from src.models.database import QueryLog
+    
+    # 日志写入耗时只进入直方图：写入时日志内容已确定，无法记入本条日志
+    with stage("db_log"):
+        session = service.db_manager.get_session()
+        try:
+            session.add(QueryLog(**fields))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+def _accessible_kb_ids(service: KnowledgeBaseService, current_user: User) -> List[str]:
+    session = service.db_manager.get_session()
+    try:
+        return permission_service.get_accessible_knowledge_bases(session, current_user, "read")
+    finally:
+        session.close()
+
+
+async def _get_request_engine(request, current_user: User, service: KnowledgeBaseService):
+    """按请求中的知识库得到检索引擎，返回 (引擎, 知识库ID列表)；knowledge_base_ids包含多个知识库时使用联邦检索"""
+    if request.knowledge_base_ids:
+        kb_ids = list(dict.fromkeys(request.knowledge_base_ids))
+        if not is_superuser(current_user):
+            accessible = set(await asyncio.to_thread(_accessible_kb_ids, service, current_user))
+            denied = [kb_id for kb_id in kb_ids if kb_id not in accessible]
+            if denied:
+                raise HTTPException(status_code=403, detail=f"No read access to knowledge bases: {', '.join(denied)}")
+        if len(kb_ids) > 1:
+            return service.get_federated_engine(kb_ids), kb_ids
+        return service.get_rag_engine(kb_ids[0]), kb_ids
+    if not request.knowledge_base_id:
+        raise HTTPException(status_code=400, detail="knowledge_base_id or knowledge_base_ids is required")
+    return service.get_rag_engine(request.knowledge_base_id), [request.knowledge_base_id]
+
+
 @app.post("/api/v1/search", response_model=SearchResponse)
 async def search(
     search_request: SearchRequest,
@@ -482,8 +543,8 @@ async def search(
     service: KnowledgeBaseService = Depends(get_kb_service)
 ):
     try:
-        rag_engine = service.get_rag_engine(search_request.knowledge_base_id)
-        result = rag_engine.search_only(
+        rag_engine, kb_ids = await _get_request_engine(search_request, current_user, service)
+        result = await rag_engine.asearch(
             query=search_request.query,
             top_k=search_request.top_k,
             score_threshold=search_request.score_threshold,
@@ -503,8 +564,41 @@ async def search(
                 for r in result["results"]
             ],
             total_count=result["count"],
-            retrieval_time=result["retrieval_time"]
+            retrieval_time=result["retrieval_time"],
+            failed_knowledge_bases=getattr(rag_engine, "last_failed", None) or None
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _ndjson_line(index: int, result: Dict[str, Any]) -> str:
+    return json.dumps({"index": index, **result}, ensure_ascii=False, default=str) + "\n"
+
+
+@app.post("/api/v1/search/batch")
+async def search_batch(
+    batch_request: BatchSearchRequest,
+    current_user: User = Depends(get_current_user),
+    service: KnowledgeBaseService = Depends(get_kb_service)
+):
+    """批量检索，结果以NDJSON逐行返回（每行带请求中的序号index，按完成顺序输出）"""
+    try:
+        rag_engine, kb_ids = await _get_request_engine(batch_request, current_user, service)
+        
+        async def generate():
+            async for index, result in rag_engine.asearch_batch(
+                queries=batch_request.queries,
+                top_k=batch_request.top_k,
+                score_threshold=batch_request.score_threshold,
+                filters=batch_request.filters
+            ):
+                yield _ndjson_line(index, result)
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -516,33 +610,28 @@ async def question_answer(
     service: KnowledgeBaseService = Depends(get_kb_service)
 ):
     try:
-        rag_engine = service.get_rag_engine(qa_request.knowledge_base_id)
-        result = rag_engine.query(
+        trace = start_trace()
+        rag_engine, kb_ids = await _get_request_engine(qa_request, current_user, service)
+        result = await rag_engine.aquery(
             question=qa_request.question,
             top_k=qa_request.top_k,
             conversation_history=qa_request.conversation_history,
-            **qa_request.model_dump(exclude={"question", "knowledge_base_id", "top_k", "conversation_history"}, exclude_unset=True)
+            **qa_request.model_dump(exclude={"question", "knowledge_base_id", "knowledge_base_ids", "top_k", "conversation_history", "stream_mode", "preliminary_sources"}, exclude_unset=True)
         )
         
-        from src.models.database import QueryLog
-        
-        session = service.db_manager.get_session()
-        try:
-            query_log = QueryLog(
-                user_id=current_user.id,
-                knowledge_base_id=qa_request.knowledge_base_id,
-                query=qa_request.question,
-                answer=result["answer"],
-                retrieval_count=len(result["sources"]),
-                retrieval_time=result["retrieval_time"],
-                generation_time=result["generation_time"],
-                total_time=result["total_time"],
-                log_metadata={"sources": result["sources"]}
-            )
-            session.add(query_log)
-            session.commit()
-        finally:
-            session.close()
+        await asyncio.to_thread(
+            _save_query_log,
+            service,
+            user_id=current_user.id,
+            knowledge_base_id=kb_ids[0],
+            query=qa_request.question,
+            answer=result["answer"],
+            retrieval_count=len(result["sources"]),
+            retrieval_time=result["retrieval_time"],
+            generation_time=result["generation_time"],
+            total_time=result["total_time"],
+            log_metadata={"sources": result["sources"], "knowledge_base_ids": kb_ids, "timings": trace.to_dict()}
+        )
         
         return QAResponse(
             question=result["question"],
@@ -563,6 +652,34 @@ async def question_answer(
             llm_provider=type(rag_engine.llm).__name__,
             llm_model=getattr(rag_engine.llm, 'model', 'unknown')
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/v1/qa/batch")
+async def question_answer_batch(
+    batch_request: BatchQARequest,
+    current_user: User = Depends(get_current_user),
+    service: KnowledgeBaseService = Depends(get_kb_service)
+):
+    """批量问答，结果以NDJSON逐行返回（每行带请求中的序号index，按完成顺序输出）"""
+    try:
+        rag_engine, kb_ids = await _get_request_engine(batch_request, current_user, service)
+        
+        async def generate():
+            async for index, result in rag_engine.aquery_batch(
+                questions=batch_request.questions,
+                top_k=batch_request.top_k,
+                concurrency=batch_request.concurrency,
+                **batch_request.model_dump(exclude={"questions", "knowledge_base_id", "knowledge_base_ids", "top_k", "concurrency"}, exclude_unset=True)
+            ):
+                yield _ndjson_line(index, result)
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -577,27 +694,33 @@ async def question_answer_stream(
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info(f"Received stream QA request for KB: {qa_request.knowledge_base_id}, question: {qa_request.question[:50]}...")
+        logger.info(f"Received stream QA request for KB: {qa_request.knowledge_base_ids or qa_request.knowledge_base_id}, question: {qa_request.question[:50]}...")
         
-        rag_engine = service.get_rag_engine(qa_request.knowledge_base_id)
-        logger.info(f"Got RAG engine for KB: {qa_request.knowledge_base_id}")
+        rag_engine, kb_ids = await _get_request_engine(qa_request, current_user, service)
+        logger.info(f"Got RAG engine for KB: {', '.join(kb_ids)}")
         
         async def generate():
             logger.info("Starting stream query...")
+            trace = start_trace()
             start_time = time.time()
             full_answer = ""
+            answer_parts = []
             sources = []
             retrieval_time = 0
             
             try:
-                for chunk in rag_engine.stream_query(
+                async for chunk in rag_engine.astream_query(
                     question=qa_request.question,
                     top_k=qa_request.top_k,
                     conversation_history=qa_request.conversation_history,
-                    **qa_request.model_dump(exclude={"question", "knowledge_base_id", "top_k", "conversation_history"}, exclude_unset=True)
+                    stream_mode=qa_request.stream_mode,
+                    preliminary_sources=bool(qa_request.preliminary_sources),
+                    **qa_request.model_dump(exclude={"question", "knowledge_base_id", "knowledge_base_ids", "top_k", "conversation_history", "stream_mode", "preliminary_sources"}, exclude_unset=True)
                 ):
-                    logger.info(f"Yielding chunk with keys: {list(chunk.keys())}")
+                    logger.debug(f"Yielding chunk with keys: {list(chunk.keys())}")
                     
+                    if "delta" in chunk:
+                        answer_parts.append(chunk["delta"])
                     if "answer" in chunk:
                         full_answer = chunk["answer"]
                     if "sources" in chunk:
@@ -605,36 +728,36 @@ async def question_answer_stream(
                     if "retrieval_time" in chunk:
                         retrieval_time = chunk["retrieval_time"]
                     
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if "event" in chunk:
+                        yield f"event: {chunk['event']}\ndata: {json.dumps(chunk)}\n\n"
+                    else:
+                        yield f"data: {json.dumps(chunk)}\n\n"
                 
                 logger.info("Stream query completed")
                 
+                if answer_parts:
+                    full_answer = "".join(answer_parts)
+                
                 total_time = time.time() - start_time
                 generation_time = total_time - retrieval_time
                 
-                from src.models.database import QueryLog
-                
-                session = service.db_manager.get_session()
                 try:
-                    query_log = QueryLog(
+                    await asyncio.to_thread(
+                        _save_query_log,
+                        service,
                         user_id=current_user.id,
-                        knowledge_base_id=qa_request.knowledge_base_id,
+                        knowledge_base_id=kb_ids[0],
                         query=qa_request.question,
                         answer=full_answer,
                         retrieval_count=len(sources),
                         retrieval_time=retrieval_time,
                         generation_time=generation_time,
                         total_time=total_time,
-                        log_metadata={"sources": sources}
+                        log_metadata={"sources": sources, "knowledge_base_ids": kb_ids, "timings": trace.to_dict()}
                     )
-                    session.add(query_log)
-                    session.commit()
                     logger.info("Query log saved successfully")
                 except Exception as log_e:
                     logger.error(f"Error saving query log: {str(log_e)}")
-                    session.rollback()
-                finally:
-                    session.close()
                     
             except Exception as stream_e:
                 logger.error(f"Error in stream query: {str(stream_e)}")
@@ -645,6 +768,8 @@ async def question_answer_stream(
             generate(),
             media_type="text/event-stream"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in question_answer_stream: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
-from typing import Optional
+from typing import Optional, Dict
 import os
 
 
@@ -88,13 +88,56 @@ class Settings(BaseSettings):
     use_rerank: bool = False
     use_query_rewrite: bool = False
     rerank_model: str = "BAAI/bge-reranker-v2-m3"
+    reranker_type: str = "bge"
+    rerank_onnx_path: str = "./models/bge-reranker-onnx"
+    rerank_onnx_quantized: bool = True
+    rerank_onnx_threads: int = 0
+    rerank_micro_batching: bool = False
+    rerank_max_batch_size: int = 64
+    rerank_max_wait_ms: float = 5.0
+    enable_rerank_cache: bool = True
+    rerank_cache_size: int = 50000
+    rerank_cache_ttl: int = 86400
     num_paths: int = 3
     bm25_weight: float = 0.3
     vector_weight: float = 0.7
+    bm25_index_dir: str = "./data/bm25"
+    bm25_analyzer: str = "chinese"
+    bm25_use_dictionary: bool = False
+    retrieval_workers: int = 16
+    vector_search_timeout: float = 10.0
+    bm25_search_timeout: float = 5.0
+    federated_search_timeout: float = 15.0
+    federated_score_calibration: str = "auto"
+    batch_chunk_size: int = 32
+    batch_qa_concurrency: int = 8
+    batch_stage_timeout: float = 120.0
+    query_expansion_mode: str = "sync"
+    query_expansion_cache_size: int = 1024
+    query_expansion_cache_ttl: int = 3600
+    query_expansion_speculative_timeout: float = 0.5
     context_window_size: int = 4000
+    context_token_budgets: Dict[str, int] = {}
+    neighbor_chunk_window: int = 0
+    neighbor_chunk_cache_size: int = 4096
+    enable_context_compression: bool = False
+    context_compression_ratio: float = 0.4
+    context_compression_window: int = 1
+    context_compression_min_chars: int = 200
+    enable_mmr: bool = False
+    mmr_lambda: float = 0.7
+    mmr_fetch_factor: int = 3
+    stream_coalesce_ms: int = 50
 
     enable_cache: bool = True
     cache_ttl: int = 3600
+    cache_backend: str = "memory"
+    cache_max_size: int = 10000
+    cache_sqlite_path: str = "./data/cache.db"
+    cache_key_prefix: str = "rag:"
+    enable_semantic_cache: bool = False
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_size: int = 1000
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_password: Optional[str] = None
@@ -140,4 +183,5 @@ def ensure_directories(settings: Settings):
     os.makedirs(settings.upload_dir, exist_ok=True)
     os.makedirs(settings.temp_dir, exist_ok=True)
     os.makedirs(settings.chroma_persist_dir, exist_ok=True)
+    os.makedirs(settings.bm25_index_dir, exist_ok=True)
     os.makedirs(os.path.dirname(settings.log_file), exist_ok=True)
\ No newline at end of file
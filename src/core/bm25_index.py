@@ -0,0 +1,990 @@
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+from collections import defaultdict
+from contextlib import contextmanager
+import os
+import json
+import mmap
+import heapq
+import struct
+import numpy as np
+from scipy import sparse
+
+try:
+    import fcntl
+except ImportError:
+    # 非POSIX平台没有flock，只保证单进程内的并发安全
+    fcntl = None
+
+
+class BM25Segment:
+    """BM25增量段
+
+    段内文档使用从0开始的局部下标，倒排表为 词项 -> {局部下标: 词频}。
+    新增文档写入可变的增量段，合并时与基础段一起编译为新的CompiledBM25Segment。
+    """
+
+    def __init__(self):
+        self.doc_ids: List[str] = []
+        self.corpus: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.doc_len: List[int] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_terms: List[List[str]] = []
+        self.key_index: Dict[str, int] = {}
+        self.dead: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def add(
+        self,
+        doc_id: str,
+        content: str,
+        metadata: Dict[str, Any],
+        tokens: List[str]
+    ) -> int:
+        """追加一个文档，返回其局部下标"""
+        idx = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.corpus.append(content)
+        self.metadatas.append(metadata)
+        self.doc_len.append(len(tokens))
+        self.key_index[doc_id] = idx
+
+        freqs = defaultdict(int)
+        for token in tokens:
+            freqs[token] += 1
+        for token, freq in freqs.items():
+            self.postings.setdefault(token, {})[idx] = freq
+        self.doc_terms.append(list(freqs))
+        return idx
+
+    def extend(self, other: "BM25Segment"):
+        """把另一个增量段中的存活文档追加到本段（沿用其倒排表，无需重新分词）"""
+        remap: Dict[int, int] = {}
+        for idx, doc_id in enumerate(other.doc_ids):
+            if idx in other.dead:
+                continue
+            new_idx = len(self.doc_ids)
+            remap[idx] = new_idx
+            self.doc_ids.append(doc_id)
+            self.corpus.append(other.corpus[idx])
+            self.metadatas.append(other.metadatas[idx])
+            self.doc_len.append(other.doc_len[idx])
+            self.doc_terms.append(other.doc_terms[idx])
+            self.key_index[doc_id] = new_idx
+        for token, postings in other.postings.items():
+            for idx, tf in postings.items():
+                if idx in remap:
+                    self.postings.setdefault(token, {})[remap[idx]] = tf
+
+    def kill(self, idx: int):
+        self.dead.add(idx)
+
+    def is_alive(self, idx: int) -> bool:
+        return idx not in self.dead
+
+    def terms_of(self, idx: int) -> List[str]:
+        """文档包含的不重复词项（删除时用于扣减文档频率）"""
+        return self.doc_terms[idx]
+
+    def score(
+        self,
+        query_weights: Dict[str, float],
+        k1: float,
+        b: float,
+        avg_doc_len: float
+    ) -> Dict[int, float]:
+        """只遍历查询词的倒排表，返回 局部下标 -> BM25分数"""
+        scores: Dict[int, float] = defaultdict(float)
+        for token, query_weight in query_weights.items():
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            for idx, tf in postings.items():
+                numerator = tf * (k1 + 1)
+                denominator = tf + k1 * (1 - b + b * self.doc_len[idx] / avg_doc_len)
+                scores[idx] += query_weight * (numerator / denominator)
+        return scores
+
+    def top_k(
+        self,
+        query_weights: Dict[str, float],
+        top_k: int,
+        k1: float,
+        b: float,
+        avg_doc_len: float,
+        min_score: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[float, int]]:
+        scores = self.score(query_weights, k1, b, avg_doc_len)
+        candidates = (
+            (score, idx) for idx, score in scores.items()
+            if score > 0 and score >= min_score and idx not in self.dead
+            and (not filters or match_filters(self.metadatas[idx], filters))
+        )
+        # 同分按文档下标排序，与CompiledBM25Segment.top_k一致
+        return heapq.nsmallest(top_k, candidates, key=lambda item: (-item[0], item[1]))
+
+
+BLOCK_SIZE = 128
+
+
+def varint_sizes(values: np.ndarray) -> np.ndarray:
+    """每个整数的varint编码字节数"""
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        num_bytes += values >= (1 << shift)
+    return num_bytes
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """把非负整数数组编码为LEB128变长字节（每字节7位，最高位表示后面还有字节）"""
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = varint_sizes(values)
+    offsets = np.cumsum(num_bytes) - num_bytes
+    encoded = np.empty(int(num_bytes.sum()), dtype=np.uint8)
+    for group in range(int(num_bytes.max()) if len(values) else 0):
+        mask = num_bytes > group
+        payload = (values[mask] >> np.uint64(7 * group)) & np.uint64(0x7F)
+        more = (num_bytes[mask] > group + 1).astype(np.uint64) << np.uint64(7)
+        encoded[offsets[mask] + group] = (payload | more).astype(np.uint8)
+    return encoded
+
+
+def decode_varints(encoded: np.ndarray) -> np.ndarray:
+    """向量化解码LEB128变长字节
+
+    绝大多数值只占一个字节，按值的结束字节向前逐字节拼接高位，循环次数等于最长编码的字节数。
+    """
+    is_end = encoded < 0x80
+    if is_end.all():
+        return encoded.astype(np.int64)
+    ends = np.flatnonzero(is_end)
+    values = (encoded[ends] & 0x7F).astype(np.int64)
+    active = np.ones(len(ends), dtype=bool)
+    for back in range(1, 10):
+        positions = ends - back
+        active &= positions >= 0
+        active[active] &= ~is_end[positions[active]]
+        if not active.any():
+            break
+        values[active] = (values[active] << 7) | (encoded[positions[active]] & 0x7F)
+    return values
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """拼接多个区间 [start, start+length) 的下标"""
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+
+
+def _segmented_cumsum(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """按段分别做前缀和"""
+    totals = np.cumsum(values)
+    seg_starts = np.cumsum(counts) - counts
+    before = totals[seg_starts] - values[seg_starts]
+    return totals - np.repeat(before, counts)
+
+
+class _BlobSequence:
+    """变长记录的只读序列视图：记录拼接在blob中，offsets[i]:offsets[i+1]为第i条，按需解码"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, decode):
+        self.blob = blob
+        self.offsets = offsets
+        self.decode = decode
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, idx: int) -> bytes:
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].tobytes()
+
+    def __getitem__(self, idx: int):
+        return self.decode(self.raw(idx))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class _SortedKeyIndex:
+    """key -> 下标的只读映射：在按key字节序排好的下标数组上二分查找，无需加载时构建字典"""
+
+    def __init__(self, keys: _BlobSequence, order: np.ndarray):
+        self.keys = keys
+        self.order = order
+
+    def get(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        target = key.encode('utf-8')
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keys.raw(int(self.order[mid])) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.order) and self.keys.raw(int(self.order[lo])) == target:
+            return int(self.order[lo])
+        return default
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+def _pack_blobs(items: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = np.fromiter((len(item) for item in items), dtype=np.int64, count=len(items))
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.frombuffer(b"".join(items), dtype=np.uint8), offsets
+
+
+class CompiledBM25Segment:
+    """不可变基础段（紧凑二进制格式，可直接内存映射）
+
+    所有数据保存在一块连续缓冲区中（内存中的bytes或只读mmap的快照文件），按段落(section)
+    以numpy视图零拷贝访问，多个worker进程映射同一文件时共享一份页缓存，加载与文档数无关：
+    - 词典：按UTF-8字节序排序的词项拼接串+偏移，查询词二分查找定位行号；
+    - 倒排表：每个词项按BLOCK_SIZE个文档分块，块内依次为文档号差值与词频的varint编码，
+      每块记录最后一个文档号以便跳块查找；
+    - 正排表：每个文档包含的词项号（差值+varint），删除文档时扣减文档频率；
+    - 文档库：key、原文、元数据JSON各自拼接保存，检索结果按需解码。
+
+    BM25词项权重 tf*(k1+1)/(tf+k1*(1-b+b*dl/avgdl)) 在解码时按段内平均文档长度计算，
+    每个词项的最大权重作为分数上界保存在段内，供MaxScore动态剪枝：上界之和低于当前第k名
+    分数的低IDF高频词项不再解码其倒排表，只对候选文档跳块查找补全分数，结果与穷举打分完全一致。
+    """
+
+    SECTIONS = (
+        ('doc_len', np.int32), ('term_blob', np.uint8), ('term_offsets', np.int64),
+        ('term_df', np.int32), ('term_max', np.float32), ('term_blocks', np.int64),
+        ('block_last_doc', np.int32), ('block_counts', np.int32), ('block_offsets', np.int64),
+        ('postings', np.uint8), ('forward_offsets', np.int64), ('forward', np.uint8),
+        ('key_blob', np.uint8), ('key_offsets', np.int64), ('key_order', np.int32),
+        ('text_blob', np.uint8), ('text_offsets', np.int64),
+        ('meta_blob', np.uint8), ('meta_offsets', np.int64),
+    )
+
+    def __init__(self, meta: Dict[str, Any], buffer):
+        self.meta = meta
+        self.buffer = buffer
+        self.k1 = meta['k1']
+        self.b = meta['b']
+        self.avg_doc_len = meta['avg_doc_len']
+        self.total_len = meta['total_len']
+
+        arrays = {}
+        for name, dtype in self.SECTIONS:
+            offset, count = meta['sections'][name]
+            arrays[name] = (
+                np.frombuffer(buffer, dtype=dtype, count=count, offset=offset) if count
+                else np.empty(0, dtype=dtype)
+            )
+        self.doc_len = arrays['doc_len']
+        self.term_df = arrays['term_df']
+        self.term_max_weight = arrays['term_max']
+        self.term_blocks = arrays['term_blocks']
+        self.block_last_doc = arrays['block_last_doc']
+        self.block_counts = arrays['block_counts']
+        self.block_offsets = arrays['block_offsets']
+        self.postings_data = arrays['postings']
+        self.forward_offsets = arrays['forward_offsets']
+        self.forward = arrays['forward']
+
+        self.terms = _BlobSequence(arrays['term_blob'], arrays['term_offsets'], lambda raw: raw.decode('utf-8'))
+        self.doc_ids = _BlobSequence(arrays['key_blob'], arrays['key_offsets'], lambda raw: raw.decode('utf-8'))
+        self.corpus = _BlobSequence(arrays['text_blob'], arrays['text_offsets'], lambda raw: raw.decode('utf-8'))
+        self.metadatas = _BlobSequence(arrays['meta_blob'], arrays['meta_offsets'], json.loads)
+        self.key_index = _SortedKeyIndex(self.doc_ids, arrays['key_order'])
+        self.alive = np.ones(len(self.doc_len), dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer)
+
+    def kill(self, idx: int):
+        self.alive[idx] = False
+
+    def is_alive(self, idx: int) -> bool:
+        return bool(self.alive[idx])
+
+    def term_row(self, token: str) -> Optional[int]:
+        """词典二分查找"""
+        target = token.encode('utf-8')
+        lo, hi = 0, len(self.terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.terms.raw(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.terms) and self.terms.raw(lo) == target:
+            return lo
+        return None
+
+    def doc_freq(self, token: str) -> int:
+        """编译时的文档频率（不扣除之后被删除的文档）"""
+        row = self.term_row(token)
+        return int(self.term_df[row]) if row is not None else 0
+
+    def terms_of(self, idx: int) -> List[str]:
+        """文档包含的不重复词项（删除时用于扣减文档频率）"""
+        term_ids = np.cumsum(decode_varints(self.forward[self.forward_offsets[idx]:self.forward_offsets[idx + 1]])) - 1
+        return [self.terms[int(term_id)] for term_id in term_ids]
+
+    def _term_weights(self, docs: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        return _bm25_weights(tfs, self.doc_len[docs], self.k1, self.b, self.avg_doc_len)
+
+    def _decode_blocks(self, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """解码若干倒排块（按顺序给出），返回 (文档下标, 词频)"""
+        if not len(blocks):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        starts = self.block_offsets[blocks]
+        lengths = self.block_offsets[blocks + 1] - starts
+        contiguous = blocks[-1] - blocks[0] == len(blocks) - 1
+        if contiguous:
+            encoded = self.postings_data[starts[0]:starts[0] + int(lengths.sum())]
+        else:
+            encoded = self.postings_data[_ranges(starts, lengths)]
+        values = decode_varints(encoded)
+
+        # 每块依次为counts个文档号差值和counts个词频；差值相对词项内前一个文档号，词项第一块从-1开始
+        counts = self.block_counts[blocks].astype(np.int64)
+        term_first_block = self.term_blocks[np.searchsorted(self.term_blocks, blocks, side='right') - 1]
+        previous = np.where(blocks == term_first_block, -1, self.block_last_doc[blocks - 1]).astype(np.int64)
+
+        if (counts[:-1] == BLOCK_SIZE).all():
+            # 同一词项的块只有最后一块可能不满，可以按 (块, 2, BLOCK_SIZE) 重排
+            full = len(blocks) - 1 + int(counts[-1] == BLOCK_SIZE)
+            head = values[:2 * BLOCK_SIZE * full].reshape(full, 2, BLOCK_SIZE)
+            tail = values[2 * BLOCK_SIZE * full:]
+            tail_count = len(tail) // 2
+            deltas = np.concatenate([head[:, 0, :].ravel(), tail[:tail_count]])
+            tfs = np.concatenate([head[:, 1, :].ravel(), tail[tail_count:]])
+        else:
+            entry_starts = np.cumsum(counts) - counts
+            delta_pos = _ranges(2 * entry_starts, counts)
+            deltas = values[delta_pos]
+            tfs = values[delta_pos + np.repeat(counts, counts)]
+
+        if contiguous and term_first_block[0] == term_first_block[-1]:
+            # 同一词项的连续块，差值可以一直累加
+            docs = previous[0] + np.cumsum(deltas)
+        else:
+            docs = np.repeat(previous, counts) + _segmented_cumsum(deltas, counts)
+        return docs, tfs
+
+    def _row(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """解码整行倒排表，返回 (文档下标, BM25权重)"""
+        docs, tfs = self._decode_blocks(np.arange(self.term_blocks[row], self.term_blocks[row + 1]))
+        return docs, self._term_weights(docs, tfs)
+
+    def _lookup(self, row: int, doc_indices: np.ndarray) -> np.ndarray:
+        """候选文档在某词项中的权重（不存在为0），按块最后文档号跳块，只解码命中的块"""
+        weights = np.zeros(len(doc_indices), dtype=np.float32)
+        first, last = self.term_blocks[row], self.term_blocks[row + 1]
+        if first == last or not len(doc_indices):
+            return weights
+        block_pos = np.searchsorted(self.block_last_doc[first:last], doc_indices)
+        blocks = np.unique(block_pos[block_pos < last - first]) + first
+        row_docs, row_tfs = self._decode_blocks(blocks)
+        if not len(row_docs):
+            return weights
+        pos = np.searchsorted(row_docs, doc_indices)
+        pos[pos == len(row_docs)] = 0
+        hit = row_docs[pos] == doc_indices
+        weights[hit] = self._term_weights(row_docs[pos[hit]], row_tfs[pos[hit]])
+        return weights
+
+    def all_postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """全部倒排项 (词项号, 文档下标, 词频)，用于合并"""
+        docs, tfs = self._decode_blocks(np.arange(len(self.block_counts)))
+        rows = np.repeat(np.arange(len(self.term_df)), self.term_df)
+        return rows, docs, tfs
+
+    def _query_vector(self, query_weights: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """查询词所在行及权重，按分数上界从大到小排列
+
+        穷举打分与剪枝打分都按这一顺序累加，两者的浮点结果逐位一致。
+        """
+        rows, values = [], []
+        for token, weight in query_weights.items():
+            row = self.term_row(token)
+            if row is not None:
+                rows.append(row)
+                values.append(weight)
+        rows, values = np.asarray(rows, dtype=np.int64), np.asarray(values, dtype=np.float64)
+        order = np.argsort(-(self.term_max_weight[rows] * values), kind='stable')
+        return rows[order], values[order]
+
+    def score_vector(self, query_weights: Dict[str, float]) -> np.ndarray:
+        """穷举打分：解码查询词所在行并累加到文档分数"""
+        rows, values = self._query_vector(query_weights)
+        if not len(rows):
+            return np.zeros(len(self), dtype=np.float64)
+        decoded = [self._row(row) for row in rows]
+        docs = np.concatenate([row_docs for row_docs, _ in decoded])
+        contributions = np.concatenate([
+            row_weights.astype(np.float64) * value for (_, row_weights), value in zip(decoded, values)
+        ])
+        return np.bincount(docs, weights=contributions, minlength=len(self))
+
+    def _select(
+        self,
+        doc_indices: np.ndarray,
+        scores: np.ndarray,
+        top_k: int,
+        min_score: float,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[Tuple[float, int]]:
+        # 同分按文档下标排序，保证剪枝与穷举打分选出的结果一致
+        keep = (scores > 0) & (scores >= min_score) & self.alive[doc_indices]
+        doc_indices, scores = doc_indices[keep], scores[keep]
+        if filters:
+            order = np.lexsort((doc_indices, -scores))
+            selected = []
+            for pos in order:
+                idx = int(doc_indices[pos])
+                if match_filters(self.metadatas[idx], filters):
+                    selected.append((float(scores[pos]), idx))
+                    if len(selected) >= top_k:
+                        break
+            return selected
+        if len(scores) > top_k:
+            kth_score = -np.partition(-scores, top_k - 1)[top_k - 1]
+            above = np.flatnonzero(scores > kth_score)
+            ties = np.flatnonzero(scores == kth_score)
+            ties = ties[np.argsort(doc_indices[ties], kind='stable')][:top_k - len(above)]
+            part = np.concatenate([above, ties])
+            doc_indices, scores = doc_indices[part], scores[part]
+        order = np.lexsort((doc_indices, -scores))
+        return [(float(scores[pos]), int(doc_indices[pos])) for pos in order]
+
+    def top_k(
+        self,
+        query_weights: Dict[str, float],
+        top_k: int,
+        min_score: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[float, int]]:
+        """MaxScore动态剪枝的top-k检索
+
+        按分数上界从大到小逐个扫描词项的倒排表并累加部分分数，部分分数的第k名是最终第k名
+        分数的下界θ。当剩余词项的上界之和低于θ时，只出现在剩余词项中的文档不可能进入top-k，
+        剩余（通常是低IDF的高频）词项不再扫描；已有候选中“部分分数+剩余上界”低于θ的也被剪掉，
+        其余候选按词项逐个跳块查找补全分数，每补全一个词项再剪枝一次。
+        """
+        if not len(self) or top_k <= 0:
+            return []
+        rows, values = self._query_vector(query_weights)
+        if not len(rows):
+            return []
+        upper_bounds = self.term_max_weight[rows].astype(np.float64) * values
+        # remaining[i]：第i个及之后词项的上界之和（留出浮点误差余量）
+        remaining = np.cumsum(upper_bounds[::-1])[::-1] * (1 + 1e-9)
+
+        accumulator = np.zeros(len(self), dtype=np.float64)
+        touched_parts = []
+        theta = min_score
+        scanned = 0
+        for term, (row, value) in enumerate(zip(rows, values)):
+            if remaining[term] < theta:
+                break
+            row_docs, row_weights = self._row(row)
+            # 权重均为正，部分分数为0即首次出现
+            touched_parts.append(row_docs[accumulator[row_docs] == 0])
+            accumulator[row_docs] += row_weights.astype(np.float64) * value
+            scanned = term + 1
+            if scanned < len(rows):
+                touched = np.concatenate(touched_parts)
+                partial_top = self._select(touched, accumulator[touched], top_k, min_score, filters)
+                if len(partial_top) >= top_k:
+                    theta = max(theta, partial_top[-1][0])
+
+        candidates = np.concatenate(touched_parts) if touched_parts else np.empty(0, dtype=np.int32)
+        if scanned < len(rows):
+            keep = (accumulator[candidates] + remaining[scanned]) >= theta
+            # 候选有序时二分查找的访存更连续
+            candidates = np.sort(candidates[keep & self.alive[candidates]])
+        scores = accumulator[candidates]
+        for term in range(scanned, len(rows)):
+            scores += self._lookup(rows[term], candidates).astype(np.float64) * values[term]
+            if term + 1 < len(rows):
+                # 每补全一个词项，剩余上界变小，可以继续剪掉候选
+                keep = scores + remaining[term + 1] >= theta
+                candidates, scores = candidates[keep], scores[keep]
+        return self._select(candidates, scores, top_k, min_score, filters)
+
+    def batch_top_k(
+        self,
+        batch_query_weights: List[Dict[str, float]],
+        top_k: int,
+        min_score: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[float, int]]]:
+        """批量打分：所有查询共用的词项只解码一次，再做一次稀疏矩阵乘法 (查询×词项) @ (词项×文档)"""
+        if not len(self) or not batch_query_weights:
+            return [[] for _ in batch_query_weights]
+        query_vectors = [self._query_vector(query_weights) for query_weights in batch_query_weights]
+        unique_rows = np.unique(np.concatenate([rows for rows, _ in query_vectors]))
+        if not len(unique_rows):
+            return [[] for _ in batch_query_weights]
+
+        decoded = [self._row(row) for row in unique_rows]
+        indptr = np.zeros(len(unique_rows) + 1, dtype=np.int64)
+        np.cumsum([len(row_docs) for row_docs, _ in decoded], out=indptr[1:])
+        term_matrix = sparse.csr_matrix(
+            (
+                np.concatenate([row_weights for _, row_weights in decoded]),
+                np.concatenate([row_docs for row_docs, _ in decoded]),
+                indptr
+            ),
+            shape=(len(unique_rows), len(self))
+        )
+
+        query_rows, query_cols, query_values = [], [], []
+        for query_idx, (rows, values) in enumerate(query_vectors):
+            query_rows.extend([query_idx] * len(rows))
+            query_cols.extend(np.searchsorted(unique_rows, rows).tolist())
+            query_values.extend(values.tolist())
+        query_matrix = sparse.csr_matrix(
+            (query_values, (query_rows, query_cols)),
+            shape=(len(batch_query_weights), len(unique_rows))
+        )
+        scores = (query_matrix @ term_matrix).tocsr()
+        results = []
+        for query_idx in range(len(batch_query_weights)):
+            start, end = scores.indptr[query_idx], scores.indptr[query_idx + 1]
+            results.append(self._select(scores.indices[start:end], scores.data[start:end], top_k, min_score, filters))
+        return results
+
+    @classmethod
+    def merged(
+        cls,
+        segments: Iterable[Any],
+        dead_keys: Set[str],
+        k1: float,
+        b: float
+    ) -> "CompiledBM25Segment":
+        """合并多个段并清除已删除文档，直接重映射倒排表而无需重新分词"""
+        doc_ids, texts, metadatas, doc_len = [], [], [], []
+        vocab: Dict[str, int] = {}
+        term_parts, doc_parts, tf_parts = [], [], []
+
+        for segment in segments:
+            keep = np.array(
+                [segment.is_alive(idx) and doc_id not in dead_keys for idx, doc_id in enumerate(segment.doc_ids)],
+                dtype=bool
+            )
+            remap = np.full(len(segment.doc_ids), -1, dtype=np.int64)
+            remap[keep] = np.arange(len(doc_ids), len(doc_ids) + int(keep.sum()))
+            compiled = isinstance(segment, CompiledBM25Segment)
+            for idx in np.flatnonzero(keep):
+                doc_ids.append(segment.doc_ids[idx])
+                if compiled:
+                    # 原文与元数据直接拷贝已编码的字节
+                    texts.append(segment.corpus.raw(idx))
+                    metadatas.append(segment.metadatas.raw(idx))
+                else:
+                    texts.append(segment.corpus[idx].encode('utf-8'))
+                    metadatas.append(json.dumps(segment.metadatas[idx], ensure_ascii=False).encode('utf-8'))
+                doc_len.append(int(segment.doc_len[idx]))
+
+            if compiled:
+                rows, docs, tfs = segment.all_postings()
+                term_map = np.array([vocab.setdefault(token, len(vocab)) for token in segment.terms], dtype=np.int64)
+                mask = keep[docs]
+                term_parts.append(term_map[rows[mask]] if len(term_map) else np.empty(0, dtype=np.int64))
+                doc_parts.append(remap[docs[mask]])
+                tf_parts.append(tfs[mask])
+            else:
+                terms, docs, tfs = [], [], []
+                for token, postings in segment.postings.items():
+                    for idx, tf in postings.items():
+                        if keep[idx]:
+                            terms.append(vocab.setdefault(token, len(vocab)))
+                            docs.append(remap[idx])
+                            tfs.append(tf)
+                term_parts.append(np.asarray(terms, dtype=np.int64))
+                doc_parts.append(np.asarray(docs, dtype=np.int64))
+                tf_parts.append(np.asarray(tfs, dtype=np.int64))
+
+        return cls.build(
+            doc_ids, texts, metadatas, np.asarray(doc_len, dtype=np.int32), list(vocab),
+            np.concatenate(term_parts) if term_parts else np.empty(0, dtype=np.int64),
+            np.concatenate(doc_parts) if doc_parts else np.empty(0, dtype=np.int64),
+            np.concatenate(tf_parts) if tf_parts else np.empty(0, dtype=np.int64),
+            k1, b
+        )
+
+    @classmethod
+    def build(
+        cls,
+        doc_ids: List[str],
+        texts: List[bytes],
+        metadatas: List[bytes],
+        doc_len: np.ndarray,
+        vocab: List[str],
+        term_ids: np.ndarray,
+        docs: np.ndarray,
+        tfs: np.ndarray,
+        k1: float,
+        b: float
+    ) -> "CompiledBM25Segment":
+        """由倒排项 (词项号, 文档下标, 词频) 编码生成段"""
+        num_docs = len(doc_ids)
+
+        # 只保留仍有倒排项的词项，按UTF-8字节序重新编号
+        used = np.unique(term_ids)
+        term_bytes = [vocab[term].encode('utf-8') for term in used]
+        term_order = sorted(range(len(used)), key=term_bytes.__getitem__)
+        new_ids = np.zeros(len(vocab), dtype=np.int64)
+        new_ids[used[term_order]] = np.arange(len(used))
+        term_ids = new_ids[term_ids]
+        term_blob, term_offsets = _pack_blobs([term_bytes[pos] for pos in term_order])
+
+        entry_order = np.lexsort((docs, term_ids))
+        term_ids, docs, tfs = term_ids[entry_order], docs[entry_order], tfs[entry_order]
+        term_df = np.bincount(term_ids, minlength=len(used))
+        term_start = np.cumsum(term_df) - term_df
+
+        avg_doc_len = float(doc_len.mean()) if num_docs else 0.0
+        weights = _bm25_weights(tfs, doc_len[docs], k1, b, avg_doc_len)
+        term_max = np.maximum.reduceat(weights, term_start) if len(weights) else np.empty(0, dtype=np.float32)
+
+        # 倒排表分块：块内先写文档号差值再写词频
+        blocks_per_term = (term_df + BLOCK_SIZE - 1) // BLOCK_SIZE
+        term_blocks = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(blocks_per_term, out=term_blocks[1:])
+        entry_block = term_blocks[term_ids] + (np.arange(len(docs)) - np.repeat(term_start, term_df)) // BLOCK_SIZE
+        block_counts = np.bincount(entry_block, minlength=int(term_blocks[-1]))
+        block_last_doc = docs[np.cumsum(block_counts) - 1] if len(docs) else np.empty(0, dtype=np.int64)
+        previous = np.empty_like(docs)
+        previous[1:] = docs[:-1]
+        previous[term_start] = -1
+        stream_keys = np.concatenate([entry_block * 2, entry_block * 2 + 1])
+        stream_order = np.argsort(stream_keys, kind='stable')
+        stream = np.concatenate([docs - previous, tfs])[stream_order]
+        block_offsets = np.zeros(len(block_counts) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(stream_keys[stream_order] // 2, weights=varint_sizes(stream), minlength=len(block_counts)),
+            out=block_offsets[1:]
+        )
+
+        # 正排表：文档 -> 词项号差值
+        forward_order = np.lexsort((term_ids, docs))
+        forward_docs, forward_terms = docs[forward_order], term_ids[forward_order]
+        doc_terms = np.bincount(forward_docs, minlength=num_docs)
+        forward_previous = np.empty_like(forward_terms)
+        forward_previous[1:] = forward_terms[:-1]
+        forward_previous[(np.cumsum(doc_terms) - doc_terms)[doc_terms > 0]] = -1
+        forward_deltas = forward_terms - forward_previous
+        forward_offsets = np.zeros(num_docs + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(forward_docs, weights=varint_sizes(forward_deltas), minlength=num_docs),
+            out=forward_offsets[1:]
+        )
+
+        key_bytes = [doc_id.encode('utf-8') for doc_id in doc_ids]
+        key_blob, key_offsets = _pack_blobs(key_bytes)
+        text_blob, text_offsets = _pack_blobs(texts)
+        meta_blob, meta_offsets = _pack_blobs(metadatas)
+
+        arrays = {
+            'doc_len': doc_len, 'term_blob': term_blob, 'term_offsets': term_offsets,
+            'term_df': term_df, 'term_max': term_max, 'term_blocks': term_blocks,
+            'block_last_doc': block_last_doc, 'block_counts': block_counts, 'block_offsets': block_offsets,
+            'postings': encode_varints(stream), 'forward_offsets': forward_offsets,
+            'forward': encode_varints(forward_deltas),
+            'key_blob': key_blob, 'key_offsets': key_offsets,
+            'key_order': np.asarray(sorted(range(num_docs), key=key_bytes.__getitem__), dtype=np.int32),
+            'text_blob': text_blob, 'text_offsets': text_offsets,
+            'meta_blob': meta_blob, 'meta_offsets': meta_offsets,
+        }
+        sections, parts, offset = {}, [], 0
+        for name, dtype in cls.SECTIONS:
+            data = np.ascontiguousarray(arrays[name], dtype=dtype)
+            padding = -offset % 8
+            parts.append(b"\0" * padding)
+            offset += padding
+            sections[name] = [offset, len(data)]
+            parts.append(data.tobytes())
+            offset += data.nbytes
+
+        meta = {
+            'k1': k1,
+            'b': b,
+            'avg_doc_len': avg_doc_len,
+            'total_len': int(doc_len.sum()),
+            'block_size': BLOCK_SIZE,
+            'sections': sections
+        }
+        return cls(meta, b"".join(parts))
+
+
+def _bm25_weights(tfs: np.ndarray, doc_len: np.ndarray, k1: float, b: float, avg_doc_len: float) -> np.ndarray:
+    """BM25词项权重 tf*(k1+1)/(tf+k1*(1-b+b*dl/avgdl))"""
+    tf = tfs.astype(np.float32)
+    norm = (1 - b + b * doc_len.astype(np.float32) / (avg_doc_len or 1.0)).astype(np.float32)
+    return (tf * np.float32(k1 + 1) / (tf + np.float32(k1) * norm)).astype(np.float32)
+
+
+def match_filters(metadata: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """按向量库的元数据过滤语法（等值、$eq/$ne/$in/$nin、$and/$or）匹配BM25结果"""
+    for key, condition in filters.items():
+        if key == '$and':
+            if not all(match_filters(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(match_filters(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, expected in condition.items():
+                if op == '$eq' and value != expected:
+                    return False
+                if op == '$ne' and value == expected:
+                    return False
+                if op == '$in' and value not in expected:
+                    return False
+                if op == '$nin' and value in expected:
+                    return False
+                if op not in ('$eq', '$ne', '$in', '$nin'):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class BM25IndexStorage:
+    """BM25索引持久化
+
+    由一个基础段快照和一个追加写的操作日志（JSON Lines）组成。快照文件为
+    魔数 + 头部长度 + JSON头部（格式版本、操作序号、参数、段落表）+ 段数据，
+    加载时只读内存映射段数据，不做解析或拷贝。
+    快照记录写入时的操作序号，加载时只回放序号更大的日志操作；合并期间日志先轮转为
+    `.merging`，新快照落盘后再删除，进程中途退出也不会丢失或重复应用操作。
+
+    多个worker进程共享同一份索引文件：追加日志、轮转、替换快照都在`.lock`文件的flock下进行，
+    操作序号保存在`.seq`文件中由各进程共同递增；同一时刻只有持有`.merge.lock`的进程执行合并。
+    """
+
+    MAGIC = b"BM25IDX\0"
+    FORMAT_VERSION = 5
+
+    def __init__(self, path: str):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.merging_log_path = f"{path}.log.merging"
+        self.seq_path = f"{path}.seq"
+        self.lock_path = f"{path}.lock"
+        self.merge_lock_path = f"{path}.merge.lock"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _open_lock_file(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return open(path, 'a+b')
+
+    @contextmanager
+    def locked(self):
+        """进程间互斥：日志追加、轮转、快照替换与读取日志尾部都在此锁内进行（不可重入）"""
+        if fcntl is None:
+            yield
+            return
+        with self._open_lock_file(self.lock_path) as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def merge_lock(self):
+        """尝试获取合并锁，返回是否获取成功；其他进程正在合并时不等待"""
+        if fcntl is None:
+            yield True
+            return
+        with self._open_lock_file(self.merge_lock_path) as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def stamp(self) -> Tuple:
+        """序号文件与快照文件的状态，用于低开销地判断其他进程是否写入过"""
+        stamp = []
+        for path in (self.seq_path, self.path):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def current_seq(self) -> int:
+        """所有进程共享的最新操作序号（需在locked()内调用）；序号文件缺失时由快照与日志推算"""
+        try:
+            with open(self.seq_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            header = self.read_header()
+            seq = header['seq'] if header is not None else 0
+            return max([seq] + [op['seq'] for op in self.read_ops(after_seq=seq)])
+
+    def write_seq(self, seq: int):
+        """写入共享的操作序号（需在locked()内调用）"""
+        tmp_path = f"{self.seq_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(seq))
+        os.replace(tmp_path, self.seq_path)
+
+    def next_seq(self) -> int:
+        """分配下一个操作序号（需在locked()内调用）"""
+        seq = self.current_seq() + 1
+        self.write_seq(seq)
+        return seq
+
+    @classmethod
+    def _payload_offset(cls, header_len: int) -> int:
+        offset = len(cls.MAGIC) + 8 + header_len
+        return offset + (-offset % 8)
+
+    def write_snapshot(
+        self,
+        params: Dict[str, Any],
+        segment: CompiledBM25Segment,
+        seq: int
+    ) -> CompiledBM25Segment:
+        """写入快照（先写临时文件再原子替换，避免并发读到半个文件），返回映射该文件的段"""
+        return self.commit_snapshot(self.prepare_snapshot(params, segment, seq), segment)
+
+    def prepare_snapshot(
+        self,
+        params: Dict[str, Any],
+        segment: CompiledBM25Segment,
+        seq: int
+    ) -> str:
+        """把快照写入临时文件（耗时部分，无需持有进程间锁），返回临时文件路径"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        header = json.dumps(
+            {'version': self.FORMAT_VERSION, 'seq': seq, **params, 'segment': segment.meta},
+            ensure_ascii=False
+        ).encode('utf-8')
+        payload_offset = self._payload_offset(len(header))
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(b"\0" * (payload_offset - len(self.MAGIC) - 8 - len(header)))
+            f.write(segment.buffer)
+        return tmp_path
+
+    def commit_snapshot(self, tmp_path: str, segment: CompiledBM25Segment) -> CompiledBM25Segment:
+        """用临时文件原子替换快照，返回映射该文件的段"""
+        os.replace(tmp_path, self.path)
+        snapshot = self.read_snapshot()
+        return snapshot[1] if snapshot is not None else segment
+
+    def read_header(self) -> Optional[Dict[str, Any]]:
+        """只读取快照头部（不含段表），用于判断其他进程是否写入了新快照"""
+        try:
+            with open(self.path, 'rb') as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    return None
+                header_len = struct.unpack('<Q', f.read(8))[0]
+                header = json.loads(f.read(header_len).decode('utf-8'))
+        except (OSError, ValueError, struct.error):
+            return None
+        if header.get('version') != self.FORMAT_VERSION:
+            return None
+        header.pop('segment', None)
+        return header
+
+    def read_snapshot(self) -> Optional[Tuple[Dict[str, Any], CompiledBM25Segment]]:
+        """返回 (参数, 段)；段数据为只读内存映射，多个进程共享同一份页缓存"""
+        if not self.exists():
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped[:len(self.MAGIC)] != self.MAGIC:
+                return None
+            header_len = struct.unpack_from('<Q', mapped, len(self.MAGIC))[0]
+            header_start = len(self.MAGIC) + 8
+            header = json.loads(mapped[header_start:header_start + header_len].decode('utf-8'))
+            if header.get('version') != self.FORMAT_VERSION:
+                return None
+            segment_meta = header.pop('segment')
+            segment = CompiledBM25Segment(segment_meta, memoryview(mapped)[self._payload_offset(header_len):])
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            print(f"加载BM25索引失败: {e}")
+            return None
+        return header, segment
+
+    def append(self, op: Dict[str, Any]):
+        """追加一条操作（需在locked()内调用，序号由next_seq分配）"""
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+
+    def read_ops(self, after_seq: int) -> List[Dict[str, Any]]:
+        ops = []
+        for log_path in (self.merging_log_path, self.log_path):
+            if not os.path.exists(log_path):
+                continue
+            with open(log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能因进程退出而写了一半
+                        continue
+                    if op.get('seq', 0) > after_seq:
+                        ops.append(op)
+        ops.sort(key=lambda op: op['seq'])
+        return ops
+
+    def rotate_log(self):
+        """合并开始时轮转日志，之后的操作写入新日志"""
+        if os.path.exists(self.log_path):
+            if os.path.exists(self.merging_log_path):
+                # 上一次合并未完成：把两份日志拼接起来，保证不丢操作
+                with open(self.merging_log_path, 'a', encoding='utf-8') as dst, \
+                        open(self.log_path, 'r', encoding='utf-8') as src:
+                    dst.write(src.read())
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.merging_log_path)
+
+    def finish_merge(self):
+        if os.path.exists(self.merging_log_path):
+            os.remove(self.merging_log_path)
+
+    def clear_logs(self):
+        for log_path in (self.log_path, self.merging_log_path):
+            if os.path.exists(log_path):
+                os.remove(log_path)
+
+    def remove(self):
+        # 锁文件保留：其他进程可能正持有它
+        self.clear_logs()
+        for path in (self.path, self.seq_path):
+            if os.path.exists(path):
+                os.remove(path)
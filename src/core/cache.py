@@ -0,0 +1,277 @@
+from typing import Optional, Any, Dict
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from src.config.settings import get_settings
+import os
+import json
+import time
+import sqlite3
+import threading
+
+settings = get_settings()
+
+
+class BaseCache(ABC):
+    """键值缓存基类
+
+    值需可JSON序列化；ttl为None时使用default_ttl，default_ttl也为None表示不过期。
+    blocking为True的后端涉及磁盘或网络IO，异步代码中应在线程里调用。
+    """
+
+    blocking = False
+
+    def __init__(self, default_ttl: Optional[int] = None):
+        self.default_ttl = default_ttl
+
+    def _ttl(self, ttl: Optional[int]) -> Optional[int]:
+        return self.default_ttl if ttl is None else ttl
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        """原子自增计数器（不过期），返回自增后的值"""
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+class MemoryCache(BaseCache):
+    """进程内LRU缓存（计数器单独存放，不参与淘汰）"""
+
+    def __init__(self, max_size: int = 10000, default_ttl: Optional[int] = None):
+        super().__init__(default_ttl)
+        self.max_size = max_size
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = self._ttl(ttl)
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._counters.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+
+class SQLiteCache(BaseCache):
+    """本地SQLite文件缓存，同一台机器上的多个worker进程共享，重启后保留"""
+
+    blocking = True
+
+    def __init__(self, path: str, default_ttl: Optional[int] = None):
+        super().__init__(default_ttl)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = self._ttl(ttl)
+        expires_at = time.time() + ttl if ttl else None
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, expires_at)
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+                value = (int(json.loads(row[0])) if row else 0) + 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, NULL)",
+                    (key, json.dumps(value))
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+            return cursor.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+
+class RedisCache(BaseCache):
+    """Redis缓存，多副本共享
+
+    client可注入任意实现了get/set(ex=)/delete/incr/scan_iter的Redis协议客户端（如测试用的本地替身）；
+    未传入时按settings中的redis_*配置创建。
+    """
+
+    blocking = True
+
+    def __init__(self, client=None, prefix: str = "rag:", default_ttl: Optional[int] = None):
+        super().__init__(default_ttl)
+        self.prefix = prefix
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("请安装 redis: pip install redis")
+            client = redis.Redis(
+                host=settings.redis_host,
+                port=settings.redis_port,
+                password=settings.redis_password,
+                db=settings.redis_db
+            )
+        self.client = client
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            return None
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = self._ttl(ttl)
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        self.client.set(self._key(key), payload, ex=ttl or None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self._key(key))
+
+    def incr(self, key: str) -> int:
+        return int(self.client.incr(self._key(key)))
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class CacheFactory:
+    """缓存后端工厂"""
+
+    @staticmethod
+    def create(cache_type: str = "memory", **kwargs) -> BaseCache:
+        cache_type = cache_type.lower()
+        default_ttl = kwargs.get("default_ttl", settings.cache_ttl)
+
+        if cache_type == "memory":
+            return MemoryCache(max_size=kwargs.get("max_size", settings.cache_max_size), default_ttl=default_ttl)
+        elif cache_type == "sqlite":
+            return SQLiteCache(path=kwargs.get("path", settings.cache_sqlite_path), default_ttl=default_ttl)
+        elif cache_type == "redis":
+            return RedisCache(
+                client=kwargs.get("client"),
+                prefix=kwargs.get("prefix", settings.cache_key_prefix),
+                default_ttl=default_ttl
+            )
+        else:
+            raise ValueError(f"不支持的缓存类型: {cache_type}")
+
+
+_cache: Optional[BaseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[BaseCache]:
+    """按配置创建的共享缓存；ENABLE_CACHE关闭时返回None"""
+    global _cache
+    if not settings.enable_cache:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheFactory.create(settings.cache_backend)
+    return _cache
+
+
+def kb_version_key(kb_id: str) -> str:
+    return f"kb_version:{kb_id}"
+
+
+def get_kb_version(cache: BaseCache, kb_id: str) -> int:
+    """知识库内容版本号，文档增删时递增；缓存键带上版本号，内容变化后旧条目自然失效"""
+    return int(cache.get(kb_version_key(kb_id)) or 0)
+
+
+def bump_kb_version(cache: Optional[BaseCache], kb_id: str) -> Optional[int]:
+    if cache is None:
+        return None
+    try:
+        return cache.incr(kb_version_key(kb_id))
+    except Exception as e:
+        print(f"更新知识库缓存版本失败: {e}")
+        return None
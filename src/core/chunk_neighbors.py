@@ -0,0 +1,110 @@
+from langchain_core.documents import Document
+from typing import List, Dict, Any, Tuple, Iterable
+from collections import OrderedDict
+import threading
+
+
+class ChunkNeighborExpander:
+    """小分块检索、大窗口生成（small-to-big）
+
+    命中的分块按vector_id在DocumentChunk中定位，取同一文档中chunk_index ± window的分块作为上下文窗口；
+    一次请求中所有未缓存的命中合并为一次自连接查询。窗口按vector_id缓存在内存LRU中：
+    分块入库后内容不变，删除后其vector_id不会再被检索到，因此缓存无需失效。
+    """
+
+    def __init__(self, db_manager, window: int = 1, cache_size: int = 4096):
+        self.db_manager = db_manager
+        self.window = window
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[Tuple[int, str, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "queries": 0}
+
+    def _query(self, vector_ids: List[str]) -> Dict[str, List[Tuple[int, str, Dict[str, Any]]]]:
+        from sqlalchemy import and_
+        from sqlalchemy.orm import aliased
+        from src.models.database import DocumentChunk
+
+        hit = aliased(DocumentChunk)
+        session = self.db_manager.get_session()
+        try:
+            rows = session.query(
+                hit.vector_id,
+                DocumentChunk.chunk_index,
+                DocumentChunk.content,
+                DocumentChunk.chunk_metadata
+            ).join(
+                DocumentChunk,
+                and_(
+                    DocumentChunk.document_id == hit.document_id,
+                    DocumentChunk.chunk_index.between(hit.chunk_index - self.window, hit.chunk_index + self.window)
+                )
+            ).filter(
+                hit.vector_id.in_(vector_ids)
+            ).order_by(hit.vector_id, DocumentChunk.chunk_index).all()
+        finally:
+            session.close()
+
+        windows: Dict[str, List[Tuple[int, str, Dict[str, Any]]]] = {}
+        for vector_id, chunk_index, content, metadata in rows:
+            windows.setdefault(vector_id, []).append((chunk_index, content, metadata or {}))
+        return windows
+
+    def windows(self, vector_ids: Iterable[str]) -> Dict[str, List[Tuple[int, str, Dict[str, Any]]]]:
+        """vector_id -> 窗口内的分块 [(chunk_index, content, metadata)]，按chunk_index排序"""
+        vector_ids = list(dict.fromkeys(vid for vid in vector_ids if vid))
+        result, misses = {}, []
+        with self._lock:
+            for vector_id in vector_ids:
+                window = self._cache.get(vector_id)
+                if window is None:
+                    misses.append(vector_id)
+                else:
+                    self._cache.move_to_end(vector_id)
+                    result[vector_id] = window
+            self.stats["hits"] += len(result)
+            self.stats["misses"] += len(misses)
+
+        if misses:
+            found = self._query(misses)
+            with self._lock:
+                self.stats["queries"] += 1
+                # 查不到的分块（例如正在入库、尚未提交）不缓存，下次重新查询
+                for vector_id, window in found.items():
+                    self._cache[vector_id] = window
+                    self._cache.move_to_end(vector_id)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            result.update(found)
+        return result
+
+    def expand(self, documents: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        """每个命中后追加其窗口内的相邻分块（分数与命中相同），由ContextBuilder按重叠文本合并为一段
+
+        命中本身保持原样；没有vector_id或在数据库中找不到的命中不扩展，查询失败时原样返回。
+        """
+        if self.window <= 0 or not documents:
+            return documents
+        try:
+            windows = self.windows(doc.metadata.get("vector_id") for doc, _ in documents)
+        except Exception as e:
+            print(f"查询相邻分块失败: {e}")
+            return documents
+
+        expanded = []
+        for doc, score in documents:
+            expanded.append((doc, score))
+            vector_id = doc.metadata.get("vector_id")
+            for _, content, metadata in windows.get(vector_id, []):
+                if metadata.get("vector_id") == vector_id:
+                    continue
+                expanded.append((Document(page_content=content, metadata={**metadata, "neighbor_of": vector_id}), score))
+        return expanded
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "size": len(self._cache), "window": self.window}
@@ -0,0 +1,188 @@
+from langchain_core.documents import Document
+from typing import List, Optional, Dict, Any, Tuple
+from src.core.text_analyzer import CJK_RANGES
+import re
+
+
+_TOKEN_ESTIMATE_PATTERN = re.compile(f"[{CJK_RANGES}]|[^\\W{CJK_RANGES}]+|[^\\w\\s]")
+
+
+class TokenCounter:
+    """按模型计算token数；tiktoken不可用时（未安装或无法加载编码文件）按字符类别估算"""
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name
+        self._encoding = None
+        try:
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(model_name) if model_name else tiktoken.get_encoding("cl100k_base")
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            self._encoding = None
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # 中文按字、英文按词、标点单独计数
+        return len(_TOKEN_ESTIMATE_PATTERN.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens])
+        for idx, match in enumerate(_TOKEN_ESTIMATE_PATTERN.finditer(text)):
+            if idx == max_tokens:
+                return text[:match.start()].rstrip()
+        return text
+
+
+class ContextBuilder:
+    """按token预算组装上下文
+
+    同一来源（source + page）中chunk_index相邻的分块按重叠文本合并，被其他分块完整包含的分块去掉；
+    合并后的片段按分数从高到低放入预算；放不下的片段在剩余预算足够时截断放入，否则跳过继续尝试更短的片段。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4000,
+        model_name: Optional[str] = None,
+        min_overlap: int = 20,
+        min_truncated_tokens: int = 64,
+        passage_overhead: int = 24
+    ):
+        self.max_tokens = max_tokens
+        self.counter = TokenCounter(model_name)
+        self.min_overlap = min_overlap
+        self.min_truncated_tokens = min_truncated_tokens
+        # 每个片段的标题行（序号、相似度、文件名）占用的token
+        self.passage_overhead = passage_overhead
+
+    @staticmethod
+    def _group_key(doc: Document) -> Optional[Tuple[Any, Any]]:
+        source = doc.metadata.get("source")
+        if not source:
+            return None
+        return source, doc.metadata.get("page")
+
+    def _overlap(self, left: str, right: str) -> int:
+        """left的后缀与right的前缀重合的长度，没有足够长的重合时返回0"""
+        if len(right) < self.min_overlap:
+            return len(right) if left.endswith(right) else 0
+        anchor = right[:self.min_overlap]
+        start = left.find(anchor, max(0, len(left) - len(right)))
+        while start != -1:
+            if right.startswith(left[start:]):
+                return len(left) - start
+            start = left.find(anchor, start + 1)
+        return 0
+
+    def merge(self, documents: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        """合并相邻重叠分块并去重，保持输入顺序"""
+        passages: List[Dict[str, Any]] = []
+        groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+
+        for doc, score in documents:
+            key = self._group_key(doc)
+            text = doc.page_content
+            if key is None:
+                passages.append({"doc": doc, "text": text, "score": score})
+                continue
+            chunk_index = doc.metadata.get("chunk_index")
+            passage = {"doc": doc, "text": text, "score": score, "first": chunk_index, "last": chunk_index}
+            groups.setdefault(key, []).append(passage)
+            passages.append(passage)
+
+        dropped = set()
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            # chunk_index缺失的分块只做包含去重
+            group.sort(key=lambda p: (p["first"] is None, p["first"] if p["first"] is not None else 0))
+            current = group[0]
+            for passage in group[1:]:
+                if passage["text"] in current["text"]:
+                    self._absorb(current, passage, current["text"])
+                    dropped.add(id(passage))
+                    continue
+                if current["text"] in passage["text"]:
+                    self._absorb(passage, current, passage["text"])
+                    dropped.add(id(current))
+                    current = passage
+                    continue
+                adjacent = (
+                    current["last"] is not None and passage["first"] is not None
+                    and passage["first"] - current["last"] <= 1
+                )
+                overlap = self._overlap(current["text"], passage["text"]) if adjacent else 0
+                if overlap:
+                    self._absorb(current, passage, current["text"] + passage["text"][overlap:])
+                    dropped.add(id(passage))
+                else:
+                    current = passage
+
+        return [
+            (self._merged_document(p), p["score"])
+            for p in passages if id(p) not in dropped
+        ]
+
+    @staticmethod
+    def _absorb(target: Dict[str, Any], other: Dict[str, Any], text: str):
+        target["text"] = text
+        target["score"] = max(target["score"], other["score"])
+        if other.get("first") is not None and (target.get("first") is None or other["first"] < target["first"]):
+            target["first"] = other["first"]
+        if other.get("last") is not None and (target.get("last") is None or other["last"] > target["last"]):
+            target["last"] = other["last"]
+        target["merged"] = target.get("merged", 1) + other.get("merged", 1)
+
+    @staticmethod
+    def _merged_document(passage: Dict[str, Any]) -> Document:
+        doc = passage["doc"]
+        if passage.get("merged", 1) == 1 and passage["text"] == doc.page_content:
+            return doc
+        metadata = dict(doc.metadata)
+        metadata["merged_chunks"] = passage.get("merged", 1)
+        if passage.get("first") is not None:
+            metadata["chunk_index"] = passage["first"]
+            metadata["last_chunk_index"] = passage["last"]
+        return Document(page_content=passage["text"], metadata=metadata)
+
+    def build(
+        self,
+        documents: List[Tuple[Document, float]],
+        max_tokens: Optional[int] = None
+    ) -> List[Tuple[Document, float]]:
+        """合并后按分数填充token预算，返回放入上下文的片段（按分数降序）"""
+        return self.fill(self.merge(documents), max_tokens)
+
+    def fill(
+        self,
+        documents: List[Tuple[Document, float]],
+        max_tokens: Optional[int] = None
+    ) -> List[Tuple[Document, float]]:
+        """已合并的片段按分数填充token预算"""
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        merged = sorted(documents, key=lambda item: item[1], reverse=True)
+
+        selected = []
+        used = 0
+        for doc, score in merged:
+            tokens = self.counter.count(doc.page_content) + self.passage_overhead
+            if used + tokens <= budget:
+                selected.append((doc, score))
+                used += tokens
+                continue
+            remaining = budget - used - self.passage_overhead
+            if remaining >= self.min_truncated_tokens:
+                text = self.counter.truncate(doc.page_content, remaining)
+                selected.append((Document(page_content=text, metadata={**doc.metadata, "truncated": True}), score))
+                break
+            # 剩余预算不够截断放入，继续尝试更短的片段
+        return selected
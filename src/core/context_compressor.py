@@ -0,0 +1,122 @@
+from langchain_core.documents import Document
+from typing import List, Tuple
+import re
+import numpy as np
+
+
+# 句末标点（含其后的引号/括号）或换行处断句；英文句号需后跟空白，避免切开小数和缩写
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?；;\n]*?(?:[。！？!?；;]+[”’\"')）]*|\.(?=\s)|\n+|$)")
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句切分，保留标点与原文空白，各句拼接后等于原文"""
+    sentences: List[str] = []
+    for sentence in _SENTENCE_PATTERN.findall(text):
+        if not sentence:
+            continue
+        if sentences and not sentence.strip():
+            # 纯空白并入上一句
+            sentences[-1] += sentence
+        else:
+            sentences.append(sentence)
+    return sentences
+
+
+class ContextCompressor:
+    """抽取式上下文压缩
+
+    候选片段切分为句子，与问题一起一次批量嵌入，按余弦相似度（一次矩阵乘法）对句子打分；
+    每个片段从得分最高的句子开始，连同前后window句一起保留，保留的字符数不超过原文的keep_ratio。
+    保留的句子按原文顺序拼接，不相邻处用省略号隔开。短于min_chars的片段不压缩。
+    """
+
+    GAP = "……"
+
+    def __init__(
+        self,
+        embedding_service,
+        keep_ratio: float = 0.4,
+        window: int = 1,
+        min_chars: int = 200
+    ):
+        if not 0 < keep_ratio <= 1:
+            raise ValueError(f"keep_ratio需在(0, 1]之间: {keep_ratio}")
+        self.embedding_service = embedding_service
+        self.keep_ratio = keep_ratio
+        self.window = window
+        self.min_chars = min_chars
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _select(self, sentences: List[str], scores: np.ndarray) -> List[int]:
+        """按分数从高到低取句子（含前后window句），加入后会超出字符预算时停止（得分最高的一组总是保留）；
+        返回按原文顺序的句子下标"""
+        lengths = np.fromiter((len(s) for s in sentences), dtype=np.int64, count=len(sentences))
+        budget = self.keep_ratio * lengths.sum()
+        keep = np.zeros(len(sentences), dtype=bool)
+        kept = 0
+        for idx in np.argsort(-scores, kind="stable"):
+            low, high = max(0, idx - self.window), min(len(sentences), idx + self.window + 1)
+            added = int(lengths[low:high][~keep[low:high]].sum())
+            if kept and kept + added > budget:
+                break
+            kept += added
+            keep[low:high] = True
+        return np.flatnonzero(keep).tolist()
+
+    def _join(self, sentences: List[str], selected: List[int]) -> str:
+        """连续的句子拼成一段，段与段之间以及被省略的开头、结尾用省略号标出"""
+        runs: List[List[int]] = []
+        for idx in selected:
+            if runs and idx == runs[-1][-1] + 1:
+                runs[-1].append(idx)
+            else:
+                runs.append([idx])
+        text = self.GAP.join("".join(sentences[idx] for idx in run).strip() for run in runs)
+        if selected[0] > 0:
+            text = self.GAP + text
+        if selected[-1] < len(sentences) - 1:
+            text = text + self.GAP
+        return text
+
+    def compress(
+        self,
+        query: str,
+        documents: List[Tuple[Document, float]]
+    ) -> List[Tuple[Document, float]]:
+        """压缩各片段的文本，分数与顺序不变；嵌入失败时原样返回"""
+        split = [
+            split_sentences(doc.page_content) if len(doc.page_content) >= self.min_chars else []
+            for doc, _ in documents
+        ]
+        offsets = np.cumsum([0] + [len(sentences) for sentences in split])
+        if offsets[-1] == 0:
+            return documents
+
+        all_sentences = [sentence.strip() or sentence for sentences in split for sentence in sentences]
+        try:
+            # 问题与全部句子一次调用嵌入服务
+            embeddings = np.asarray(self.embedding_service.embed_queries([query] + all_sentences), dtype=np.float32)
+        except Exception as e:
+            print(f"上下文压缩失败，使用原文: {e}")
+            return documents
+        embeddings = self._normalize_rows(embeddings)
+        scores = embeddings[1:] @ embeddings[0]
+
+        compressed = []
+        for idx, ((doc, score), sentences) in enumerate(zip(documents, split)):
+            if len(sentences) < 2:
+                compressed.append((doc, score))
+                continue
+            selected = self._select(sentences, scores[offsets[idx]:offsets[idx + 1]])
+            if len(selected) == len(sentences):
+                compressed.append((doc, score))
+                continue
+            text = self._join(sentences, selected)
+            metadata = {**doc.metadata, "compressed": True, "original_length": len(doc.page_content)}
+            compressed.append((Document(page_content=text, metadata=metadata), score))
+        return compressed
@@ -4,6 +4,7 @@ from typing import List, Optional
 from abc import ABC, abstractmethod
 from src.config.settings import get_settings
 from functools import lru_cache
+import asyncio
 
 settings = get_settings()
 
@@ -17,6 +18,19 @@ class BaseEmbeddings(ABC):
     def embed_query(self, text: str) -> List[float]:
         pass
 
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量向量化多个查询，一次调用服务；当前各服务的查询与文档使用同一编码方式"""
+        if not texts:
+            return []
+        return self.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步向量化；默认在线程中调用同步接口"""
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
 
 class OpenAIEmbeddingService(BaseEmbeddings):
     def __init__(self, model: Optional[str] = None):
@@ -32,6 +46,12 @@ class OpenAIEmbeddingService(BaseEmbeddings):
     def embed_query(self, text: str) -> List[float]:
         return self.embeddings.embed_query(text)
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
 
 class AlibabaEmbeddingService(BaseEmbeddings):
     def __init__(self, model: Optional[str] = None):
@@ -47,6 +67,12 @@ class AlibabaEmbeddingService(BaseEmbeddings):
     def embed_query(self, text: str) -> List[float]:
         return self.embeddings.embed_query(text)
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
 
 class LocalEmbeddingService(BaseEmbeddings):
     def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None):
@@ -63,6 +89,12 @@ class LocalEmbeddingService(BaseEmbeddings):
     def embed_query(self, text: str) -> List[float]:
         return self.embeddings.embed_query(text)
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
 
 class EmbeddingServiceFactory:
     @staticmethod
@@ -128,4 +160,22 @@ class CachedEmbeddingService(BaseEmbeddings):
             return cached
         embedding = self.base_service.embed_query(text)
         self.cache.set(text, embedding)
+        return embedding
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """未缓存的查询合并为一次调用"""
+        embeddings = [self.cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            for text, embedding in zip(missing, self.base_service.embed_queries(missing)):
+                self.cache.set(text, embedding)
+            embeddings = [self.cache.get(text) for text in texts]
+        return embeddings
+
+    async def aembed_query(self, text: str) -> List[float]:
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached
+        embedding = await self.base_service.aembed_query(text)
+        self.cache.set(text, embedding)
         return embedding
\ No newline at end of file
@@ -0,0 +1,270 @@
+from langchain_core.documents import Document
+from typing import List, Optional, Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from src.core.rag_engine import RAGEngine
+from src.config.settings import get_settings
+import math
+import time
+import asyncio
+import threading
+import contextvars
+from contextvars import ContextVar
+
+settings = get_settings()
+
+CALIBRATION_METHODS = ("auto", "none", "minmax", "zscore")
+
+# 联邦引擎在请求间共享，失败的知识库按请求上下文记录：(引擎, 失败的知识库ID)
+_last_failed: ContextVar[Optional[Tuple["FederatedRAGEngine", List[str]]]] = ContextVar("federated_last_failed", default=None)
+
+_federation_executor: Optional[ThreadPoolExecutor] = None
+_federation_executor_lock = threading.Lock()
+
+
+def get_federation_executor() -> ThreadPoolExecutor:
+    """同步联邦检索使用的线程池；各知识库的检索阶段仍提交到检索线程池，两者分开避免互相等待"""
+    global _federation_executor
+    if _federation_executor is None:
+        with _federation_executor_lock:
+            if _federation_executor is None:
+                _federation_executor = ThreadPoolExecutor(
+                    max_workers=settings.retrieval_workers,
+                    thread_name_prefix="federation"
+                )
+    return _federation_executor
+
+
+def calibrate_scores(scores: List[float], method: str = "zscore") -> List[float]:
+    """把一组候选分数校准到可与其他组比较的尺度
+
+    zscore 按该组候选的均值和标准差标准化后经sigmoid映射到0~1；minmax 线性拉伸到0~1；
+    none 直接使用原始分数。候选少于2个或分数无差异时无法估计分布，保留原始分数。
+    """
+    if method == "none" or len(scores) < 2:
+        return list(scores)
+    low, high = min(scores), max(scores)
+    if high - low < 1e-6:
+        return list(scores)
+    if method == "minmax":
+        return [(score - low) / (high - low) for score in scores]
+    mean = sum(scores) / len(scores)
+    std = math.sqrt(sum((score - mean) ** 2 for score in scores) / len(scores))
+    return [1.0 / (1.0 + math.exp(-(score - mean) / std)) for score in scores]
+
+
+class FederatedRAGEngine(RAGEngine):
+    """多知识库联邦检索与问答
+
+    各知识库的引擎并发检索候选（各自的查询扩展、召回、重排序和检索缓存照常生效），
+    分数校准后合并为一个top_k；整体超过截止时间仍未返回的知识库被放弃，不阻塞其他结果。
+    返回结果中score保留原始分数（阈值过滤与单库一致），排序使用校准分数，
+    元数据中带knowledge_base_id与calibrated_score。生成答案使用第一个知识库的大模型与提示词。
+    """
+
+    def __init__(
+        self,
+        engines: Dict[str, RAGEngine],
+        timeout: Optional[float] = None,
+        calibration: Optional[str] = None
+    ):
+        if not engines:
+            raise ValueError("联邦检索至少需要一个知识库")
+        primary = next(iter(engines.values()))
+        super().__init__(
+            vector_store=primary.vector_store,
+            llm=primary.llm,
+            embedding_service=primary.embedding_service,
+            system_prompt=primary.system_prompt,
+            db_manager=primary.db_manager,
+            use_hybrid_search=False,
+            use_rerank=False,
+            enable_caching=False,
+            query_expansion_mode="off",
+            use_semantic_cache=False,
+            source_resolver=primary.source_resolver
+        )
+        self.engines = engines
+        self.timeout = settings.federated_search_timeout if timeout is None else timeout
+        self.calibration = calibration or settings.federated_score_calibration
+        if self.calibration not in CALIBRATION_METHODS:
+            raise ValueError(f"不支持的分数校准方式: {self.calibration}")
+
+    @property
+    def last_failed(self) -> List[str]:
+        """当前请求中最近一次检索超时或失败的知识库"""
+        value = _last_failed.get()
+        return value[1] if value is not None and value[0] is self else []
+
+    @staticmethod
+    def _score_scale(engine: RAGEngine) -> Tuple[Any, ...]:
+        """决定分数尺度的检索配置：重排序分数只取决于重排序模型，向量/混合检索分数还取决于嵌入模型"""
+        if engine.use_rerank and engine.multi_path_retriever is not None:
+            return ("rerank",)
+        embedding = getattr(engine.embedding_service, "base_service", engine.embedding_service)
+        model = getattr(embedding, "model", None) or getattr(embedding, "model_name", None)
+        mode = "hybrid" if engine.use_hybrid_search and engine.hybrid_retriever is not None else "vector"
+        return mode, type(embedding).__name__, model
+
+    def _calibration_groups(self, kb_ids: List[str]) -> List[List[str]]:
+        """分数需要一起校准的知识库分组
+
+        auto：分数尺度相同的知识库原始分数直接可比，只有存在多种尺度时才按尺度分组做zscore；
+        其他方式每个知识库单独校准。
+        """
+        if self.calibration != "auto":
+            return [[kb_id] for kb_id in kb_ids]
+        groups: Dict[Tuple[Any, ...], List[str]] = {}
+        for kb_id in kb_ids:
+            groups.setdefault(self._score_scale(self.engines[kb_id]), []).append(kb_id)
+        return list(groups.values())
+
+    def _merge(
+        self,
+        candidates: Dict[str, List[Tuple[Document, float]]],
+        top_k: int
+    ) -> List[Tuple[Document, float]]:
+        """按校准分数合并各知识库的候选，取前top_k"""
+        groups = self._calibration_groups(list(candidates))
+        method = self.calibration
+        if method == "auto":
+            method = "zscore" if len(groups) > 1 else "none"
+
+        merged = []
+        for group in groups:
+            results = [(kb_id, doc, score) for kb_id in group for doc, score in candidates[kb_id]]
+            calibrated = calibrate_scores([score for _, _, score in results], method)
+            for (kb_id, doc, score), calibrated_score in zip(results, calibrated):
+                # 复制元数据，避免改动各知识库检索缓存中的对象
+                metadata = {**doc.metadata, "knowledge_base_id": kb_id, "calibrated_score": calibrated_score}
+                merged.append((calibrated_score, score, Document(page_content=doc.page_content, metadata=metadata)))
+        merged.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [(doc, score) for _, score, doc in merged[:top_k]]
+
+    def _report_failures(self, failed: List[str]):
+        _last_failed.set((self, failed))
+        if failed:
+            print(f"联邦检索中以下知识库超时或失败，已忽略: {', '.join(failed)}")
+
+    def retrieve_candidates(
+        self,
+        query: str,
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """各知识库并发检索后合并；联邦引擎不启用语义缓存，query_embedding只为与父类签名一致，各知识库自行嵌入查询"""
+        start_time = time.time()
+        executor = get_federation_executor()
+        futures = {
+            kb_id: executor.submit(contextvars.copy_context().run, engine.retrieve_candidates, query, top_k, filters)
+            for kb_id, engine in self.engines.items()
+        }
+        candidates = {
+            kb_id: result[0] for kb_id, result in self._collect(futures, self.timeout).items()
+        }
+        return self._merge(candidates, top_k), time.time() - start_time
+
+    def retrieve_candidates_batch(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[List[Tuple[Document, float]], float]]:
+        """各知识库分别批量检索后逐条合并；批量检索耗时更长，截止时间取BATCH_STAGE_TIMEOUT"""
+        start_time = time.time()
+        executor = get_federation_executor()
+        futures = {
+            kb_id: executor.submit(
+                contextvars.copy_context().run, engine.retrieve_candidates_batch, queries, top_k, filters
+            )
+            for kb_id, engine in self.engines.items()
+        }
+        batches = self._collect(futures, max(self.timeout, settings.batch_stage_timeout))
+        retrieval_time = time.time() - start_time
+        return [
+            (self._merge({kb_id: batch[idx][0] for kb_id, batch in batches.items()}, top_k), retrieval_time)
+            for idx in range(len(queries))
+        ]
+
+    def _collect(self, futures: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """等待各知识库的检索到截止时间，返回已成功完成的结果"""
+        futures_wait(list(futures.values()), timeout=timeout)
+
+        results, failed = {}, []
+        for kb_id, future in futures.items():
+            if not future.done():
+                # 超时的检索在线程池中继续执行完毕，结果被丢弃
+                future.cancel()
+                failed.append(kb_id)
+            elif future.exception() is not None:
+                print(f"知识库 {kb_id} 检索失败: {future.exception()}")
+                failed.append(kb_id)
+            else:
+                results[kb_id] = future.result()
+        self._report_failures(failed)
+        return results
+
+    async def aretrieve_candidates(
+        self,
+        query: str,
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        start_time = time.time()
+        tasks = {
+            kb_id: asyncio.ensure_future(engine.aretrieve_candidates(query, top_k, filters))
+            for kb_id, engine in self.engines.items()
+        }
+        await asyncio.wait(list(tasks.values()), timeout=self.timeout)
+
+        candidates, failed = {}, []
+        for kb_id, task in tasks.items():
+            if not task.done():
+                task.cancel()
+                failed.append(kb_id)
+            elif task.exception() is not None:
+                print(f"知识库 {kb_id} 检索失败: {task.exception()}")
+                failed.append(kb_id)
+            else:
+                candidates[kb_id] = task.result()[0]
+        self._report_failures(failed)
+        return self._merge(candidates, top_k), time.time() - start_time
+
+    def _group_sources(self, documents: List[Tuple[Document, float]]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for doc, _ in documents:
+            kb_id = doc.metadata.get("knowledge_base_id")
+            if kb_id in self.engines and self.engines[kb_id].source_resolver is not None:
+                groups.setdefault(kb_id, []).append(doc.metadata.get("source", ""))
+        return groups
+
+    def _build_sources(
+        self,
+        documents: List[Tuple[Document, float]],
+        resolved: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """来源信息由各知识库自己的来源映射解析"""
+        if resolved is None:
+            resolved = {}
+            for kb_id, paths in self._group_sources(documents).items():
+                resolved.update(self.engines[kb_id].source_resolver.resolve(paths))
+        return super()._build_sources(documents, resolved)
+
+    async def _abuild_sources(self, documents: List[Tuple[Document, float]]) -> List[Dict[str, Any]]:
+        groups = self._group_sources(documents)
+        parts = await asyncio.gather(*(
+            self.engines[kb_id].source_resolver.aresolve(paths) for kb_id, paths in groups.items()
+        ))
+        resolved = {}
+        for part in parts:
+            resolved.update(part)
+        return self._build_sources(documents, resolved)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "knowledge_bases": list(self.engines),
+            "calibration": self.calibration,
+            "timeout": self.timeout,
+            "last_failed": self.last_failed
+        }
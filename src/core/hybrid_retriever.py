@@ -1,139 +1,569 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set
 import math
 from collections import defaultdict
-import re
+from contextlib import nullcontext
+import heapq
+import threading
+import numpy as np
+from src.core.bm25_index import BM25Segment, CompiledBM25Segment, BM25IndexStorage
+from src.core.text_analyzer import BaseAnalyzer, AnalyzerFactory
 
 
 class BM25Retriever:
-    """BM25检索器"""
+    """BM25检索器
+
+    基于倒排索引实现：每个词项只保存包含它的文档及词频，查询时只遍历查询词的倒排表，
+    检索开销与知识库分块总数无关。基础段为紧凑的分块varint编码格式，持久化后直接
+    内存映射，单次查询按MaxScore剪枝，批量查询是一次稀疏矩阵乘法。
+
+    长度归一化使用基础段的平均文档长度（每次合并时刷新），IDF按当前存活文档实时计算：
+    文档频率 = 基础段编译时的文档频率 + 此后增删带来的增量（_df）。
+
+    索引支持增量维护：新增文档写入增量段，删除文档记录为墓碑（tombstone），
+    文档频率、文档数与总长度随之原地更新；当增量段或墓碑积累到阈值时在后台线程中
+    合并为新的基础段。持久化时只追加操作日志，单次上传的开销与其自身分块数成正比。
+
+    分词由可插拔的analyzer完成（默认中文二元组分词）。入库时可直接传入已保存的分词结果，
+    操作日志也记录分词结果，重建与回放都不会重新分词；删除时按索引中的词项扣减文档频率。
+
+    多个worker进程共享同一份索引文件时，写入前先回放其他进程追加的日志，操作序号由
+    存储层在进程间锁内统一分配；检索前检查序号文件和快照文件是否变化，变化时回放日志尾部，
+    其他进程合并出新快照时直接映射新快照。
+    """
     
     def __init__(
         self,
         k1: float = 1.5,
         b: float = 0.75,
-        epsilon: float = 0.25
+        epsilon: float = 0.25,
+        merge_min_docs: int = 1000,
+        merge_ratio: float = 0.1,
+        analyzer: Optional[BaseAnalyzer] = None
     ):
         self.k1 = k1
         self.b = b
         self.epsilon = epsilon
-        self.corpus = []
-        self.doc_freqs = []
-        self.idf = {}
-        self.doc_len = []
-        self.avg_doc_len = 0
+        self.merge_min_docs = merge_min_docs
+        self.merge_ratio = merge_ratio
+        self.analyzer = analyzer or AnalyzerFactory.create()
+        
+        self._base = CompiledBM25Segment.merged([], set(), k1, b)
+        self._frozen: Optional[BM25Segment] = None
+        self._delta = BM25Segment()
+        self._tombstones: Set[str] = set()
+        self._df: Dict[str, int] = defaultdict(int)
+        self._num_docs = 0
+        self._total_len = 0
+        
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._storage: Optional[BM25IndexStorage] = None
+        self._seq = 0
+        self._base_seq = 0
+        self._stamp = None
         self._initialized = False
     
-    def initialize(self, documents: List[str]):
-        """初始化BM25索引"""
-        self.corpus = documents
-        self.doc_len = [len(doc.split()) for doc in documents]
-        self.avg_doc_len = sum(self.doc_len) / len(documents) if self.doc_len else 0
-        
-        self.doc_freqs = []
-        for doc in documents:
-            freqs = defaultdict(int)
-            tokens = self._tokenize(doc)
-            for token in tokens:
-                freqs[token] += 1
-            self.doc_freqs.append(freqs)
-        
-        self._compute_idf()
-        self._initialized = True
+    def _segments(self) -> List[BM25Segment]:
+        return [segment for segment in (self._base, self._frozen, self._delta) if segment is not None]
+    
+    @property
+    def avg_doc_len(self) -> float:
+        return self._total_len / self._num_docs if self._num_docs else 0
+    
+    def initialize(
+        self,
+        documents: List[str],
+        doc_ids: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        tokens: Optional[List[Optional[List[str]]]] = None
+    ):
+        """全量初始化BM25索引
+
+        tokens为入库时保存的分词结果，缺失（None）的文档才现场分词。
+        """
+        doc_ids = list(doc_ids) if doc_ids is not None else [str(idx) for idx in range(len(documents))]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in documents]
+        tokens = list(tokens) if tokens is not None else [None] * len(documents)
+        
+        segment = BM25Segment()
+        for doc_id, content, metadata, doc_tokens in zip(doc_ids, documents, metadatas, tokens):
+            if doc_tokens is None:
+                doc_tokens = self._tokenize(content)
+            segment.add(doc_id, content, metadata, doc_tokens)
+        base = CompiledBM25Segment.merged([segment], set(), self.k1, self.b)
+        
+        with self._lock:
+            self._base = base
+            self._frozen = None
+            self._delta = BM25Segment()
+            self._tombstones = set()
+            self._recompute_stats()
+            self._initialized = True
+    
+    def _recompute_stats(self):
+        """重新统计文档数、总长度与相对基础段的文档频率增量，开销与增量段和墓碑数成正比"""
+        self._df = defaultdict(int)
+        base = self._base
+        dead = np.flatnonzero(~base.alive)
+        self._num_docs = len(base) - len(dead)
+        self._total_len = base.total_len - int(base.doc_len[dead].sum())
+        for idx in dead:
+            for token in base.terms_of(int(idx)):
+                self._df[token] -= 1
+        for segment in (self._frozen, self._delta):
+            if segment is None:
+                continue
+            for token, postings in segment.postings.items():
+                self._df[token] += sum(1 for idx in postings if segment.is_alive(idx))
+            for idx, length in enumerate(segment.doc_len):
+                if segment.is_alive(idx):
+                    self._num_docs += 1
+                    self._total_len += length
     
     def _tokenize(self, text: str) -> List[str]:
         """分词"""
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
-        return text.split()
+        return self.analyzer.analyze(text)
+    
+    def _doc_freq(self, token: str) -> int:
+        return self._base.doc_freq(token) + self._df.get(token, 0)
+    
+    def _idf(self, tokens: List[str]) -> Dict[str, float]:
+        """按当前存活文档统计计算IDF"""
+        n_docs = self._num_docs
+        idf = {}
+        for token in set(tokens):
+            df = self._doc_freq(token)
+            if df > 0:
+                idf[token] = math.log((n_docs - df + 0.5) / (df + 0.5) + 1.0)
+        return idf
+    
+    def _query_weights(self, tokens: List[str]) -> Dict[str, float]:
+        """查询向量：词项 -> IDF × 查询中出现次数"""
+        idf = self._idf(tokens)
+        weights: Dict[str, float] = defaultdict(float)
+        for token in tokens:
+            if token in idf:
+                weights[token] += idf[token]
+        return dict(weights)
+    
+    def _norm_avg_doc_len(self) -> float:
+        # 防止除零错误
+        return self._base.avg_doc_len or self.avg_doc_len or 1.0
+    
+    def __len__(self) -> int:
+        return self._num_docs
+    
+    def _locate(self, doc_id: str):
+        for segment in self._segments():
+            idx = segment.key_index.get(doc_id)
+            if idx is not None:
+                return segment, idx
+        return None, None
+    
+    def add_documents(
+        self,
+        documents: List[str],
+        doc_ids: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        tokens: Optional[List[Optional[List[str]]]] = None
+    ):
+        """增量添加文档：写入增量段并更新文档频率与平均长度
+
+        doc_ids需全局唯一（入库时的vector_id），已存在或已删除的key会被跳过，
+        因此重复回放同一批操作是幂等的。tokens为入库时已计算的分词结果。
+        """
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in documents]
+        tokens = list(tokens) if tokens is not None else [None] * len(documents)
+        with self._lock, self._shared():
+            self._catch_up_locked()
+            added = self._add_locked(documents, doc_ids, metadatas, tokens)
+            if added:
+                self._log({'op': 'add', 'docs': added})
+        self.maybe_merge()
+    
+    def _add_locked(
+        self,
+        documents: List[str],
+        doc_ids: List[str],
+        metadatas: List[Dict[str, Any]],
+        tokens: List[Optional[List[str]]]
+    ) -> List[Dict[str, Any]]:
+        added = []
+        for doc_id, content, metadata, doc_tokens in zip(doc_ids, documents, metadatas, tokens):
+            if doc_id in self._tombstones or self._locate(doc_id)[0] is not None:
+                continue
+            if doc_tokens is None:
+                doc_tokens = self._tokenize(content)
+            idx = self._delta.add(doc_id, content, metadata, doc_tokens)
+            for token in self._delta.terms_of(idx):
+                self._df[token] += 1
+                if self._df[token] == 0:
+                    del self._df[token]
+            self._num_docs += 1
+            self._total_len += len(doc_tokens)
+            added.append({'id': doc_id, 'content': content, 'metadata': metadata, 'tokens': doc_tokens})
+        self._initialized = True
+        return added
+    
+    def remove_documents(self, doc_ids: List[str]):
+        """删除文档：记录墓碑并扣减文档频率，倒排表在后台合并时清理"""
+        with self._lock, self._shared():
+            self._catch_up_locked()
+            removed = self._remove_locked(doc_ids)
+            if removed:
+                self._log({'op': 'delete', 'ids': removed})
+        if removed:
+            self.maybe_merge()
+    
+    def _remove_locked(self, doc_ids: List[str]) -> List[str]:
+        removed = []
+        for doc_id in doc_ids:
+            if doc_id in self._tombstones:
+                continue
+            segment, idx = self._locate(doc_id)
+            if segment is None:
+                continue
+            for token in segment.terms_of(idx):
+                self._df[token] -= 1
+                if self._df[token] == 0:
+                    del self._df[token]
+            self._num_docs -= 1
+            self._total_len -= int(segment.doc_len[idx])
+            segment.kill(idx)
+            self._tombstones.add(doc_id)
+            removed.append(doc_id)
+        return removed
+    
+    def _shared(self):
+        """进程间锁；未持久化时为空操作。加锁顺序总是先self._lock后文件锁"""
+        return self._storage.locked() if self._storage is not None else nullcontext()
+    
+    def _log(self, op: Dict[str, Any]):
+        """记录一条已应用的操作（需持有self._lock与进程间锁）"""
+        if self._storage is None:
+            self._seq += 1
+            return
+        self._seq = self._storage.next_seq()
+        self._storage.append({'seq': self._seq, **op})
+        self._stamp = self._storage.stamp()
+    
+    def _apply_op(self, op: Dict[str, Any]):
+        if op['op'] == 'add':
+            self._add_locked(
+                [doc['content'] for doc in op['docs']],
+                [doc['id'] for doc in op['docs']],
+                [doc['metadata'] for doc in op['docs']],
+                [doc.get('tokens') for doc in op['docs']]
+            )
+        elif op['op'] == 'delete':
+            self._remove_locked(op['ids'])
+        self._seq = op['seq']
+    
+    def _reset_to_snapshot_locked(self, params: Dict[str, Any], base: CompiledBM25Segment):
+        self._base = base
+        self._frozen = None
+        self._delta = BM25Segment()
+        self._tombstones = set()
+        self._seq = self._base_seq = params['seq']
+        self._recompute_stats()
+        self._initialized = True
+    
+    def _catch_up_locked(self):
+        """回放其他进程写入而本进程尚未应用的操作（需持有self._lock与进程间锁）
+
+        其他进程合并出更新的快照时（其日志已删除），先映射新快照再回放其后的日志。
+        """
+        storage = self._storage
+        if storage is None:
+            return
+        header = storage.read_header()
+        if header is not None and header['seq'] > self._base_seq and self._frozen is None:
+            snapshot = storage.read_snapshot()
+            if snapshot is not None and snapshot[0].get('analyzer') == self.analyzer.signature:
+                self._reset_to_snapshot_locked(*snapshot)
+        for op in storage.read_ops(after_seq=self._seq):
+            self._apply_op(op)
+        self._stamp = storage.stamp()
+    
+    def refresh(self):
+        """其他进程写入过索引文件时回放日志尾部；文件未变化时只有两次stat"""
+        storage = self._storage
+        if storage is None or storage.stamp() == self._stamp:
+            return
+        with self._lock, self._shared():
+            self._catch_up_locked()
+    
+    def needs_merge(self) -> bool:
+        threshold = max(self.merge_min_docs, int(self._num_docs * self.merge_ratio))
+        return len(self._delta) >= threshold or len(self._tombstones) >= threshold
+    
+    def maybe_merge(self):
+        """增量段或墓碑超过阈值时启动后台合并"""
+        with self._lock:
+            if not self.needs_merge() or (self._merge_thread and self._merge_thread.is_alive()):
+                return
+            self._merge_thread = threading.Thread(target=self.merge, daemon=True)
+            self._merge_thread.start()
+    
+    def merge(self):
+        """把基础段与增量段合并为新的基础段，并清除墓碑文档
+
+        重写段的工作在锁外进行，期间检索和增删照常；新的增删写入新的增量段。
+        多进程共享索引时只有取得合并锁的进程合并，其他进程随后映射其快照。
+        """
+        storage = self._storage
+        with (storage.merge_lock() if storage is not None else nullcontext(True)) as acquired:
+            if acquired:
+                self._merge()
     
-    def _compute_idf(self):
-        """计算IDF"""
-        df = defaultdict(int)
-        for freqs in self.doc_freqs:
-            for token in freqs:
-                df[token] += 1
+    def _merge(self):
+        storage = self._storage
+        with self._lock, self._shared():
+            if self._frozen is not None:
+                return
+            # 先跟上其他进程的操作（可能直接换成其他进程刚合并出的快照），快照序号即共享的最新序号
+            self._catch_up_locked()
+            base, frozen = self._base, self._delta
+            self._frozen = frozen
+            self._delta = BM25Segment()
+            dead = set(self._tombstones)
+            merge_seq = self._seq
+            if storage is not None:
+                storage.rotate_log()
         
-        n_docs = len(self.corpus)
-        for token, freq in df.items():
-            self.idf[token] = math.log((n_docs - freq + 0.5) / (freq + 0.5) + 1.0)
+        tmp_path = None
+        try:
+            new_base = CompiledBM25Segment.merged([base, frozen], dead, self.k1, self.b)
+            if storage is not None:
+                tmp_path = storage.prepare_snapshot(self._params(), new_base, merge_seq)
+        except Exception:
+            with self._lock:
+                # 合并失败时把冻结段并回增量段，墓碑保持不变
+                frozen.extend(self._delta)
+                self._delta = frozen
+                self._frozen = None
+            raise
+        
+        with self._lock, self._shared():
+            if tmp_path is not None:
+                # 替换快照与删除已合并的日志在同一把进程间锁内完成，其他进程不会读到二者之间的状态
+                new_base = storage.commit_snapshot(tmp_path, new_base)
+                storage.finish_merge()
+                self._base_seq = merge_seq
+                self._stamp = storage.stamp()
+            # 合并期间被删除的基础段文档需要在新段中同样标记
+            for doc_id in self._tombstones - dead:
+                idx = new_base.key_index.get(doc_id)
+                if idx is not None:
+                    new_base.kill(idx)
+            self._base = new_base
+            self._frozen = None
+            self._tombstones -= dead
+            self._recompute_stats()
+    
+    def _params(self) -> Dict[str, Any]:
+        return {'k1': self.k1, 'b': self.b, 'epsilon': self.epsilon, 'analyzer': self.analyzer.signature}
+    
+    def wait_for_merge(self, timeout: Optional[float] = None):
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join(timeout)
     
     def search(
         self,
         query: str,
         top_k: int = 10,
-        min_score: float = 0.0
+        min_score: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """BM25检索"""
+        self.refresh()
         if not self._initialized:
             return []
         
         query_tokens = self._tokenize(query)
-        scores = []
-        
-        for idx, freqs in enumerate(self.doc_freqs):
-            score = 0.0
-            doc_len = self.doc_len[idx]
-            
-            for token in query_tokens:
-                if token in freqs:
-                    tf = freqs[token]
-                    idf = self.idf.get(token, 0)
-                    numerator = tf * (self.k1 + 1)
-                    # 防止除零错误
-                    avg_doc_len_safe = self.avg_doc_len if self.avg_doc_len != 0 else 1.0
-                    denominator = tf + self.k1 * (1 - self.b + self.b * doc_len / avg_doc_len_safe)
-                    score += idf * (numerator / denominator)
-            
-            if score >= min_score:
-                scores.append({
-                    'index': idx,
-                    'score': score,
-                    'content': self.corpus[idx]
-                })
+        with self._lock:
+            query_weights = self._query_weights(query_tokens)
+            avg_doc_len = self._norm_avg_doc_len()
+            base = self._base
+            candidates = [
+                (score, rank, segment, idx)
+                for rank, segment in ((1, self._frozen), (2, self._delta)) if segment is not None
+                for score, idx in segment.top_k(query_weights, top_k, self.k1, self.b, avg_doc_len, min_score, filters)
+            ]
         
-        scores.sort(key=lambda x: x['score'], reverse=True)
-        return scores[:top_k]
+        # 基础段不可变，在锁外做向量化打分
+        candidates.extend(
+            (score, 0, base, idx) for score, idx in base.top_k(query_weights, top_k, min_score, filters)
+        )
+        return self._format_results(candidates, top_k)
+    
+    @staticmethod
+    def _format_results(candidates, top_k: int) -> List[Dict[str, Any]]:
+        # 同分按入库顺序（基础段、冻结段、增量段，段内按下标）排序，与合并后的基础段结果一致
+        top = heapq.nsmallest(top_k, candidates, key=lambda item: (-item[0], item[1], item[3]))
+        return [
+            {
+                'index': idx,
+                'key': segment.doc_ids[idx],
+                'score': score,
+                'content': segment.corpus[idx],
+                'metadata': segment.metadatas[idx]
+            }
+            for score, _, segment, idx in top
+        ]
     
     def batch_search(
         self,
         queries: List[str],
-        top_k: int = 10
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None
     ) -> List[List[Dict[str, Any]]]:
-        """批量检索"""
-        return [self.search(query, top_k) for query in queries]
+        """批量检索：基础段对所有查询做一次稀疏矩阵乘法"""
+        self.refresh()
+        if not self._initialized or not queries:
+            return [[] for _ in queries]
+        
+        tokenized = [self._tokenize(query) for query in queries]
+        with self._lock:
+            batch_weights = [self._query_weights(tokens) for tokens in tokenized]
+            avg_doc_len = self._norm_avg_doc_len()
+            base = self._base
+            batch_candidates = [
+                [
+                    (score, rank, segment, idx)
+                    for rank, segment in ((1, self._frozen), (2, self._delta)) if segment is not None
+                    for score, idx in segment.top_k(query_weights, top_k, self.k1, self.b, avg_doc_len, 0.0, filters)
+                ]
+                for query_weights in batch_weights
+            ]
+        
+        for candidates, base_top in zip(batch_candidates, base.batch_top_k(batch_weights, top_k, filters=filters)):
+            candidates.extend((score, 0, base, idx) for score, idx in base_top)
+        return [self._format_results(candidates, top_k) for candidates in batch_candidates]
+    
+    def save(self, path: str):
+        """把当前全部内容写成新快照，并清空操作日志"""
+        storage = BM25IndexStorage(path)
+        with self._lock, storage.locked():
+            # 快照沿用共享序号，其他进程据此发现新快照并重新映射
+            seq = max(self._seq, storage.current_seq())
+            base = CompiledBM25Segment.merged(self._segments(), self._tombstones, self.k1, self.b)
+            base = storage.write_snapshot(self._params(), base, seq)
+            storage.clear_logs()
+            storage.write_seq(seq)
+            self._base = base
+            self._frozen = None
+            self._delta = BM25Segment()
+            self._tombstones = set()
+            self._storage = storage
+            self._seq = self._base_seq = seq
+            self._stamp = storage.stamp()
+            self._recompute_stats()
+    
+    @classmethod
+    def load(cls, path: str, analyzer: Optional[BaseAnalyzer] = None) -> Optional["BM25Retriever"]:
+        """加载快照并回放操作日志
+
+        文件不存在、格式不兼容或分词配置与快照不一致时返回None，由调用方重建。
+        """
+        analyzer = analyzer or AnalyzerFactory.create()
+        storage = BM25IndexStorage(path)
+        with storage.locked():
+            snapshot = storage.read_snapshot()
+            if snapshot is None:
+                return None
+            params, base = snapshot
+            if params.get('analyzer') != analyzer.signature:
+                return None
+            
+            retriever = cls(k1=params['k1'], b=params['b'], epsilon=params['epsilon'], analyzer=analyzer)
+            retriever._reset_to_snapshot_locked(params, base)
+            for op in storage.read_ops(after_seq=params['seq']):
+                retriever._apply_op(op)
+            retriever._storage = storage
+            retriever._stamp = storage.stamp()
+        
+        retriever.maybe_merge()
+        return retriever
+    
+    @staticmethod
+    def remove_files(path: str):
+        BM25IndexStorage(path).remove()
 
 
 class HybridRetriever:
-    """混合检索器（BM25 + 向量检索）"""
+    """混合检索器（BM25 + 向量检索）
+
+    BM25召回基于知识库全量分块的倒排索引，与向量召回结果按分块key（vector_id）融合。
+    """
     
     def __init__(
         self,
         bm25_weight: float = 0.3,
         vector_weight: float = 0.7,
-        normalize_scores: bool = True
+        normalize_scores: bool = True,
+        bm25_retriever: Optional[BM25Retriever] = None
     ):
         self.bm25_weight = bm25_weight
         self.vector_weight = vector_weight
         self.normalize_scores = normalize_scores
-        self.bm25_retriever = BM25Retriever()
-        self._bm25_initialized = False
+        self.bm25_retriever = bm25_retriever or BM25Retriever()
+    
+    @property
+    def _bm25_initialized(self) -> bool:
+        return self.bm25_retriever._initialized
     
-    def initialize_bm25(self, documents: List[str]):
+    def initialize_bm25(
+        self,
+        documents: List[str],
+        doc_ids: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        tokens: Optional[List[Optional[List[str]]]] = None
+    ):
         """初始化BM25"""
-        self.bm25_retriever.initialize(documents)
-        self._bm25_initialized = True
+        self.bm25_retriever.initialize(documents, doc_ids, metadatas, tokens)
+    
+    def set_bm25_retriever(self, bm25_retriever: BM25Retriever):
+        """替换BM25索引（如知识库索引重建后）"""
+        self.bm25_retriever = bm25_retriever
+    
+    def bm25_search(
+        self,
+        query: str,
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """单独执行BM25召回，可与向量检索并发"""
+        if not self._bm25_initialized:
+            return []
+        return self.bm25_retriever.search(query, top_k=top_k, filters=filters)
+    
+    def batch_bm25_search(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """多查询BM25召回，基础段一次稀疏矩阵乘法完成打分"""
+        if not self._bm25_initialized:
+            return [[] for _ in queries]
+        return self.bm25_retriever.batch_search(queries, top_k=top_k, filters=filters)
     
     def hybrid_search(
         self,
         query: str,
         vector_results: List[Dict[str, Any]],
-        top_k: int = 10
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        bm25_results: Optional[List[Dict[str, Any]]] = None
     ) -> List[Dict[str, Any]]:
-        """混合检索"""
-        if not self._bm25_initialized:
-            return vector_results[:top_k]
-        
-        bm25_results = self.bm25_retriever.search(query, top_k=top_k * 2)
+        """混合检索
+
+        bm25_results为已经并发完成的BM25召回结果（top_k * 2），为None时在此处检索。
+        """
+        if bm25_results is None:
+            bm25_results = self.bm25_search(query, top_k=top_k * 2, filters=filters)
         
         if not bm25_results:
             return vector_results[:top_k]
@@ -149,6 +579,10 @@ class HybridRetriever:
         
         return fused_results
     
+    @staticmethod
+    def _result_key(result: Dict[str, Any]):
+        return result.get('key', result['index'])
+    
     def _fuse_results(
         self,
         bm25_results: List[Dict[str, Any]],
@@ -158,11 +592,15 @@ class HybridRetriever:
         """融合BM25和向量检索结果"""
         fused = {}
         
-        bm25_scores = {r['index']: r['score'] for r in bm25_results}
-        vector_scores = {r['index']: r['score'] for r in vector_results}
+        bm25_by_key = {self._result_key(r): r for r in bm25_results}
+        vector_by_key = {self._result_key(r): r for r in vector_results}
+        bm25_scores = {key: r['score'] for key, r in bm25_by_key.items()}
+        vector_scores = {key: r['score'] for key, r in vector_by_key.items()}
         
-        all_indices = set(bm25_scores.keys()) | set(vector_scores.keys())
+        all_keys = set(bm25_scores.keys()) | set(vector_scores.keys())
         
+        max_bm25 = 1.0
+        max_vector = 1.0
         if self.normalize_scores:
             max_bm25 = max(bm25_scores.values()) if bm25_scores else 1.0
             max_vector = max(vector_scores.values()) if vector_scores else 1.0
@@ -172,26 +610,19 @@ class HybridRetriever:
                 max_bm25 = 1.0
             if max_vector == 0:
                 max_vector = 1.0
-            
-            for idx in all_indices:
-                bm25_score = bm25_scores.get(idx, 0) / max_bm25
-                vector_score = vector_scores.get(idx, 0) / max_vector
-                fused[idx] = {
-                    'index': idx,
-                    'score': self.bm25_weight * bm25_score + self.vector_weight * vector_score,
-                    'bm25_score': bm25_score,
-                    'vector_score': vector_score
-                }
-        else:
-            for idx in all_indices:
-                bm25_score = bm25_scores.get(idx, 0)
-                vector_score = vector_scores.get(idx, 0)
-                fused[idx] = {
-                    'index': idx,
-                    'score': self.bm25_weight * bm25_score + self.vector_weight * vector_score,
-                    'bm25_score': bm25_score,
-                    'vector_score': vector_score
-                }
+        
+        for key in all_keys:
+            bm25_score = bm25_scores.get(key, 0) / max_bm25
+            vector_score = vector_scores.get(key, 0) / max_vector
+            # 优先保留向量侧结果（带原始Document），否则使用BM25索引中的内容与元数据
+            source = vector_by_key.get(key) or bm25_by_key[key]
+            fused[key] = {
+                **source,
+                'key': key,
+                'score': self.bm25_weight * bm25_score + self.vector_weight * vector_score,
+                'bm25_score': bm25_score,
+                'vector_score': vector_score
+            }
         
         sorted_results = sorted(fused.values(), key=lambda x: x['score'], reverse=True)
-        return sorted_results[:top_k]
\ No newline at end of file
+        return sorted_results[:top_k]
@@ -3,9 +3,11 @@ from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_core.outputs import ChatGeneration, ChatResult
 from langchain_core.callbacks import CallbackManagerForLLMRun
-from typing import List, Optional, Dict, Any, Iterator
+from typing import List, Optional, Dict, Any, Iterator, AsyncIterator, Callable
 from abc import ABC, abstractmethod
 from src.config.settings import get_settings
+import asyncio
+import threading
 import dashscope
 import zhipuai
 import erniebot
@@ -13,6 +15,37 @@ import erniebot
 settings = get_settings()
 
 
+async def iterate_in_thread(iterator_factory: Callable[[], Iterator[Any]]) -> AsyncIterator[Any]:
+    """在线程中迭代同步迭代器，通过队列逐项转发给事件循环；调用方提前结束时通知线程停止"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator_factory():
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (None, e))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+
+
 class BaseLLM(ABC):
     @abstractmethod
     def generate(self, messages: List[BaseMessage], **kwargs) -> str:
@@ -22,6 +55,15 @@ class BaseLLM(ABC):
     def stream(self, messages: List[BaseMessage], **kwargs) -> Iterator[str]:
         pass
 
+    async def agenerate(self, messages: List[BaseMessage], **kwargs) -> str:
+        """异步生成；SDK没有异步客户端时在线程中调用同步接口，不阻塞事件循环"""
+        return await asyncio.to_thread(self.generate, messages, **kwargs)
+
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[str]:
+        """异步流式生成；默认在线程中迭代同步流式接口"""
+        async for chunk in iterate_in_thread(lambda: self.stream(messages, **kwargs)):
+            yield chunk
+
 
 class OpenAILLM(BaseLLM):
     def __init__(
@@ -54,6 +96,14 @@ class OpenAILLM(BaseLLM):
         for chunk in self.llm.stream(messages, **kwargs):
             yield chunk.content
 
+    async def agenerate(self, messages: List[BaseMessage], **kwargs) -> str:
+        response = await self.llm.ainvoke(messages, **kwargs)
+        return response.content
+
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[str]:
+        async for chunk in self.llm.astream(messages, **kwargs):
+            yield chunk.content
+
 
 class AlibabaLLM(BaseLLM):
     def __init__(
@@ -259,6 +309,36 @@ class ErnieLLM(BaseLLM):
             if chunk and 'result' in chunk:
                 yield chunk['result']
 
+    async def agenerate(self, messages: List[BaseMessage], **kwargs) -> str:
+        ernie_messages = self._convert_messages(messages)
+        response = await erniebot.ChatCompletion.acreate(
+            model=self.model,
+            messages=ernie_messages,
+            temperature=self.temperature,
+            max_output_tokens=self.max_tokens,
+            **kwargs
+        )
+        
+        if response and 'result' in response:
+            return response['result']
+        else:
+            raise Exception(f"Failed to call ErnieBot LLM: {response}")
+
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[str]:
+        ernie_messages = self._convert_messages(messages)
+        response = await erniebot.ChatCompletion.acreate(
+            model=self.model,
+            messages=ernie_messages,
+            temperature=self.temperature,
+            max_output_tokens=self.max_tokens,
+            stream=True,
+            **kwargs
+        )
+        
+        async for chunk in response:
+            if chunk and 'result' in chunk:
+                yield chunk['result']
+
 
 class LLMFactory:
     @staticmethod
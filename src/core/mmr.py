@@ -0,0 +1,46 @@
+from typing import List, Sequence
+import numpy as np
+
+
+def mmr_select(
+    query_embedding: Sequence[float],
+    candidate_embeddings: Sequence[Sequence[float]],
+    k: int,
+    lambda_mult: float = 0.7
+) -> List[int]:
+    """最大边际相关性（MMR）选择，返回选中候选的下标（按选中顺序）
+
+    相关性与候选两两之间的相似度各用一次矩阵乘法算出；之后每轮只需按已选集合更新
+    每个候选与其最大相似度（一次向量取max），几十到上百个候选时耗时在微秒级。
+    lambda_mult越大越偏向相关性，越小越偏向多样性。
+    """
+    vectors = np.asarray(candidate_embeddings, dtype=np.float32)
+    if k <= 0 or vectors.ndim != 2 or len(vectors) == 0:
+        return []
+    if k >= len(vectors):
+        return list(range(len(vectors)))
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    query_norm = np.linalg.norm(query)
+    if query_norm > 0:
+        query = query / query_norm
+
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_similarity = similarity[first].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[first] = False
+    for _ in range(k - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(max_similarity, similarity[idx], out=max_similarity)
+    return selected
@@ -0,0 +1,201 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+from typing import Optional, Dict, Any, Tuple, Set
+from collections import OrderedDict
+from concurrent.futures import Future, Executor, TimeoutError as FutureTimeoutError
+from src.core.llm import BaseLLM
+from src.core.text_analyzer import normalize_text
+import asyncio
+import threading
+import time
+
+
+EXPANSION_MODES = ("sync", "speculative", "off")
+
+
+class QueryExpander:
+    """LLM查询扩展
+
+    扩展结果按规范化后的查询缓存（TTL + 容量上限，LRU淘汰）；相同查询的并发扩展只发起一次LLM调用，
+    其余调用方等待同一结果。扩展失败不缓存，调用方退回原始查询。
+    """
+
+    SYSTEM_PROMPT = "你是一个查询扩展助手。请根据原始查询生成相关的关键词和同义词，用逗号分隔。只返回关键词，不要其他内容。"
+
+    def __init__(self, llm: BaseLLM, cache_size: int = 1024, ttl: int = 3600):
+        self.llm = llm
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "failures": 0}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """全角转半角、小写并合并空白"""
+        return " ".join(normalize_text(query).split())
+
+    def _messages(self, query: str):
+        return [
+            SystemMessage(content=self.SYSTEM_PROMPT),
+            HumanMessage(content=f"查询: {query}")
+        ]
+
+    @staticmethod
+    def _combine(query: str, terms: Optional[str]) -> str:
+        if not terms:
+            return query
+        return f"{query} {terms}".strip()
+
+    def _lookup_locked(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        terms, expires_at = entry
+        if expires_at <= time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return terms
+
+    def _begin(self, key: str) -> Tuple[Optional[str], Optional[Future], bool]:
+        """返回 (缓存的扩展词, 等待的Future, 是否由当前调用方执行扩展)"""
+        with self._lock:
+            terms = self._lookup_locked(key)
+            if terms is not None:
+                self.stats["hits"] += 1
+                return terms, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return None, future, False
+            future = Future()
+            self._inflight[key] = future
+            self.stats["misses"] += 1
+            return None, future, True
+
+    def _finish(self, key: str, future: Future, terms: Optional[str]):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if terms is not None:
+                self._cache[key] = (terms, time.time() + self.ttl)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self.stats["failures"] += 1
+        future.set_result(terms)
+
+    def _generate(self, query: str) -> Optional[str]:
+        try:
+            return self.llm.generate(self._messages(query), temperature=0.3, max_tokens=100)
+        except Exception as e:
+            print(f"Query expansion failed: {e}")
+            return None
+
+    async def _agenerate(self, query: str) -> Optional[str]:
+        try:
+            return await self.llm.agenerate(self._messages(query), temperature=0.3, max_tokens=100)
+        except Exception as e:
+            print(f"Query expansion failed: {e}")
+            return None
+
+    def get_cached(self, query: str) -> Optional[str]:
+        """仅查缓存，命中时返回扩展后的查询"""
+        with self._lock:
+            terms = self._lookup_locked(self.normalize(query))
+        return self._combine(query, terms) if terms is not None else None
+
+    def expand(self, query: str) -> str:
+        key = self.normalize(query)
+        terms, future, is_leader = self._begin(key)
+        if future is None:
+            return self._combine(query, terms)
+        if is_leader:
+            terms = self._generate(query)
+            self._finish(key, future, terms)
+        else:
+            terms = future.result()
+        return self._combine(query, terms)
+
+    async def aexpand(self, query: str) -> str:
+        key = self.normalize(query)
+        terms, future, is_leader = self._begin(key)
+        if future is None:
+            return self._combine(query, terms)
+        if is_leader:
+            try:
+                terms = await self._agenerate(query)
+            finally:
+                # 被取消时也要释放in-flight占位，避免其他调用方一直等待
+                self._finish(key, future, terms)
+        else:
+            terms = await asyncio.wrap_future(future)
+        return self._combine(query, terms)
+
+    def prefetch(self, query: str, executor: Executor) -> Optional[str]:
+        """推测式扩展：缓存命中时直接返回扩展后的查询，否则在后台发起扩展并返回None"""
+        key = self.normalize(query)
+        terms, future, is_leader = self._begin(key)
+        if future is None:
+            return self._combine(query, terms)
+        if is_leader:
+            def run():
+                self._finish(key, future, self._generate(query))
+            try:
+                executor.submit(run)
+            except Exception:
+                self._finish(key, future, None)
+        return None
+
+    def aprefetch(self, query: str) -> Optional[str]:
+        """prefetch的异步版本，后台扩展作为事件循环上的任务执行"""
+        key = self.normalize(query)
+        terms, future, is_leader = self._begin(key)
+        if future is None:
+            return self._combine(query, terms)
+        if is_leader:
+            async def run():
+                terms = None
+                try:
+                    terms = await self._agenerate(query)
+                finally:
+                    self._finish(key, future, terms)
+            task = asyncio.get_running_loop().create_task(run())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+
+    def _pending(self, query: str) -> Tuple[Optional[str], Optional[Future]]:
+        key = self.normalize(query)
+        with self._lock:
+            return self._lookup_locked(key), self._inflight.get(key)
+
+    def wait(self, query: str, timeout: float) -> Optional[str]:
+        """等待进行中的扩展（推测式扩展的同一请求使用），返回扩展后的查询；超时或扩展失败返回None"""
+        terms, future = self._pending(query)
+        if terms is None and future is not None:
+            try:
+                terms = future.result(timeout=max(0.0, timeout))
+            except FutureTimeoutError:
+                return None
+        return self._combine(query, terms) if terms else None
+
+    async def await_expansion(self, query: str, timeout: float) -> Optional[str]:
+        """wait的异步版本；超时不取消后台扩展，结果照常写入缓存"""
+        terms, future = self._pending(query)
+        if terms is None and future is not None:
+            try:
+                terms = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                return None
+        return self._combine(query, terms) if terms else None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "size": len(self._cache), "inflight": len(self._inflight)}
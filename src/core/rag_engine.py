@@ -1,19 +1,49 @@
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
-from typing import List, Optional, Dict, Any, Tuple, Iterator
+from typing import List, Optional, Dict, Any, Tuple, Iterator, AsyncIterator, Awaitable, Callable
 from src.core.vector_store import BaseVectorStore
 from src.core.llm import BaseLLM
 from src.core.embeddings import BaseEmbeddings
-from src.core.hybrid_retriever import HybridRetriever
-from src.core.reranker import MultiPathRetriever, RerankerFactory, QueryRewriter
+from src.core.hybrid_retriever import HybridRetriever, BM25Retriever
+from src.core.reranker import MultiPathRetriever, RerankerFactory, QueryRewriter, get_batching_reranker
+from src.core.rerank_cache import get_rerank_score_cache
+from src.core.query_expansion import QueryExpander, EXPANSION_MODES
+from src.core.cache import BaseCache, MemoryCache, get_kb_version
+from src.core.semantic_cache import SemanticAnswerCache, get_answer_version
+from src.core.context_builder import ContextBuilder
+from src.core.context_compressor import ContextCompressor
+from src.core.source_metadata import SourceMetadataResolver
+from src.core.chunk_neighbors import ChunkNeighborExpander
+from src.core.mmr import mmr_select
+from src.core.tracing import stage, timed_stream, atimed_stream
 from src.config.settings import get_settings
 import time
+import asyncio
 import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from functools import lru_cache
 
 settings = get_settings()
 
+_retrieval_executor: Optional[ThreadPoolExecutor] = None
+_retrieval_executor_lock = threading.Lock()
+
+
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    """检索阶段共用的线程池（进程内所有知识库共享）"""
+    global _retrieval_executor
+    if _retrieval_executor is None:
+        with _retrieval_executor_lock:
+            if _retrieval_executor is None:
+                _retrieval_executor = ThreadPoolExecutor(
+                    max_workers=settings.retrieval_workers,
+                    thread_name_prefix="retrieval"
+                )
+    return _retrieval_executor
+
 
 class RAGEngine:
     def __init__(
@@ -28,7 +58,16 @@ class RAGEngine:
         use_query_rewrite: bool = False,
         num_paths: int = 3,
         enable_caching: bool = True,
-        cache_size: int = 128
+        cache_size: int = 128,
+        bm25_retriever: Optional[BM25Retriever] = None,
+        query_expansion_mode: Optional[str] = None,
+        knowledge_base_id: Optional[str] = None,
+        cache: Optional[BaseCache] = None,
+        use_semantic_cache: Optional[bool] = None,
+        source_resolver: Optional[SourceMetadataResolver] = None,
+        use_context_compression: Optional[bool] = None,
+        neighbor_window: Optional[int] = None,
+        use_mmr: Optional[bool] = None
     ):
         self.vector_store = vector_store
         self.llm = llm
@@ -39,6 +78,33 @@ class RAGEngine:
         self.use_query_rewrite = use_query_rewrite
         self.num_paths = num_paths
         self.enable_caching = enable_caching
+        self.knowledge_base_id = knowledge_base_id
+        
+        # 来源文件名与文档ID解析，每次请求至多一次数据库查询
+        if source_resolver is None and db_manager is not None:
+            source_resolver = SourceMetadataResolver(db_manager, knowledge_base_id)
+        self.source_resolver = source_resolver
+        
+        # small-to-big：生成前把命中的分块扩展为同一文档中前后neighbor_window个分块组成的窗口
+        if neighbor_window is None:
+            neighbor_window = settings.neighbor_chunk_window
+        self.neighbor_expander: Optional[ChunkNeighborExpander] = None
+        if neighbor_window > 0 and db_manager is not None:
+            self.neighbor_expander = ChunkNeighborExpander(
+                db_manager,
+                window=neighbor_window,
+                cache_size=settings.neighbor_chunk_cache_size
+            )
+        
+        # 查询扩展模式：sync 检索前同步扩展；speculative 扩展在后台进行，本次先用原始查询检索；off 不扩展
+        self.query_expansion_mode = query_expansion_mode or settings.query_expansion_mode
+        if self.query_expansion_mode not in EXPANSION_MODES:
+            raise ValueError(f"不支持的查询扩展模式: {self.query_expansion_mode}")
+        self.query_expander = QueryExpander(
+            llm=llm,
+            cache_size=settings.query_expansion_cache_size,
+            ttl=settings.query_expansion_cache_ttl
+        )
         
         self.system_prompt = system_prompt or (
             "你是一个专业的企业知识库助手。请根据提供的上下文信息回答用户的问题。"
@@ -60,62 +126,183 @@ class RAGEngine:
         self.hybrid_retriever = None
         self.multi_path_retriever = None
         
-        # Initialize caches with LRU strategy
-        from collections import OrderedDict
+        # 上下文按模型的token预算组装，相邻重叠分块合并
+        model_name = getattr(llm, "model", None)
+        self.context_builder = ContextBuilder(
+            max_tokens=settings.context_token_budgets.get(model_name, settings.context_window_size),
+            model_name=model_name
+        )
+        
+        # 抽取式上下文压缩：只保留片段中与问题最相关的句子，需要嵌入模型
+        if use_context_compression is None:
+            use_context_compression = settings.enable_context_compression
+        self.context_compressor: Optional[ContextCompressor] = None
+        if use_context_compression and embedding_service is not None:
+            self.context_compressor = ContextCompressor(
+                embedding_service,
+                keep_ratio=settings.context_compression_ratio,
+                window=settings.context_compression_window,
+                min_chars=settings.context_compression_min_chars
+            )
+        
+        # MMR多样性选择：向量检索多取mmr_fetch_factor倍候选（连同其向量），在重排序和融合之前去掉近似重复的分块
+        if use_mmr is None:
+            use_mmr = settings.enable_mmr
+        self.mmr_lambda = settings.mmr_lambda
+        self.mmr_fetch_factor = max(1, settings.mmr_fetch_factor)
+        self.use_mmr = bool(use_mmr) and self._supports_mmr()
+        if use_mmr and not self.use_mmr:
+            print(f"{type(vector_store).__name__} 不支持返回候选向量，MMR未启用")
+        
+        # 检索结果缓存：未传入共享缓存时使用进程内LRU
+        self.cache: Optional[BaseCache] = None
         if enable_caching:
-            self._query_cache = OrderedDict()
-            self._cache_max_size = cache_size
+            self.cache = cache or MemoryCache(max_size=cache_size, default_ttl=settings.cache_ttl)
             self._embedding_cache = {}
         
+        # 语义答案缓存：相似问题直接复用已生成的答案，需要嵌入模型和知识库ID（用于内容变化时失效）
+        if use_semantic_cache is None:
+            use_semantic_cache = settings.enable_semantic_cache
+        self.semantic_cache: Optional[SemanticAnswerCache] = None
+        if use_semantic_cache and embedding_service is not None:
+            if not knowledge_base_id:
+                print("未指定知识库ID，答案无法随知识库内容变化失效，语义缓存未启用")
+            else:
+                self.semantic_cache = SemanticAnswerCache(
+                    threshold=settings.semantic_cache_threshold,
+                    max_entries=settings.semantic_cache_size,
+                    ttl=settings.cache_ttl,
+                    version_getter=self._answer_version_getter(knowledge_base_id, cache or self.cache)
+                )
+        
         if use_hybrid_search:
             self.hybrid_retriever = HybridRetriever(
                 bm25_weight=0.3,
-                vector_weight=0.7
+                vector_weight=0.7,
+                bm25_retriever=bm25_retriever
             )
         
         if use_rerank:
             try:
-                reranker = RerankerFactory.create(
-                    reranker_type="bge",
-                    model_name="BAAI/bge-reranker-v2-m3"
-                )
+                reranker_kwargs = {"model_name": "BAAI/bge-reranker-v2-m3"}
+                if settings.reranker_type == "onnx":
+                    reranker_kwargs.update(
+                        model_path=settings.rerank_onnx_path,
+                        quantized=settings.rerank_onnx_quantized,
+                        intra_op_threads=settings.rerank_onnx_threads
+                    )
+                if settings.rerank_micro_batching:
+                    # 并发请求的(查询, 文档)对在进程内共享的队列中合并为大批次
+                    reranker = get_batching_reranker(
+                        reranker_type=settings.reranker_type,
+                        max_batch_size=settings.rerank_max_batch_size,
+                        max_wait_ms=settings.rerank_max_wait_ms,
+                        **reranker_kwargs
+                    )
+                else:
+                    reranker = RerankerFactory.create(
+                        reranker_type=settings.reranker_type,
+                        **reranker_kwargs
+                    )
                 query_rewriter = QueryRewriter(llm=llm) if use_query_rewrite else None
                 
                 self.multi_path_retriever = MultiPathRetriever(
                     hybrid_retriever=self.hybrid_retriever,
                     reranker=reranker,
                     query_rewriter=query_rewriter,
-                    num_paths=num_paths
+                    num_paths=num_paths,
+                    score_cache=get_rerank_score_cache(
+                        max_size=settings.rerank_cache_size,
+                        ttl=settings.rerank_cache_ttl
+                    ) if settings.enable_rerank_cache else None
                 )
             except Exception as e:
                 print(f"初始化重排序模型失败: {e}")
                 self.use_rerank = False
     
-    def _get_cache_key(self, query: str, top_k: int, score_threshold: float, filters: Optional[Dict[str, Any]]) -> str:
-        """Generate a cache key for the query"""
-        cache_input = f"{query}_{top_k}_{score_threshold}_{str(filters)}"
+    def _get_cache_key(self, query: str, top_k: int, filters: Optional[Dict[str, Any]]) -> str:
+        """Generate a cache key for the query (score threshold is applied after caching)"""
+        cache_input = f"{query}_{top_k}_{str(filters)}"
         return hashlib.md5(cache_input.encode()).hexdigest()
     
+    def _retrieval_cache_key(self, query: str, top_k: int, filters: Optional[Dict[str, Any]]) -> str:
+        cache_key = self._get_cache_key(query, top_k, filters)
+        # 推测式扩展尚未完成时检索的是原始查询，单独缓存，扩展就绪后不再命中该结果
+        if self.query_expansion_mode == "speculative" and self.query_expander.get_cached(query) is None:
+            cache_key += ":raw"
+        if self.knowledge_base_id:
+            # 键中带知识库内容版本号，文档增删后旧结果不再命中，由TTL回收
+            version = get_kb_version(self.cache, self.knowledge_base_id)
+            return f"retrieval:{self.knowledge_base_id}:v{version}:{cache_key}"
+        return f"retrieval:{cache_key}"
+    
     def _get_embedding_cache_key(self, text: str) -> str:
         """Generate a cache key for embeddings"""
         return hashlib.md5(text.encode()).hexdigest()
     
     def _get_cached_result(self, cache_key: str):
         """Retrieve cached result if available"""
-        if not self.enable_caching:
+        if self.cache is None:
+            return None
+        try:
+            cached = self.cache.get(cache_key)
+        except Exception as e:
+            print(f"读取检索缓存失败: {e}")
+            return None
+        if cached is None:
             return None
-        return self._query_cache.get(cache_key)
+        documents = [
+            (Document(page_content=item["content"], metadata=item["metadata"]), item["score"])
+            for item in cached["documents"]
+        ]
+        return documents, cached["retrieval_time"]
     
     def _cache_result(self, cache_key: str, result):
-        """Cache the result with LRU eviction"""
-        if not self.enable_caching:
+        """Cache the result (serialized so it can be shared across processes)"""
+        if self.cache is None:
             return
-        # Add to cache
-        self._query_cache[cache_key] = result
-        # Evict oldest entry if cache exceeds max size
-        if len(self._query_cache) > self._cache_max_size:
-            oldest_key = next(iter(self._query_cache))
-            del self._query_cache[oldest_key]
+        documents, retrieval_time = result
+        payload = {
+            "documents": [
+                {"content": doc.page_content, "metadata": doc.metadata, "score": score}
+                for doc, score in documents
+            ],
+            "retrieval_time": retrieval_time
+        }
+        try:
+            self.cache.set(cache_key, payload)
+        except Exception as e:
+            print(f"写入检索缓存失败: {e}")
+    
+    def _lookup_retrieval(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[str], Any]:
+        """返回 (缓存键, 缓存的检索结果)；未启用缓存时均为None"""
+        if self.cache is None:
+            return None, None
+        try:
+            cache_key = self._retrieval_cache_key(query, top_k, filters)
+        except Exception as e:
+            print(f"读取检索缓存失败: {e}")
+            return None, None
+        return cache_key, self._get_cached_result(cache_key)
+    
+    async def _acache_call(self, func: Callable, *args) -> Any:
+        """访问需要IO的缓存后端（SQLite、Redis）时放到线程中执行"""
+        if self.cache is not None and self.cache.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    @staticmethod
+    def apply_threshold(
+        candidates: List[Tuple[Document, float]],
+        score_threshold: float
+    ) -> List[Tuple[Document, float]]:
+        """按阈值过滤候选（分数已归一化到0~1）"""
+        return [(doc, score) for doc, score in candidates if score >= score_threshold]
 
     def retrieve(
         self,
@@ -124,211 +311,1003 @@ class RAGEngine:
         score_threshold: float = 0.0,
         filters: Optional[Dict[str, Any]] = None
     ) -> List[Tuple[Document, float]]:
-        # Generate cache key
-        cache_key = self._get_cache_key(query, top_k, score_threshold, filters)
-        
+        candidates, retrieval_time = self.retrieve_candidates(query, top_k, filters)
+        return self.apply_threshold(candidates, score_threshold), retrieval_time
+
+    async def aretrieve(
+        self,
+        query: str,
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        """retrieve的异步版本，与同步接口共用结果缓存"""
+        candidates, retrieval_time = await self.aretrieve_candidates(query, top_k, filters)
+        return self.apply_threshold(candidates, score_threshold), retrieval_time
+
+    def retrieve_candidates(
+        self,
+        query: str,
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """检索top_k个候选及归一化分数，不做阈值过滤
+
+        结果按(查询, top_k, 过滤条件)缓存，不同阈值的请求共用同一份候选，阈值由调用方事后过滤。
+        query_embedding为调用方已算好的查询向量（如语义缓存查询时的向量），检索查询未被扩展改写时直接复用，不再重复嵌入。
+        """
         # Try to get cached result
-        cached_result = self._get_cached_result(cache_key)
+        cache_key, cached_result = self._lookup_retrieval(query, top_k, filters)
         if cached_result is not None:
             return cached_result
         
         start_time = time.time()
         
         if self.use_rerank and self.multi_path_retriever:
-            result = self._retrieve_with_rerank(query, top_k, score_threshold, filters, start_time)
+            result = self._retrieve_with_rerank(query, top_k, filters, start_time, query_embedding)
         elif self.use_hybrid_search and self.hybrid_retriever:
-            result = self._retrieve_hybrid(query, top_k, score_threshold, filters, start_time)
+            result = self._retrieve_hybrid(query, top_k, filters, start_time, query_embedding)
         else:
-            result = self._retrieve_vector(query, top_k, score_threshold, filters, start_time)
+            result = self._retrieve_vector(query, top_k, filters, start_time, query_embedding)
         
         # Cache the result
-        self._cache_result(cache_key, result)
+        if cache_key is not None:
+            self._cache_result(cache_key, result)
         
         return result
     
-    def expand_query(self, query: str) -> str:
-        """Expand the query with related terms to improve retrieval"""
-        try:
-            # Create a simple expanded query by asking the LLM for related terms
-            messages = [
-                SystemMessage(content="你是一个查询扩展助手。请根据原始查询生成相关的关键词和同义词，用逗号分隔。只返回关键词，不要其他内容。"),
-                HumanMessage(content=f"查询: {query}")
+    async def aretrieve_candidates(
+        self,
+        query: str,
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """retrieve_candidates的异步版本"""
+        cache_key, cached_result = await self._acache_call(
+            self._lookup_retrieval, query, top_k, filters
+        )
+        if cached_result is not None:
+            return cached_result
+        
+        start_time = time.time()
+        
+        if self.use_rerank and self.multi_path_retriever:
+            result = await self._aretrieve_with_rerank(query, top_k, filters, start_time, query_embedding)
+        elif self.use_hybrid_search and self.hybrid_retriever:
+            result = await self._aretrieve_hybrid(query, top_k, filters, start_time, query_embedding)
+        else:
+            result = await self._aretrieve_vector(query, top_k, filters, start_time, query_embedding)
+        
+        if cache_key is not None:
+            await self._acache_call(self._cache_result, cache_key, result)
+        
+        return result
+    
+    def retrieve_candidates_batch(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[List[Tuple[Document, float]], float]]:
+        """批量检索候选，返回与queries一一对应的 (候选, 检索耗时)
+
+        已缓存的查询直接返回；其余查询并发扩展后，查询向量一次嵌入调用，向量与BM25按多查询批量检索，
+        重排序对所有查询的候选一次模型调用。
+        """
+        start_time = time.time()
+        results: List[Any] = [None] * len(queries)
+        cache_keys: Dict[int, Optional[str]] = {}
+        for idx, query in enumerate(queries):
+            cache_key, cached_result = self._lookup_retrieval(query, top_k, filters)
+            if cached_result is not None:
+                results[idx] = cached_result
+            else:
+                cache_keys[idx] = cache_key
+        
+        if cache_keys:
+            pending = list(cache_keys)
+            executor = get_retrieval_executor()
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._retrieval_query, queries[idx])
+                for idx in pending
             ]
-            
-            expanded_terms = self.llm.generate(messages, **{"temperature": 0.3, "max_tokens": 100})
-            
-            # Combine original query with expanded terms
-            expanded_query = f"{query} {expanded_terms}".strip()
-            return expanded_query
-        except Exception as e:
-            # If expansion fails, return original query
-            print(f"Query expansion failed: {e}")
+            expanded = [future.result() for future in futures]
+            candidates_list = self._batch_retrieve(expanded, top_k, filters)
+            retrieval_time = time.time() - start_time
+            for idx, candidates in zip(pending, candidates_list):
+                results[idx] = (candidates, retrieval_time)
+                if cache_keys[idx] is not None:
+                    self._cache_result(cache_keys[idx], results[idx])
+        
+        return results
+    
+    def _batch_retrieve(
+        self,
+        queries: List[str],
+        top_k: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[List[Tuple[Document, float]]]:
+        """批量检索（查询已扩展），召回数量与单条检索的各条路径一致"""
+        use_rerank = self.use_rerank and self.multi_path_retriever is not None
+        use_hybrid = not use_rerank and self.use_hybrid_search and self.hybrid_retriever is not None
+        use_bm25 = (use_rerank or use_hybrid) and self.hybrid_retriever is not None
+        if use_rerank:
+            vector_k, bm25_k = top_k * 3, top_k * 4
+        elif use_hybrid:
+            vector_k = bm25_k = top_k * 2
+        else:
+            vector_k = bm25_k = top_k
+        
+        stages = {
+            'vector': (lambda: self._batch_vector_search(queries, vector_k, filters), settings.batch_stage_timeout)
+        }
+        if use_bm25:
+            def bm25_stage():
+                with stage("bm25"):
+                    return self.hybrid_retriever.batch_bm25_search(queries, top_k=bm25_k, filters=filters)
+            stages['bm25'] = (bm25_stage, settings.batch_stage_timeout)
+        stage_results = self._run_stages(stages)
+        vector_batches = stage_results['vector']
+        if vector_batches is None:
+            # 单条检索时向量召回失败可退化为BM25结果，批量时整批失败由调用方逐条报告
+            raise RuntimeError("批量向量检索失败")
+        bm25_batches = stage_results.get('bm25') or [[] for _ in queries]
+        
+        if use_rerank:
+            reranked = self.multi_path_retriever.retrieve_batch(
+                queries,
+                [self._to_vector_results(results) for results in vector_batches],
+                top_k=top_k,
+                filters=filters,
+                bm25_results_list=bm25_batches if use_bm25 else None
+            )
+            return [self._score_fused_results(results, score_key='rerank_score') for results in reranked]
+        if use_hybrid:
+            with stage("fusion"):
+                return [
+                    self._score_fused_results(self.hybrid_retriever.hybrid_search(
+                        query,
+                        self._to_vector_results(vector_results),
+                        top_k=top_k,
+                        filters=filters,
+                        bm25_results=bm25_results
+                    ))
+                    for query, vector_results, bm25_results in zip(queries, vector_batches, bm25_batches)
+                ]
+        return [self._score_vector_results(results) for results in vector_batches]
+    
+    def expand_query(self, query: str) -> str:
+        """Expand the query with related terms to improve retrieval (cached, concurrent calls coalesced)"""
+        return self.query_expander.expand(query)
+    
+    async def aexpand_query(self, query: str) -> str:
+        """expand_query的异步版本"""
+        return await self.query_expander.aexpand(query)
+    
+    def _retrieval_query(self, query: str) -> str:
+        """按扩展模式得到本次检索使用的查询"""
+        if self.query_expansion_mode == "off":
+            return query
+        with stage("expansion"):
+            if self.query_expansion_mode == "speculative":
+                # 已有扩展结果则直接使用；否则后台扩展，本次先用原始查询召回，扩展及时完成时再合并扩展召回
+                return self.query_expander.prefetch(query, get_retrieval_executor()) or query
+            return self.expand_query(query)
+    
+    async def _aretrieval_query(self, query: str) -> str:
+        if self.query_expansion_mode == "off":
             return query
+        with stage("expansion"):
+            if self.query_expansion_mode == "speculative":
+                return self.query_expander.aprefetch(query) or query
+            return await self.aexpand_query(query)
+    
+    def _speculative_recall(
+        self,
+        query: str,
+        retrieval_query: str,
+        start_time: float,
+        recall: Callable[[str], Any],
+        merge: Callable[[Any, Any], Any]
+    ) -> Any:
+        """召回；推测式扩展未命中缓存时先用原始查询召回，扩展在截止时间内完成则再用扩展后的查询召回一次并合并
+
+        截止时间为检索开始后QUERY_EXPANSION_SPECULATIVE_TIMEOUT秒；超时的扩展不再等待，只写入缓存供后续请求使用。
+        """
+        results = recall(retrieval_query)
+        if self.query_expansion_mode != "speculative" or retrieval_query != query:
+            return results
+        with stage("expansion"):
+            expanded_query = self.query_expander.wait(
+                query, start_time + settings.query_expansion_speculative_timeout - time.time()
+            )
+        if not expanded_query or expanded_query == query:
+            return results
+        return merge(results, recall(expanded_query))
+    
+    async def _aspeculative_recall(
+        self,
+        query: str,
+        retrieval_query: str,
+        start_time: float,
+        recall: Callable[[str], Awaitable[Any]],
+        merge: Callable[[Any, Any], Any]
+    ) -> Any:
+        """_speculative_recall的异步版本"""
+        results = await recall(retrieval_query)
+        if self.query_expansion_mode != "speculative" or retrieval_query != query:
+            return results
+        with stage("expansion"):
+            expanded_query = await self.query_expander.await_expansion(
+                query, start_time + settings.query_expansion_speculative_timeout - time.time()
+            )
+        if not expanded_query or expanded_query == query:
+            return results
+        return merge(results, await recall(expanded_query))
+    
+    def _merge_vector_recall(
+        self,
+        primary: List[Tuple[Document, float]],
+        extra: List[Tuple[Document, float]],
+        k: int
+    ) -> List[Tuple[Document, float]]:
+        """合并两次向量召回：同一分块保留距离更小的一次，按距离取前k个"""
+        best: Dict[Any, Tuple[Document, float]] = {}
+        for doc, distance in list(primary) + list(extra):
+            key = self._chunk_key(doc, doc.page_content)
+            if key not in best or distance < best[key][1]:
+                best[key] = (doc, distance)
+        return sorted(best.values(), key=lambda item: item[1])[:k]
+    
+    @staticmethod
+    def _merge_bm25_recall(
+        primary: List[Dict[str, Any]],
+        extra: List[Dict[str, Any]],
+        k: int
+    ) -> List[Dict[str, Any]]:
+        """合并两次BM25召回：同一分块保留分数更高的一次，按分数取前k个"""
+        best: Dict[Any, Dict[str, Any]] = {}
+        for result in list(primary) + list(extra):
+            if result['key'] not in best or result['score'] > best[result['key']]['score']:
+                best[result['key']] = result
+        return sorted(best.values(), key=lambda result: result['score'], reverse=True)[:k]
+    
+    def _recall_merger(self, vector_k: int, bm25_k: int) -> Callable[[Any, Any], Any]:
+        """合并 (向量召回, BM25召回) 二元组；没有BM25索引时BM25召回为None"""
+        def merge(primary, extra):
+            bm25_results = primary[1]
+            if bm25_results is not None and extra[1] is not None:
+                bm25_results = self._merge_bm25_recall(bm25_results, extra[1], bm25_k)
+            return self._merge_vector_recall(primary[0], extra[0], vector_k), bm25_results
+        return merge
+    
+    def _query_embedder(self) -> Optional[BaseEmbeddings]:
+        """向量库自己的嵌入模型（与入库时一致）；向量库不支持按向量检索时返回None"""
+        if type(self.vector_store).similarity_search_by_vector_with_score is BaseVectorStore.similarity_search_by_vector_with_score:
+            return None
+        return getattr(self.vector_store, "embedding_function", None)
+    
+    def _supports_mmr(self) -> bool:
+        """MMR使用向量库中存储的候选向量，不重新嵌入；需要向量库支持按向量检索并返回向量"""
+        store_class = type(self.vector_store)
+        return (
+            self._query_embedder() is not None
+            and store_class.similarity_search_with_vectors_by_vector is not BaseVectorStore.similarity_search_with_vectors_by_vector
+        )
+    
+    def _mmr(
+        self,
+        embedding: List[float],
+        results: List[Tuple[Document, float, List[float]]],
+        k: int
+    ) -> List[Tuple[Document, float]]:
+        """从带向量的候选中选出k个多样化的结果，按原检索顺序返回，后续打分与融合不受影响"""
+        with stage("mmr"):
+            selected = mmr_select(embedding, [vector for _, _, vector in results], k, self.mmr_lambda)
+        return [(results[idx][0], results[idx][1]) for idx in sorted(selected)]
+    
+    def _reusable_embedding(
+        self,
+        query: str,
+        retrieval_query: str,
+        query_embedding: Optional[List[float]]
+    ) -> Optional[List[float]]:
+        """调用方传入的查询向量只在检索查询未被扩展改写、且与向量库使用同一嵌入模型时复用"""
+        if query_embedding is None or retrieval_query != query:
+            return None
+        if self._query_embedder() is not self.embedding_service:
+            return None
+        return query_embedding
+    
+    def _vector_search(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> List[Tuple[Document, float]]:
+        """向量检索：查询嵌入与按向量检索分别计时；传入embedding时跳过嵌入"""
+        embedder = self._query_embedder()
+        if embedder is None:
+            with stage("vector_search"):
+                return self.vector_store.similarity_search_with_score(query=query, k=k, filter=filters)
+        if embedding is None:
+            with stage("embedding"):
+                embedding = embedder.embed_query(query)
+        if self.use_mmr:
+            with stage("vector_search"):
+                results = self.vector_store.similarity_search_with_vectors_by_vector(
+                    embedding, k=k * self.mmr_fetch_factor, filter=filters
+                )
+            return self._mmr(embedding, results, k)
+        with stage("vector_search"):
+            return self.vector_store.similarity_search_by_vector_with_score(embedding, k=k, filter=filters)
+    
+    async def _avector_search(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> List[Tuple[Document, float]]:
+        embedder = self._query_embedder()
+        if embedder is None:
+            with stage("vector_search"):
+                return await self.vector_store.asimilarity_search_with_score(query=query, k=k, filter=filters)
+        if embedding is None:
+            with stage("embedding"):
+                embedding = await embedder.aembed_query(query)
+        if self.use_mmr:
+            with stage("vector_search"):
+                results = await self.vector_store.asimilarity_search_with_vectors_by_vector(
+                    embedding, k=k * self.mmr_fetch_factor, filter=filters
+                )
+            return self._mmr(embedding, results, k)
+        with stage("vector_search"):
+            return await self.vector_store.asimilarity_search_by_vector_with_score(embedding, k=k, filter=filters)
+    
+    def _batch_vector_search(
+        self,
+        queries: List[str],
+        k: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[List[Tuple[Document, float]]]:
+        embedder = self._query_embedder()
+        if embedder is None:
+            with stage("vector_search"):
+                return self.vector_store.batch_similarity_search_with_score(queries, k=k, filter=filters)
+        with stage("embedding"):
+            embeddings = embedder.embed_queries(queries)
+        if self.use_mmr:
+            with stage("vector_search"):
+                batch = self.vector_store.batch_similarity_search_with_vectors_by_vector(
+                    embeddings, k=k * self.mmr_fetch_factor, filter=filters
+                )
+            return [self._mmr(embedding, results, k) for embedding, results in zip(embeddings, batch)]
+        with stage("vector_search"):
+            return self.vector_store.batch_similarity_search_by_vector_with_score(embeddings, k=k, filter=filters)
+    
+    def _bm25_search(self, query: str, k: int, filters: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with stage("bm25"):
+            return self.hybrid_retriever.bm25_search(query, top_k=k, filters=filters)
+    
+    def _fuse(
+        self,
+        query: str,
+        vector_results: List[Tuple[Document, float]],
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        bm25_results: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        with stage("fusion"):
+            return self.hybrid_retriever.hybrid_search(
+                query,
+                self._to_vector_results(vector_results),
+                top_k=top_k,
+                filters=filters,
+                bm25_results=bm25_results
+            )
+    
+    @staticmethod
+    def _score_vector_results(results: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        """向量距离转为相似度"""
+        return [(doc, max(0, min(1.0, 1 - score))) for doc, score in results]
     
     def _retrieve_vector(
         self,
         query: str,
         top_k: int,
-        score_threshold: float,
         filters: Optional[Dict[str, Any]],
-        start_time: float
+        start_time: float,
+        query_embedding: Optional[List[float]] = None
     ) -> Tuple[List[Tuple[Document, float]], float]:
         """纯向量检索"""
         # Use expanded query for better retrieval
-        expanded_query = self.expand_query(query)
+        expanded_query = self._retrieval_query(query)
         
-        results = self.vector_store.similarity_search_with_score(
-            query=expanded_query,
-            k=top_k,
-            filter=filters
+        results = self._speculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._vector_search(q, top_k, filters, self._reusable_embedding(query, q, query_embedding)),
+            lambda primary, extra: self._merge_vector_recall(primary, extra, top_k)
         )
         
-        filtered_results = [
-            (doc, max(0, min(1.0, 1 - score))) for doc, score in results
-            if max(0, min(1.0, 1 - score)) >= score_threshold
-        ]
+        candidates = self._score_vector_results(results)
         
         retrieval_time = time.time() - start_time
-        return filtered_results, retrieval_time
+        return candidates, retrieval_time
     
-    def _retrieve_hybrid(
+    async def _aretrieve_vector(
         self,
         query: str,
         top_k: int,
-        score_threshold: float,
         filters: Optional[Dict[str, Any]],
-        start_time: float
+        start_time: float,
+        query_embedding: Optional[List[float]] = None
     ) -> Tuple[List[Tuple[Document, float]], float]:
-        """混合检索"""
-        # Use expanded query for better retrieval
-        expanded_query = self.expand_query(query)
+        """纯向量检索（异步）"""
+        expanded_query = await self._aretrieval_query(query)
         
-        vector_results = self.vector_store.similarity_search_with_score(
-            query=expanded_query,
-            k=top_k * 2,
-            filter=filters
+        results = await self._aspeculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._avector_search(q, top_k, filters, self._reusable_embedding(query, q, query_embedding)),
+            lambda primary, extra: self._merge_vector_recall(primary, extra, top_k)
         )
         
-        if not vector_results:
-            retrieval_time = time.time() - start_time
-            return [], retrieval_time
-        
-        documents = [doc.page_content for doc, _ in vector_results]
+        candidates = self._score_vector_results(results)
         
-        if not self.hybrid_retriever._bm25_initialized:
-            self.hybrid_retriever.initialize_bm25(documents)
-        
-        vector_results_dict = [
+        retrieval_time = time.time() - start_time
+        return candidates, retrieval_time
+    
+    @staticmethod
+    def _chunk_key(doc: Document, fallback: Any) -> Any:
+        """分块唯一标识：优先使用入库时写入的vector_id，与BM25索引的key一致"""
+        return doc.metadata.get("vector_id") or getattr(doc, "id", None) or fallback
+    
+    def _to_vector_results(self, vector_results: List[Tuple[Document, float]]) -> List[Dict[str, Any]]:
+        return [
             {
                 'index': idx,
+                'key': self._chunk_key(doc, f"vector_{idx}"),
                 'score': max(0, min(1.0, 1 - score)),
                 'content': doc.page_content,
                 'document': doc
             }
             for idx, (doc, score) in enumerate(vector_results)
         ]
+    
+    @staticmethod
+    def _result_document(result: Dict[str, Any]) -> Document:
+        """融合结果转为Document；仅由BM25召回的分块使用索引中保存的内容与元数据"""
+        if result.get('document') is not None:
+            return result['document']
+        return Document(page_content=result.get('content', ''), metadata=dict(result.get('metadata') or {}))
+    
+    def _score_fused_results(
+        self,
+        results: List[Dict[str, Any]],
+        score_key: str = 'score'
+    ) -> List[Tuple[Document, float]]:
+        """融合/重排序结果转为(document, normalized_score)"""
+        return [
+            (self._result_document(result), max(0, min(1.0, result.get(score_key, result['score']))))
+            for result in results
+        ]
+    
+    def _run_stages(self, stages: Dict[str, Tuple[Callable[[], Any], float]]) -> Dict[str, Any]:
+        """并发执行相互独立的检索阶段，每个阶段单独计时超时
+
+        超时或失败的阶段结果为None，不会阻塞其他阶段；超时的任务仍在线程池中执行完毕，结果被丢弃。
+        """
+        executor = get_retrieval_executor()
+        started = time.time()
+        # 每个阶段在当前上下文的副本中执行，阶段耗时计入当前请求的Trace
+        futures = {name: executor.submit(contextvars.copy_context().run, func) for name, (func, _) in stages.items()}
+        results = {}
+        for name, future in futures.items():
+            timeout = stages[name][1]
+            try:
+                results[name] = future.result(timeout=max(0.0, started + timeout - time.time()))
+            except FutureTimeoutError:
+                print(f"检索阶段 {name} 超时（{timeout}秒），忽略该路结果")
+                results[name] = None
+            except Exception as e:
+                print(f"检索阶段 {name} 失败: {e}")
+                results[name] = None
+        return results
+    
+    async def _arun_stages(self, stages: Dict[str, Tuple[Awaitable[Any], float]]) -> Dict[str, Any]:
+        """_run_stages的异步版本：各阶段在事件循环上并发等待，超时或失败的阶段结果为None"""
+        async def run(name: str, awaitable: Awaitable[Any], timeout: float) -> Any:
+            try:
+                return await asyncio.wait_for(awaitable, timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"检索阶段 {name} 超时（{timeout}秒），忽略该路结果")
+            except Exception as e:
+                print(f"检索阶段 {name} 失败: {e}")
+            return None
+        
+        names = list(stages)
+        values = await asyncio.gather(*(run(name, *stages[name]) for name in names))
+        return dict(zip(names, values))
+    
+    async def _run_in_executor(self, func: Callable[[], Any]) -> Any:
+        """在检索线程池中执行同步的CPU密集步骤（BM25、重排序模型）"""
+        return await asyncio.get_running_loop().run_in_executor(
+            get_retrieval_executor(), contextvars.copy_context().run, func
+        )
+    
+    def _parallel_recall(
+        self,
+        query: str,
+        vector_k: int,
+        bm25_k: int,
+        filters: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], List[Dict[str, Any]]]:
+        """向量检索与BM25召回并发执行，两者都完成（或超时）后返回"""
+        stage_results = self._run_stages({
+            'vector': (
+                lambda: self._vector_search(query, vector_k, filters, embedding),
+                settings.vector_search_timeout
+            ),
+            'bm25': (
+                lambda: self._bm25_search(query, bm25_k, filters),
+                settings.bm25_search_timeout
+            )
+        })
+        return stage_results['vector'] or [], stage_results['bm25'] or []
+    
+    async def _aparallel_recall(
+        self,
+        query: str,
+        vector_k: int,
+        bm25_k: int,
+        filters: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], List[Dict[str, Any]]]:
+        """_parallel_recall的异步版本：向量检索走异步客户端，BM25在检索线程池中执行"""
+        stage_results = await self._arun_stages({
+            'vector': (
+                self._avector_search(query, vector_k, filters, embedding),
+                settings.vector_search_timeout
+            ),
+            'bm25': (
+                self._run_in_executor(lambda: self._bm25_search(query, bm25_k, filters)),
+                settings.bm25_search_timeout
+            )
+        })
+        return stage_results['vector'] or [], stage_results['bm25'] or []
+    
+    def _retrieve_hybrid(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        start_time: float,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """混合检索"""
+        # Use expanded query for better retrieval
+        expanded_query = self._retrieval_query(query)
         
-        hybrid_results = self.hybrid_retriever.hybrid_search(
-            expanded_query,
-            vector_results_dict,
-            top_k=top_k
+        vector_results, bm25_results = self._speculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._parallel_recall(q, top_k * 2, top_k * 2, filters, self._reusable_embedding(query, q, query_embedding)),
+            self._recall_merger(top_k * 2, top_k * 2)
         )
         
-        # 创建索引到原始文档的映射
-        index_to_document = {item['index']: (item['document'], item['score']) for item in vector_results_dict}
+        hybrid_results = self._fuse(expanded_query, vector_results, top_k, filters, bm25_results)
         
-        filtered_results = [
-            (index_to_document[result['index']][0], max(0, min(1.0, result['score'])))  # (document, normalized_score)
-            for result in hybrid_results
-            if result['index'] in index_to_document and max(0, min(1.0, result['score'])) >= score_threshold
-        ]
+        candidates = self._score_fused_results(hybrid_results)
         
         retrieval_time = time.time() - start_time
-        return filtered_results, retrieval_time
+        return candidates, retrieval_time
     
-    def _retrieve_with_rerank(
+    async def _aretrieve_hybrid(
         self,
         query: str,
         top_k: int,
-        score_threshold: float,
         filters: Optional[Dict[str, Any]],
-        start_time: float
+        start_time: float,
+        query_embedding: Optional[List[float]] = None
     ) -> Tuple[List[Tuple[Document, float]], float]:
-        """带重排序的检索"""
-        # Use expanded query for better retrieval
-        expanded_query = self.expand_query(query)
+        """混合检索（异步）"""
+        expanded_query = await self._aretrieval_query(query)
         
-        vector_results = self.vector_store.similarity_search_with_score(
-            query=expanded_query,
-            k=top_k * 3,
-            filter=filters
+        vector_results, bm25_results = await self._aspeculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._aparallel_recall(q, top_k * 2, top_k * 2, filters, self._reusable_embedding(query, q, query_embedding)),
+            self._recall_merger(top_k * 2, top_k * 2)
         )
         
-        if not vector_results:
-            retrieval_time = time.time() - start_time
-            return [], retrieval_time
-        
-        documents = [doc.page_content for doc, _ in vector_results]
+        # 两路召回结果已就绪，融合只做打分合并，直接在事件循环上执行
+        hybrid_results = self._fuse(expanded_query, vector_results, top_k, filters, bm25_results)
         
-        if not self.hybrid_retriever._bm25_initialized:
-            self.hybrid_retriever.initialize_bm25(documents)
+        candidates = self._score_fused_results(hybrid_results)
         
-        vector_results_dict = [
-            {
-                'index': idx,
-                'score': max(0, min(1.0, 1 - score)),
-                'content': doc.page_content,
-                'document': doc
-            }
-            for idx, (doc, score) in enumerate(vector_results)
-        ]
+        retrieval_time = time.time() - start_time
+        return candidates, retrieval_time
+    
+    def _retrieve_with_rerank(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        start_time: float,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """带重排序的检索"""
+        # Use expanded query for better retrieval
+        expanded_query = self._retrieval_query(query)
         
-        reranked_results = self.multi_path_retriever.retrieve(
-            expanded_query,
-            vector_results_dict,
-            top_k=top_k
+        vector_results, bm25_results = self._speculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._rerank_recall(q, top_k, filters, self._reusable_embedding(query, q, query_embedding)),
+            self._recall_merger(top_k * 3, top_k * 4)
         )
-        
-        filtered_results = [
-            (result['document'], max(0, min(1.0, result.get('rerank_score', result['score']))))
-            for result in reranked_results
-            if max(0, min(1.0, result.get('rerank_score', result['score']))) >= score_threshold
-        ]
+        candidates = self._rerank_candidates(expanded_query, vector_results, bm25_results, top_k, filters)
         
         retrieval_time = time.time() - start_time
-        return filtered_results, retrieval_time
-
-    def format_context(self, documents: List[Tuple[Document, float]]) -> str:
-        context_parts = []
-        for idx, (doc, score) in enumerate(documents, 1):
-            file_name = doc.metadata.get("file_name", "未知文件")
-            source = doc.metadata.get("source", "未知来源")
-            context_parts.append(
-                f"[文档片段 {idx}] (相似度: {score:.4f}, 文件: {file_name})\n{doc.page_content}"
-            )
-        return "\n\n".join(context_parts)
-
-    def generate_answer(
+        return candidates, retrieval_time
+    
+    async def _aretrieve_with_rerank(
         self,
-        question: str,
-        context: str,
-        conversation_history: Optional[List[Dict[str, str]]] = None,
-        **kwargs
-    ) -> str:
-        messages = [
-            SystemMessage(content=self.system_prompt)
-        ]
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        start_time: float,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """带重排序的检索（异步）"""
+        expanded_query = await self._aretrieval_query(query)
         
-        if conversation_history:
-            for msg in conversation_history[-6:]:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    messages.append(SystemMessage(content=msg["content"]))
+        vector_results, bm25_results = await self._aspeculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._arerank_recall(q, top_k, filters, self._reusable_embedding(query, q, query_embedding)),
+            self._recall_merger(top_k * 3, top_k * 4)
+        )
+        # 查询改写与重排序模型都是同步调用，放到检索线程池中执行
+        candidates = await self._run_in_executor(
+            lambda: self._rerank_candidates(expanded_query, vector_results, bm25_results, top_k, filters)
+        )
+        
+        retrieval_time = time.time() - start_time
+        return candidates, retrieval_time
+    
+    def _rerank_recall(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], Optional[List[Dict[str, Any]]]]:
+        """重排序前的召回：向量检索top_k * 3，有BM25索引时并发召回top_k * 4（对应多路召回第一路的混合检索top_k * 2）"""
+        if self.hybrid_retriever is not None:
+            return self._parallel_recall(query, top_k * 3, top_k * 4, filters, embedding)
+        return self._vector_search(query, top_k * 3, filters, embedding), None
+    
+    async def _arerank_recall(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], Optional[List[Dict[str, Any]]]]:
+        if self.hybrid_retriever is not None:
+            return await self._aparallel_recall(query, top_k * 3, top_k * 4, filters, embedding)
+        return await self._avector_search(query, top_k * 3, filters, embedding), None
+    
+    def _rerank_candidates(
+        self,
+        query: str,
+        vector_results: List[Tuple[Document, float]],
+        bm25_results: Optional[List[Dict[str, Any]]],
+        top_k: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[Tuple[Document, float]]:
+        reranked_results = self.multi_path_retriever.retrieve(
+            query,
+            self._to_vector_results(vector_results),
+            top_k=top_k,
+            filters=filters,
+            bm25_results=bm25_results
+        )
+        return self._score_fused_results(reranked_results, score_key='rerank_score')
+    
+    def retrieve_candidates_staged(
+        self,
+        query: str,
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Iterator[Tuple[str, List[Tuple[Document, float]], float]]:
+        """分阶段检索候选，依次产出 (阶段, 候选, 检索耗时)
+
+        启用重排序且未命中缓存时，先产出召回阶段（recall）按向量相似度排序的top_k个候选，
+        重排序完成后再产出最终候选（final）；其他情况只产出final，与retrieve_candidates结果一致。
+        """
+        if not (self.use_rerank and self.multi_path_retriever):
+            candidates, retrieval_time = self.retrieve_candidates(query, top_k, filters, query_embedding)
+            yield "final", candidates, retrieval_time
+            return
+        
+        cache_key, cached_result = self._lookup_retrieval(query, top_k, filters)
+        if cached_result is not None:
+            yield ("final",) + tuple(cached_result)
+            return
+        
+        start_time = time.time()
+        expanded_query = self._retrieval_query(query)
+        vector_results, bm25_results = self._speculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._rerank_recall(q, top_k, filters, self._reusable_embedding(query, q, query_embedding)),
+            self._recall_merger(top_k * 3, top_k * 4)
+        )
+        yield "recall", self._score_vector_results(vector_results[:top_k]), time.time() - start_time
+        
+        candidates = self._rerank_candidates(expanded_query, vector_results, bm25_results, top_k, filters)
+        result = (candidates, time.time() - start_time)
+        if cache_key is not None:
+            self._cache_result(cache_key, result)
+        yield ("final",) + result
+    
+    async def aretrieve_candidates_staged(
+        self,
+        query: str,
+        top_k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> AsyncIterator[Tuple[str, List[Tuple[Document, float]], float]]:
+        """retrieve_candidates_staged的异步版本"""
+        if not (self.use_rerank and self.multi_path_retriever):
+            candidates, retrieval_time = await self.aretrieve_candidates(query, top_k, filters, query_embedding)
+            yield "final", candidates, retrieval_time
+            return
+        
+        cache_key, cached_result = await self._acache_call(self._lookup_retrieval, query, top_k, filters)
+        if cached_result is not None:
+            yield ("final",) + tuple(cached_result)
+            return
+        
+        start_time = time.time()
+        expanded_query = await self._aretrieval_query(query)
+        vector_results, bm25_results = await self._aspeculative_recall(
+            query, expanded_query, start_time,
+            lambda q: self._arerank_recall(q, top_k, filters, self._reusable_embedding(query, q, query_embedding)),
+            self._recall_merger(top_k * 3, top_k * 4)
+        )
+        yield "recall", self._score_vector_results(vector_results[:top_k]), time.time() - start_time
+        
+        candidates = await self._run_in_executor(
+            lambda: self._rerank_candidates(expanded_query, vector_results, bm25_results, top_k, filters)
+        )
+        result = (candidates, time.time() - start_time)
+        if cache_key is not None:
+            await self._acache_call(self._cache_result, cache_key, result)
+        yield ("final",) + result
+
+    def format_context(self, documents: List[Tuple[Document, float]], question: Optional[str] = None) -> str:
+        """组装上下文：命中的分块扩展为相邻分块窗口（small-to-big），相邻分块合并后，
+        启用上下文压缩且传入问题时先压缩，再按token预算填充"""
+        with stage("context_build"):
+            if self.neighbor_expander is not None:
+                with stage("neighbor_expansion"):
+                    documents = self.neighbor_expander.expand(documents)
+            documents = self.context_builder.merge(documents)
+            if question and self.context_compressor is not None:
+                with stage("compression"):
+                    documents = self.context_compressor.compress(question, documents)
+            return self._format_context(self.context_builder.fill(documents))
+
+    async def aformat_context(self, documents: List[Tuple[Document, float]], question: Optional[str] = None) -> str:
+        """format_context的异步版本：相邻分块查询与压缩（嵌入模型调用）放到线程中执行"""
+        if self.neighbor_expander is not None or (question and self.context_compressor is not None):
+            return await asyncio.to_thread(self.format_context, documents, question)
+        return self.format_context(documents)
+
+    def _format_context(self, documents: List[Tuple[Document, float]]) -> str:
+        context_parts = []
+        for idx, (doc, score) in enumerate(documents, 1):
+            file_name = doc.metadata.get("file_name", "未知文件")
+            source = doc.metadata.get("source", "未知来源")
+            context_parts.append(
+                f"[文档片段 {idx}] (相似度: {score:.4f}, 文件: {file_name})\n{doc.page_content}"
+            )
+        return "\n\n".join(context_parts)
+
+    def _build_messages(
+        self,
+        question: str,
+        context: str,
+        conversation_history: Optional[List[Dict[str, str]]] = None
+    ) -> List[Any]:
+        messages = [
+            SystemMessage(content=self.system_prompt)
+        ]
+        
+        if conversation_history:
+            for msg in conversation_history[-6:]:
+                if msg["role"] == "user":
+                    messages.append(HumanMessage(content=msg["content"]))
+                elif msg["role"] == "assistant":
+                    messages.append(SystemMessage(content=msg["content"]))
         
         messages.append(HumanMessage(content=f"上下文信息：\n{context}\n\n问题：{question}"))
+        return messages
+
+    def generate_answer(
+        self,
+        question: str,
+        context: str,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        **kwargs
+    ) -> str:
+        with stage("llm_completion"):
+            return self.llm.generate(self._build_messages(question, context, conversation_history), **kwargs)
+
+    async def agenerate_answer(
+        self,
+        question: str,
+        context: str,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        **kwargs
+    ) -> str:
+        with stage("llm_completion"):
+            return await self.llm.agenerate(self._build_messages(question, context, conversation_history), **kwargs)
+
+    def _select_documents(
+        self,
+        candidates: List[Tuple[Document, float]],
+        score_threshold: float,
+        adaptive_threshold: bool
+    ) -> List[Tuple[Document, float]]:
+        # Try with original threshold first
+        documents = self.apply_threshold(candidates, score_threshold)
+        
+        # If no results and adaptive threshold is enabled, relax the threshold on the same candidates
+        if not documents and adaptive_threshold and score_threshold > 0:
+            documents = self.apply_threshold(candidates, score_threshold * 0.5)  # Reduce threshold by half
+        return documents
+
+    def _retrieve_documents(
+        self,
+        question: str,
+        top_k: int,
+        score_threshold: float,
+        filters: Optional[Dict[str, Any]],
+        adaptive_threshold: bool,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        candidates, retrieval_time = self.retrieve_candidates(question, top_k, filters, query_embedding)
+        return self._select_documents(candidates, score_threshold, adaptive_threshold), retrieval_time
+
+    async def _aretrieve_documents(
+        self,
+        question: str,
+        top_k: int,
+        score_threshold: float,
+        filters: Optional[Dict[str, Any]],
+        adaptive_threshold: bool,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        candidates, retrieval_time = await self.aretrieve_candidates(question, top_k, filters, query_embedding)
+        return self._select_documents(candidates, score_threshold, adaptive_threshold), retrieval_time
+
+    @staticmethod
+    def _no_context_result(question: str, retrieval_time: float, start_time: float) -> Dict[str, Any]:
+        return {
+            "question": question,
+            "answer": "抱歉，我在知识库中没有找到相关信息来回答您的问题。",
+            "sources": [],
+            "retrieval_time": retrieval_time,
+            "generation_time": 0.0,
+            "total_time": time.time() - start_time,
+            "has_context": False  # Indicate no context was found
+        }
+
+    def _build_sources(
+        self,
+        documents: List[Tuple[Document, float]],
+        resolved: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """来源列表，按来源文件补全file_name与document_id；resolved为空时在此批量解析"""
+        sources = [
+            {
+                "content": doc.page_content,
+                "score": max(0, min(1.0, score)),  # score已经是相似度分数，不需要再转换
+                "metadata": dict(doc.metadata)
+            }
+            for doc, score in documents
+        ]
         
-        return self.llm.generate(messages, **kwargs)
+        if self.source_resolver is not None:
+            if resolved is None:
+                resolved = self.source_resolver.resolve(s["metadata"].get("source", "") for s in sources)
+            self.source_resolver.enrich([s["metadata"] for s in sources], resolved)
+        return sources
+
+    async def _abuild_sources(self, documents: List[Tuple[Document, float]]) -> List[Dict[str, Any]]:
+        resolved = None
+        if self.source_resolver is not None:
+            resolved = await self.source_resolver.aresolve(doc.metadata.get("source", "") for doc, _ in documents)
+        return self._build_sources(documents, resolved)
+
+    @staticmethod
+    def _semantic_scope(
+        top_k: int,
+        score_threshold: float,
+        filters: Optional[Dict[str, Any]],
+        adaptive_threshold: bool,
+        llm_kwargs: Dict[str, Any]
+    ) -> str:
+        """语义缓存作用域：检索与生成参数都相同的问题才可能复用答案"""
+        return f"{top_k}_{score_threshold}_{adaptive_threshold}_{str(filters)}_{sorted(llm_kwargs.items())}"
+
+    @staticmethod
+    def _answer_version_getter(knowledge_base_id: str, shared_cache: Optional[BaseCache]) -> Callable[[], Any]:
+        """语义缓存的版本号：进程内版本号不依赖检索缓存；有共享缓存时再加上其中的版本号，其他进程的增删也能使缓存失效"""
+        if shared_cache is None:
+            return lambda: (get_answer_version(knowledge_base_id), None)
+        return lambda: (get_answer_version(knowledge_base_id), get_kb_version(shared_cache, knowledge_base_id))
+
+    def _semantic_lookup(
+        self,
+        question: str,
+        scope: str,
+        conversation_history: Optional[List[Dict[str, str]]]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Any, str, Any]]]:
+        """返回 (命中的缓存结果, 写入缓存所需的上下文)；多轮对话的答案依赖历史，不走语义缓存"""
+        if self.semantic_cache is None or conversation_history:
+            return None, None
+        try:
+            version = self.semantic_cache.current_version()
+            with stage("embedding"):
+                embedding = self.embedding_service.embed_query(question)
+        except Exception as e:
+            print(f"语义缓存查询失败: {e}")
+            return None, None
+        return self.semantic_cache.lookup(embedding, scope), (embedding, scope, version)
+
+    async def _asemantic_lookup(
+        self,
+        question: str,
+        scope: str,
+        conversation_history: Optional[List[Dict[str, str]]]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Any, str, Any]]]:
+        if self.semantic_cache is None or conversation_history:
+            return None, None
+        try:
+            version = await self._acache_call(self.semantic_cache.current_version)
+            with stage("embedding"):
+                embedding = await self.embedding_service.aembed_query(question)
+        except Exception as e:
+            print(f"语义缓存查询失败: {e}")
+            return None, None
+        return self.semantic_cache.lookup(embedding, scope), (embedding, scope, version)
+
+    @staticmethod
+    def _semantic_embedding(store_context) -> Optional[List[float]]:
+        """语义缓存查询时算出的问题向量，未命中时交给向量检索复用"""
+        return store_context[0] if store_context is not None else None
+
+    def _semantic_store(self, store_context, question: str, result: Dict[str, Any]):
+        if store_context is None or not result.get("has_context"):
+            return
+        embedding, scope, version = store_context
+        self.semantic_cache.store(embedding, scope, question, result, version)
+
+    @staticmethod
+    def _semantic_hit_result(question: str, cached: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        return {
+            **cached,
+            "question": question,
+            "retrieval_time": 0.0,
+            "generation_time": 0.0,
+            "total_time": time.time() - start_time,
+            "cache_hit": True
+        }
 
     def query(
         self,
@@ -342,63 +1321,27 @@ class RAGEngine:
     ) -> Dict[str, Any]:
         start_time = time.time()
         
-        # Try with original threshold first
-        documents, retrieval_time = self.retrieve(
-            query=question,
-            top_k=top_k,
-            score_threshold=score_threshold,
-            filters=filters
-        )
+        scope = self._semantic_scope(top_k, score_threshold, filters, adaptive_threshold, llm_kwargs)
+        cached, store_context = self._semantic_lookup(question, scope, conversation_history)
+        if cached is not None:
+            return self._semantic_hit_result(question, cached, start_time)
         
-        # If no results and adaptive threshold is enabled, try with lower threshold
-        if not documents and adaptive_threshold and score_threshold > 0:
-            # Retry with a lower threshold
-            documents, retrieval_time = self.retrieve(
-                query=question,
-                top_k=top_k,
-                score_threshold=score_threshold * 0.5,  # Reduce threshold by half
-                filters=filters
-            )
+        documents, retrieval_time = self._retrieve_documents(
+            question, top_k, score_threshold, filters, adaptive_threshold, self._semantic_embedding(store_context)
+        )
         
         if not documents:
-            return {
-                "question": question,
-                "answer": "抱歉，我在知识库中没有找到相关信息来回答您的问题。",
-                "sources": [],
-                "retrieval_time": retrieval_time,
-                "generation_time": 0.0,
-                "total_time": time.time() - start_time,
-                "has_context": False  # Indicate no context was found
-            }
+            return self._no_context_result(question, retrieval_time, start_time)
         
-        context = self.format_context(documents)
+        context = self.format_context(documents, question)
         
         gen_start_time = time.time()
         answer = self.generate_answer(question, context, conversation_history, **llm_kwargs)
         generation_time = time.time() - gen_start_time
         
-        sources = []
-        for doc, score in documents:
-            metadata = dict(doc.metadata)
-            
-            if self.db_manager:
-                try:
-                    session = self.db_manager.get_session()
-                    from src.models.database import Document as DBDocument
-                    db_doc = session.query(DBDocument).filter(DBDocument.file_path == metadata.get("source", "")).first()
-                    if db_doc:
-                        metadata["file_name"] = db_doc.file_name
-                    session.close()
-                except Exception as e:
-                    pass
-            
-            sources.append({
-                "content": doc.page_content,
-                "score": max(0, min(1.0, score)),  # score已经是相似度分数，不需要再转换
-                "metadata": metadata
-            })
+        sources = self._build_sources(documents)
         
-        return {
+        result = {
             "question": question,
             "answer": answer,
             "sources": sources,
@@ -407,6 +1350,215 @@ class RAGEngine:
             "total_time": time.time() - start_time,
             "has_context": True  # Indicate context was found
         }
+        self._semantic_store(store_context, question, result)
+        return result
+
+    async def aquery(
+        self,
+        question: str,
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        adaptive_threshold: bool = True,
+        **llm_kwargs
+    ) -> Dict[str, Any]:
+        """query的异步版本，检索与生成期间不占用事件循环"""
+        start_time = time.time()
+        
+        scope = self._semantic_scope(top_k, score_threshold, filters, adaptive_threshold, llm_kwargs)
+        cached, store_context = await self._asemantic_lookup(question, scope, conversation_history)
+        if cached is not None:
+            return self._semantic_hit_result(question, cached, start_time)
+        
+        documents, retrieval_time = await self._aretrieve_documents(
+            question, top_k, score_threshold, filters, adaptive_threshold, self._semantic_embedding(store_context)
+        )
+        
+        result = await self._aanswer(question, documents, retrieval_time, conversation_history, llm_kwargs, start_time)
+        self._semantic_store(store_context, question, result)
+        return result
+
+    async def _aanswer(
+        self,
+        question: str,
+        documents: List[Tuple[Document, float]],
+        retrieval_time: float,
+        conversation_history: Optional[List[Dict[str, str]]],
+        llm_kwargs: Dict[str, Any],
+        start_time: float
+    ) -> Dict[str, Any]:
+        """根据检索到的文档生成答案"""
+        if not documents:
+            return self._no_context_result(question, retrieval_time, start_time)
+        
+        context = await self.aformat_context(documents, question)
+        
+        gen_start_time = time.time()
+        answer = await self.agenerate_answer(question, context, conversation_history, **llm_kwargs)
+        generation_time = time.time() - gen_start_time
+        
+        sources = await self._abuild_sources(documents)
+        
+        return {
+            "question": question,
+            "answer": answer,
+            "sources": sources,
+            "retrieval_time": retrieval_time,
+            "generation_time": generation_time,
+            "total_time": time.time() - start_time,
+            "has_context": True
+        }
+
+    async def aquery_batch(
+        self,
+        questions: List[str],
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None,
+        adaptive_threshold: bool = True,
+        concurrency: Optional[int] = None,
+        **llm_kwargs
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """批量问答：按分块批量检索，答案生成并发执行，每个问题完成即产出 (序号, 结果)
+
+        生成中的问题较多时先等待其完成再检索下一块，避免检索结果在内存中堆积。失败的问题结果中带error。
+        """
+        concurrency = concurrency or settings.batch_qa_concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def answer(index: int, question: str, documents, retrieval_time: float, start_time: float):
+            try:
+                async with semaphore:
+                    result = await self._aanswer(question, documents, retrieval_time, None, llm_kwargs, start_time)
+            except Exception as e:
+                result = {"question": question, "error": str(e)}
+            await queue.put((index, result))
+        
+        async def produce():
+            pending = set()
+            try:
+                for offset in range(0, len(questions), settings.batch_chunk_size):
+                    chunk = questions[offset:offset + settings.batch_chunk_size]
+                    start_time = time.time()
+                    try:
+                        retrieved = await asyncio.to_thread(self.retrieve_candidates_batch, chunk, top_k, filters)
+                    except Exception as e:
+                        for idx, question in enumerate(chunk):
+                            await queue.put((offset + idx, {"question": question, "error": str(e)}))
+                        continue
+                    for idx, (question, (candidates, retrieval_time)) in enumerate(zip(chunk, retrieved)):
+                        documents = self._select_documents(candidates, score_threshold, adaptive_threshold)
+                        pending.add(asyncio.ensure_future(answer(offset + idx, question, documents, retrieval_time, start_time)))
+                    while len(pending) > concurrency:
+                        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if pending:
+                    await asyncio.wait(pending)
+            finally:
+                for task in pending:
+                    task.cancel()
+                await queue.put(None)
+        
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            producer.cancel()
+
+    @staticmethod
+    def _sources_event(
+        question: str,
+        sources: List[Dict[str, Any]],
+        retrieval_time: float,
+        has_context: bool,
+        stage: str = "final"
+    ) -> Dict[str, Any]:
+        return {
+            "event": "sources",
+            "stage": stage,
+            "question": question,
+            "sources": sources,
+            "retrieval_time": retrieval_time,
+            "has_context": has_context
+        }
+
+    @staticmethod
+    def _done_event(result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "event": "done",
+            "retrieval_time": result["retrieval_time"],
+            "generation_time": result["generation_time"],
+            "total_time": result["total_time"],
+            "has_context": result["has_context"],
+            "cache_hit": result.get("cache_hit", False),
+            "done": True
+        }
+
+    def _final_events(self, result: Dict[str, Any], stream_mode: str = "delta") -> List[Dict[str, Any]]:
+        """无需调用大模型（语义缓存命中或没有检索到内容）时的事件序列"""
+        if stream_mode != "delta":
+            return [{**result, "done": True}]
+        return [
+            self._sources_event(result["question"], result["sources"], result["retrieval_time"], result["has_context"]),
+            {"event": "delta", "delta": result["answer"]},
+            self._done_event(result)
+        ]
+
+    @staticmethod
+    def _coalesce(chunks: Iterator[str], window: float) -> Iterator[str]:
+        """把时间窗口内到达的小片段合并为一帧；窗口从一帧的第一个片段到达时开始计时"""
+        buffer: List[str] = []
+        started = 0.0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not buffer:
+                started = time.monotonic()
+            buffer.append(chunk)
+            if time.monotonic() - started >= window:
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
+
+    @staticmethod
+    async def _acoalesce(chunks: AsyncIterator[str], window: float) -> AsyncIterator[str]:
+        """_coalesce的异步版本：窗口到期即发送，不等待下一个片段到达"""
+        loop = asyncio.get_running_loop()
+        iterator = chunks.__aiter__()
+        buffer: List[str] = []
+        deadline: Optional[float] = None
+        pending: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield "".join(buffer)
+                    buffer, deadline = [], None
+                    continue
+                task, pending = pending, None
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    break
+                if not chunk:
+                    continue
+                buffer.append(chunk)
+                if deadline is None:
+                    deadline = loop.time() + window
+            if buffer:
+                yield "".join(buffer)
+        finally:
+            if pending is not None:
+                pending.cancel()
 
     def stream_query(
         self,
@@ -416,90 +1568,159 @@ class RAGEngine:
         filters: Optional[Dict[str, Any]] = None,
         conversation_history: Optional[List[Dict[str, str]]] = None,
         adaptive_threshold: bool = True,  # New parameter for adaptive threshold
+        stream_mode: str = "cumulative",
+        preliminary_sources: bool = False,
         **llm_kwargs
     ) -> Iterator[Dict[str, Any]]:
+        """流式问答
+
+        stream_mode为cumulative时每个事件携带完整的累计答案和来源，事件格式与之前保持一致；
+        为delta时检索完成后立即发送sources事件（早于大模型生成），之后只发送合并后的增量文本（delta事件），
+        最后发送带耗时的done事件。preliminary_sources为显式开启项：开启后任一模式都会提前发送sources事件，
+        启用重排序时向量召回完成即先发送一次stage为recall的sources事件，重排序后再发送stage为final的sources事件。
+        """
         start_time = time.time()
         
-        # Try with original threshold first
-        documents, retrieval_time = self.retrieve(
-            query=question,
-            top_k=top_k,
-            score_threshold=score_threshold,
-            filters=filters
-        )
+        scope = self._semantic_scope(top_k, score_threshold, filters, adaptive_threshold, llm_kwargs)
+        cached, store_context = self._semantic_lookup(question, scope, conversation_history)
+        if cached is not None:
+            yield from self._final_events(self._semantic_hit_result(question, cached, start_time), stream_mode)
+            return
         
-        # If no results and adaptive threshold is enabled, try with lower threshold
-        if not documents and adaptive_threshold and score_threshold > 0:
-            # Retry with a lower threshold
-            documents, retrieval_time = self.retrieve(
-                query=question,
-                top_k=top_k,
-                score_threshold=score_threshold * 0.5,  # Reduce threshold by half
-                filters=filters
-            )
+        documents, retrieval_time = [], 0.0
+        for stage_name, candidates, retrieval_time in self.retrieve_candidates_staged(
+            question, top_k, filters, self._semantic_embedding(store_context)
+        ):
+            documents = self._select_documents(candidates, score_threshold, adaptive_threshold)
+            if stage_name == "recall" and preliminary_sources and documents:
+                yield self._sources_event(question, self._build_sources(documents), retrieval_time, True, stage="recall")
         
         if not documents:
+            yield from self._final_events(self._no_context_result(question, retrieval_time, start_time), stream_mode)
+            return
+        
+        sources = self._build_sources(documents)
+        if stream_mode == "delta" or preliminary_sources:
+            yield self._sources_event(question, sources, retrieval_time, True)
+        
+        messages = self._build_messages(question, self.format_context(documents, question), conversation_history)
+        gen_start_time = time.time()
+        parts: List[str] = []
+        
+        chunks = timed_stream(self.llm.stream(messages, **llm_kwargs))
+        if stream_mode == "delta":
+            chunks = self._coalesce(chunks, settings.stream_coalesce_ms / 1000)
+        
+        for chunk in chunks:
+            parts.append(chunk)
+            if stream_mode == "delta":
+                yield {"event": "delta", "delta": chunk}
+                continue
             yield {
                 "question": question,
-                "answer": "抱歉，我在知识库中没有找到相关信息来回答您的问题。",
-                "sources": [],
+                "answer": "".join(parts),
+                "sources": sources,
                 "retrieval_time": retrieval_time,
-                "generation_time": 0.0,
+                "generation_time": time.time() - gen_start_time,
                 "total_time": time.time() - start_time,
-                "done": True,
-                "has_context": False  # Indicate no context was found
+                "done": False,
+                "has_context": True  # Indicate context was found
             }
-            return
         
-        context = self.format_context(documents)
+        result = {
+            "question": question,
+            "answer": "".join(parts),
+            "sources": sources,
+            "retrieval_time": retrieval_time,
+            "generation_time": time.time() - gen_start_time,
+            "total_time": time.time() - start_time,
+            "has_context": True  # Indicate context was found
+        }
+        self._semantic_store(store_context, question, result)
+        yield self._done_event(result) if stream_mode == "delta" else {**result, "done": True}
+
+    async def astream_query(
+        self,
+        question: str,
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        adaptive_threshold: bool = True,
+        stream_mode: str = "cumulative",
+        preliminary_sources: bool = False,
+        **llm_kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """stream_query的异步版本，事件格式与同步接口一致"""
+        start_time = time.time()
         
-        sources = [
-            {
-                "content": doc.page_content,
-                "score": max(0, min(1.0, score)),  # score已经是相似度分数，不需要再转换
-                "metadata": doc.metadata
-            }
-            for doc, score in documents
-        ]
+        scope = self._semantic_scope(top_k, score_threshold, filters, adaptive_threshold, llm_kwargs)
+        cached, store_context = await self._asemantic_lookup(question, scope, conversation_history)
+        if cached is not None:
+            for event in self._final_events(self._semantic_hit_result(question, cached, start_time), stream_mode):
+                yield event
+            return
         
-        messages = [
-            SystemMessage(content=self.system_prompt)
-        ]
+        documents, retrieval_time = [], 0.0
+        async for stage_name, candidates, retrieval_time in self.aretrieve_candidates_staged(
+            question, top_k, filters, self._semantic_embedding(store_context)
+        ):
+            documents = self._select_documents(candidates, score_threshold, adaptive_threshold)
+            if stage_name == "recall" and preliminary_sources and documents:
+                yield self._sources_event(question, await self._abuild_sources(documents), retrieval_time, True, stage="recall")
         
-        if conversation_history:
-            for msg in conversation_history[-6:]:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    messages.append(SystemMessage(content=msg["content"]))
+        if not documents:
+            for event in self._final_events(self._no_context_result(question, retrieval_time, start_time), stream_mode):
+                yield event
+            return
         
-        messages.append(HumanMessage(content=f"上下文信息：\n{context}\n\n问题：{question}"))
+        sources = await self._abuild_sources(documents)
+        if stream_mode == "delta" or preliminary_sources:
+            yield self._sources_event(question, sources, retrieval_time, True)
         
+        messages = self._build_messages(question, await self.aformat_context(documents, question), conversation_history)
         gen_start_time = time.time()
-        full_answer = ""
+        parts: List[str] = []
+        
+        chunks = atimed_stream(self.llm.astream(messages, **llm_kwargs))
+        if stream_mode == "delta":
+            chunks = self._acoalesce(chunks, settings.stream_coalesce_ms / 1000)
         
-        for chunk in self.llm.stream(messages, **llm_kwargs):
-            full_answer += chunk
+        async for chunk in chunks:
+            parts.append(chunk)
+            if stream_mode == "delta":
+                yield {"event": "delta", "delta": chunk}
+                continue
             yield {
                 "question": question,
-                "answer": full_answer,
+                "answer": "".join(parts),
                 "sources": sources,
                 "retrieval_time": retrieval_time,
                 "generation_time": time.time() - gen_start_time,
                 "total_time": time.time() - start_time,
                 "done": False,
-                "has_context": True  # Indicate context was found
+                "has_context": True
             }
         
-        yield {
+        result = {
             "question": question,
-            "answer": full_answer,
+            "answer": "".join(parts),
             "sources": sources,
             "retrieval_time": retrieval_time,
             "generation_time": time.time() - gen_start_time,
             "total_time": time.time() - start_time,
-            "done": True,
-            "has_context": True  # Indicate context was found
+            "has_context": True
+        }
+        self._semantic_store(store_context, question, result)
+        yield self._done_event(result) if stream_mode == "delta" else {**result, "done": True}
+
+    @staticmethod
+    def _search_result(query: str, results: List[Dict[str, Any]], start_time: float) -> Dict[str, Any]:
+        return {
+            "query": query,
+            "results": results,
+            "count": len(results),
+            "retrieval_time": time.time() - start_time
         }
 
     def search_only(
@@ -518,21 +1739,75 @@ class RAGEngine:
             filters=filters
         )
         
-        results = [
-            {
-                "content": doc.page_content,
-                "score": score,
-                "metadata": doc.metadata
-            }
-            for doc, score in documents
-        ]
+        return self._search_result(query, self._build_sources(documents), start_time)
+
+    async def asearch(
+        self,
+        query: str,
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """search_only的异步版本"""
+        start_time = time.time()
         
-        return {
-            "query": query,
-            "results": results,
-            "count": len(results),
-            "retrieval_time": time.time() - start_time
-        }
+        documents, retrieval_time = await self.aretrieve(
+            query=query,
+            top_k=top_k,
+            score_threshold=score_threshold,
+            filters=filters
+        )
+        
+        return self._search_result(query, await self._abuild_sources(documents), start_time)
+
+    def _search_chunk(
+        self,
+        queries: List[str],
+        top_k: int,
+        score_threshold: float,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        start_time = time.time()
+        try:
+            retrieved = self.retrieve_candidates_batch(queries, top_k, filters)
+        except Exception as e:
+            return [{"query": query, "error": str(e)} for query in queries]
+        
+        documents_list = [self.apply_threshold(candidates, score_threshold) for candidates, _ in retrieved]
+        # 整块的来源信息一次解析
+        sources = self._build_sources([item for documents in documents_list for item in documents])
+        results, offset = [], 0
+        for query, documents in zip(queries, documents_list):
+            results.append(self._search_result(query, sources[offset:offset + len(documents)], start_time))
+            offset += len(documents)
+        return results
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """批量检索，按分块（BATCH_CHUNK_SIZE）处理，每块完成即产出其中各查询的 (序号, 结果)"""
+        for offset in range(0, len(queries), settings.batch_chunk_size):
+            chunk = queries[offset:offset + settings.batch_chunk_size]
+            for idx, result in enumerate(self._search_chunk(chunk, top_k, score_threshold, filters)):
+                yield offset + idx, result
+
+    async def asearch_batch(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        score_threshold: float = 0.0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """search_batch的异步版本，每块在线程中执行"""
+        for offset in range(0, len(queries), settings.batch_chunk_size):
+            chunk = queries[offset:offset + settings.batch_chunk_size]
+            results = await asyncio.to_thread(self._search_chunk, chunk, top_k, score_threshold, filters)
+            for idx, result in enumerate(results):
+                yield offset + idx, result
 
     def set_system_prompt(self, prompt: str):
         self.system_prompt = prompt
@@ -545,7 +1820,21 @@ class RAGEngine:
         return {
             "vector_store_count": self.vector_store.count(),
             "llm_provider": type(self.llm).__name__,
-            "system_prompt": self.system_prompt
+            "system_prompt": self.system_prompt,
+            "query_expansion": {"mode": self.query_expansion_mode, **self.query_expander.get_stats()},
+            "semantic_cache": self.semantic_cache.get_stats() if self.semantic_cache is not None else None,
+            "neighbor_chunks": self.neighbor_expander.get_stats() if self.neighbor_expander is not None else None,
+            "reranker": self._reranker_stats()
+        }
+    
+    def _reranker_stats(self) -> Optional[Dict[str, Any]]:
+        if self.multi_path_retriever is None or self.multi_path_retriever.reranker is None:
+            return None
+        reranker = self.multi_path_retriever.reranker
+        score_cache = self.multi_path_retriever.score_cache
+        return {
+            "batching": reranker.get_stats() if hasattr(reranker, "get_stats") else None,
+            "score_cache": score_cache.get_stats() if score_cache is not None else None
         }
 
 
@@ -0,0 +1,99 @@
+from typing import List, Optional, Dict, Any, Tuple
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+import time
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """去掉首尾空白、合并连续空白并转小写，措辞相同的重复问题命中同一条缓存"""
+    return _WHITESPACE.sub(" ", query.strip()).lower()
+
+
+def query_hash(query: str) -> str:
+    return hashlib.md5(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+class RerankScoreCache:
+    """重排序分数缓存
+
+    按(归一化查询的哈希, 分块ID, 模型标识)缓存交叉编码器对单个(查询, 分块)对的打分，
+    重复的常见问题只把未命中的分块送入模型。分块ID为入库时的vector_id，分块内容入库后不变，
+    因此条目无需随知识库更新失效，只按LRU和TTL淘汰。模型标识为重排序模型的cache_key（后端类型、模型名，
+    ONNX后端还包括量化方式），同一模型在不同后端上的分数不会互相命中。
+    """
+
+    def __init__(self, max_size: int = 50000, ttl: Optional[int] = 86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[str, str, str], Tuple[float, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get_many(self, query: str, chunk_ids: List[str], model_name: str) -> List[Optional[float]]:
+        """按分块顺序返回缓存的分数，未命中或已过期为None"""
+        qhash = query_hash(query)
+        now = time.time()
+        scores: List[Optional[float]] = []
+        with self._lock:
+            for chunk_id in chunk_ids:
+                key = (qhash, chunk_id, model_name)
+                entry = self._data.get(key)
+                if entry is not None and entry[1] is not None and entry[1] <= now:
+                    del self._data[key]
+                    self.stats["expired"] += 1
+                    entry = None
+                if entry is None:
+                    self.stats["misses"] += 1
+                    scores.append(None)
+                else:
+                    self._data.move_to_end(key)
+                    self.stats["hits"] += 1
+                    scores.append(entry[0])
+        return scores
+
+    def set_many(self, query: str, scores: Dict[str, float], model_name: str):
+        """写入 分块ID -> 分数"""
+        if not scores:
+            return
+        qhash = query_hash(query)
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            for chunk_id, score in scores.items():
+                key = (qhash, chunk_id, model_name)
+                self._data[key] = (score, expires_at)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._data),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0
+            }
+
+
+_rerank_score_cache: Optional[RerankScoreCache] = None
+_rerank_score_cache_lock = threading.Lock()
+
+
+def get_rerank_score_cache(max_size: int = 50000, ttl: Optional[int] = 86400) -> RerankScoreCache:
+    """进程内共享的重排序分数缓存（分块ID全局唯一，各知识库可共用）"""
+    global _rerank_score_cache
+    if _rerank_score_cache is None:
+        with _rerank_score_cache_lock:
+            if _rerank_score_cache is None:
+                _rerank_score_cache = RerankScoreCache(max_size=max_size, ttl=ttl)
+    return _rerank_score_cache
@@ -1,10 +1,23 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from src.core.tracing import stage
+from src.core.rerank_cache import RerankScoreCache
+import os
+import queue
+import threading
+import time
+import numpy as np
 
 
 class BaseReranker(ABC):
     """重排序模型基类"""
     
+    @property
+    def cache_key(self) -> str:
+        """分数缓存中区分模型的标识：后端类型 + 模型名，同一模型的不同后端分数不共用"""
+        return f"{type(self).__name__}:{getattr(self, 'model_name', '')}"
+    
     @abstractmethod
     def rerank(
         self,
@@ -14,6 +27,42 @@ class BaseReranker(ABC):
     ) -> List[Dict[str, Any]]:
         """重排序文档"""
         pass
+    
+    def rerank_batch(
+        self,
+        queries: List[str],
+        documents_list: List[List[str]],
+        top_k: int = 10
+    ) -> List[List[Dict[str, Any]]]:
+        """批量重排序（每个查询对应一组文档）；默认逐个查询调用rerank"""
+        return [self.rerank(query, documents, top_k) for query, documents in zip(queries, documents_list)]
+    
+    @staticmethod
+    def _rank(documents: List[str], scores, top_k: int) -> List[Dict[str, Any]]:
+        results = []
+        for idx, (doc, score) in enumerate(zip(documents, scores)):
+            results.append({
+                'index': idx,
+                'content': doc,
+                'score': float(score)
+            })
+        
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results[:top_k]
+    
+    @classmethod
+    def _scatter(
+        cls,
+        documents_list: List[List[str]],
+        scores,
+        top_k: int
+    ) -> List[List[Dict[str, Any]]]:
+        """按各查询的文档数把一次打分的结果切回各查询并排序"""
+        results, offset = [], 0
+        for documents in documents_list:
+            results.append(cls._rank(documents, scores[offset:offset + len(documents)], top_k))
+            offset += len(documents)
+        return results
 
 
 class BGEReranker(BaseReranker):
@@ -22,10 +71,12 @@ class BGEReranker(BaseReranker):
     def __init__(
         self,
         model_name: str = "BAAI/bge-reranker-v2-m3",
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        batch_size: int = 32
     ):
         self.model_name = model_name
         self.device = device
+        self.batch_size = batch_size
         self._model = None
         self._tokenizer = None
     
@@ -51,18 +102,336 @@ class BGEReranker(BaseReranker):
             return []
         
         pairs = [[query, doc] for doc in documents]
-        scores = self.model.predict(pairs)
+        return self._rank(documents, self.score_pairs(pairs), top_k)
+    
+    def rerank_batch(
+        self,
+        queries: List[str],
+        documents_list: List[List[str]],
+        top_k: int = 10
+    ) -> List[List[Dict[str, Any]]]:
+        """所有查询的(查询, 文档)对合并为一次模型调用，按batch_size分批前向"""
+        pairs = [[query, doc] for query, documents in zip(queries, documents_list) for doc in documents]
+        if not pairs:
+            return [[] for _ in queries]
+        return self._scatter(documents_list, self.score_pairs(pairs), top_k)
+    
+    def score_pairs(self, pairs: List[List[str]]) -> Sequence[float]:
+        """对(查询, 文档)对打分，按batch_size分批前向"""
+        return self.model.predict(pairs, batch_size=self.batch_size)
+
+
+class ONNXReranker(BaseReranker):
+    """ONNX Runtime交叉编码器（CPU推理，可选int8动态量化，实验性）
+
+    model_path为导出目录（含model.onnx、量化后的model_quantized.onnx与分词器文件）或.onnx文件；
+    导出见ONNXReranker.export。(查询, 文档)对先按token长度排序再分批，每批只补齐到批内最长，
+    减少padding上的无效计算；分数经sigmoid输出，与CrossEncoder.predict一致。
+    """
+    
+    MODEL_FILE = "model.onnx"
+    QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+    TOKENIZER_FILES = ("tokenizer.json", "tokenizer_config.json")
+    
+    def __init__(
+        self,
+        model_path: str,
+        model_name: str = "BAAI/bge-reranker-v2-m3",
+        quantized: bool = True,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 1,
+        batch_size: int = 16,
+        max_length: int = 512
+    ):
+        self.model_path = model_path
+        self.model_name = model_name
+        self.quantized = quantized
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._session = None
+        self._tokenizer = None
+        self._input_names = None
+        self._lock = threading.Lock()
+    
+    def _model_file(self) -> str:
+        if os.path.isfile(self.model_path):
+            return self.model_path
+        quantized_file = os.path.join(self.model_path, self.QUANTIZED_MODEL_FILE)
+        if self.quantized and os.path.exists(quantized_file):
+            return quantized_file
+        model_file = os.path.join(self.model_path, self.MODEL_FILE)
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"未找到ONNX重排序模型: {model_file}")
+        return model_file
+    
+    @property
+    def cache_key(self) -> str:
+        """同一模型的fp32与int8量化版本分数不同，按实际加载的模型文件区分"""
+        try:
+            model_file = os.path.basename(self._model_file())
+        except FileNotFoundError:
+            model_file = self.QUANTIZED_MODEL_FILE if self.quantized else self.MODEL_FILE
+        return f"{super().cache_key}:{model_file}"
+    
+    def _tokenizer_source(self) -> str:
+        """导出目录中有分词器文件时从目录加载，否则按model_name从HuggingFace加载"""
+        model_dir = self.model_path if os.path.isdir(self.model_path) else os.path.dirname(self.model_path)
+        if model_dir and any(os.path.exists(os.path.join(model_dir, name)) for name in self.TOKENIZER_FILES):
+            return model_dir
+        return self.model_name
+    
+    def _load(self):
+        """懒加载推理会话与分词器"""
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise ImportError("请安装 onnxruntime: pip install onnxruntime")
+            try:
+                from transformers import AutoTokenizer
+            except ImportError:
+                raise ImportError("请安装 transformers: pip install transformers")
+            
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            # 0表示由onnxruntime按物理核数决定；与其他服务同机部署时应显式限制
+            if self.intra_op_threads > 0:
+                options.intra_op_num_threads = self.intra_op_threads
+            if self.inter_op_threads > 0:
+                options.inter_op_num_threads = self.inter_op_threads
+            
+            self._tokenizer = AutoTokenizer.from_pretrained(self._tokenizer_source())
+            session = ort.InferenceSession(self._model_file(), options, providers=["CPUExecutionProvider"])
+            self._input_names = {item.name for item in session.get_inputs()}
+            self._session = session
+    
+    def _length_buckets(self, lengths: List[int]) -> List[List[int]]:
+        """按token长度排序后切成批次，返回各批次的原始下标"""
+        order = sorted(range(len(lengths)), key=lambda idx: lengths[idx])
+        return [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+    
+    def score_pairs(self, pairs: List[List[str]]) -> Sequence[float]:
+        if not pairs:
+            return []
+        self._load()
+        encoded = self._tokenizer(
+            [query for query, _ in pairs],
+            [doc for _, doc in pairs],
+            truncation="only_second",
+            max_length=self.max_length
+        )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
         
-        results = []
-        for idx, (doc, score) in enumerate(zip(documents, scores)):
-            results.append({
-                'index': idx,
-                'content': doc,
-                'score': float(score)
-            })
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for bucket in self._length_buckets(lengths):
+            features = {name: [encoded[name][idx] for idx in bucket] for name in encoded.keys()}
+            batch = self._tokenizer.pad(features, padding="longest", return_tensors="np")
+            inputs = {name: np.asarray(value, dtype=np.int64) for name, value in batch.items() if name in self._input_names}
+            logits = self._session.run(None, inputs)[0]
+            if logits.ndim == 2 and logits.shape[1] > 1:
+                # 二分类头取正类概率
+                exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+                batch_scores = exp[:, 1] / exp.sum(axis=1)
+            else:
+                batch_scores = 1.0 / (1.0 + np.exp(-logits.reshape(-1)))
+            scores[bucket] = batch_scores
+        return scores
+    
+    def rerank(
+        self,
+        query: str,
+        documents: List[str],
+        top_k: int = 10
+    ) -> List[Dict[str, Any]]:
+        if not documents:
+            return []
+        return self._rank(documents, self.score_pairs([[query, doc] for doc in documents]), top_k)
+    
+    def rerank_batch(
+        self,
+        queries: List[str],
+        documents_list: List[List[str]],
+        top_k: int = 10
+    ) -> List[List[Dict[str, Any]]]:
+        pairs = [[query, doc] for query, documents in zip(queries, documents_list) for doc in documents]
+        if not pairs:
+            return [[] for _ in queries]
+        return self._scatter(documents_list, self.score_pairs(pairs), top_k)
+    
+    @classmethod
+    def export(cls, model_name: str, output_dir: str, quantize: bool = True) -> str:
+        """把HuggingFace交叉编码器导出为ONNX（连同分词器），并可生成int8动态量化版本；返回导出目录"""
+        try:
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+        except ImportError:
+            raise ImportError("请安装 optimum: pip install optimum[onnxruntime]")
+        from transformers import AutoTokenizer
         
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results[:top_k]
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        model.save_pretrained(output_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+        
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(
+                os.path.join(output_dir, cls.MODEL_FILE),
+                os.path.join(output_dir, cls.QUANTIZED_MODEL_FILE),
+                weight_type=QuantType.QInt8
+            )
+        return output_dir
+
+
+class _PendingPairs:
+    """排队等待打分的一组(查询, 文档)对"""
+    
+    __slots__ = ("pairs", "future")
+    
+    def __init__(self, pairs: List[List[str]]):
+        self.pairs = pairs
+        self.future: Future = Future()
+
+
+class BatchingReranker(BaseReranker):
+    """微批重排序服务
+    
+    并发请求的(查询, 文档)对进入同一队列，由一个后台线程合并为一次模型调用：
+    攒满max_batch_size对，或第一组入队后等待max_wait_ms，即开始打分，分数再按组切回各调用方。
+    CPU上大量小批次前向合并为少量大批次，吞吐显著提高；单个请求最多多等待max_wait_ms。
+    被包装的重排序模型需提供score_pairs。
+    """
+    
+    def __init__(
+        self,
+        reranker: BaseReranker,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0
+    ):
+        if not hasattr(reranker, "score_pairs"):
+            raise ValueError(f"{type(reranker).__name__} 不支持按(查询, 文档)对打分，无法微批")
+        self.reranker = reranker
+        self.model_name = getattr(reranker, "model_name", type(reranker).__name__)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_PendingPairs]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "pairs": 0, "batches": 0}
+    
+    @property
+    def cache_key(self) -> str:
+        """微批不改变分数，与被包装的模型共用缓存标识"""
+        return self.reranker.cache_key
+    
+    def _ensure_worker(self):
+        """后台线程未启动或已退出时（重新）启动"""
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+                    self._worker.start()
+    
+    def _collect(self) -> List[_PendingPairs]:
+        """阻塞取出第一组，之后在截止时间内继续合并，直到达到max_batch_size"""
+        batch = [self._queue.get()]
+        size = len(batch[0].pairs)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.pairs)
+        return batch
+    
+    def _run(self):
+        batch: List[_PendingPairs] = []
+        try:
+            while True:
+                batch = self._collect()
+                pairs = [pair for pending in batch for pair in pending.pairs]
+                try:
+                    scores = self.reranker.score_pairs(pairs)
+                except Exception as e:
+                    for pending in batch:
+                        pending.future.set_exception(e)
+                    batch = []
+                    continue
+                
+                with self._lock:
+                    self.stats["requests"] += len(batch)
+                    self.stats["pairs"] += len(pairs)
+                    self.stats["batches"] += 1
+                offset = 0
+                for pending in batch:
+                    pending.future.set_result(scores[offset:offset + len(pending.pairs)])
+                    offset += len(pending.pairs)
+                batch = []
+        except BaseException as e:
+            # 线程意外退出：当前批次和已入队的请求都带上异常返回，避免调用方永久阻塞；
+            # 下一次score_pairs会重新启动线程
+            print(f"重排序微批线程异常退出: {e}")
+            self._fail_pending(batch, e)
+    
+    def _fail_pending(self, batch: List[_PendingPairs], error: BaseException):
+        """把异常设置到当前批次及队列中所有未完成的请求上"""
+        pending_list = list(batch)
+        while True:
+            try:
+                pending_list.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for pending in pending_list:
+            if not pending.future.done():
+                pending.future.set_exception(error)
+    
+    def score_pairs(self, pairs: List[List[str]]) -> Sequence[float]:
+        """提交到队列并等待所在批次打分完成"""
+        if not pairs:
+            return []
+        pending = _PendingPairs(pairs)
+        self._queue.put(pending)
+        # 先入队再确认线程存活：线程若在入队前退出，这里会重启它来处理该请求
+        self._ensure_worker()
+        return pending.future.result()
+    
+    def rerank(
+        self,
+        query: str,
+        documents: List[str],
+        top_k: int = 10
+    ) -> List[Dict[str, Any]]:
+        if not documents:
+            return []
+        return self._rank(documents, self.score_pairs([[query, doc] for doc in documents]), top_k)
+    
+    def rerank_batch(
+        self,
+        queries: List[str],
+        documents_list: List[List[str]],
+        top_k: int = 10
+    ) -> List[List[Dict[str, Any]]]:
+        pairs = [[query, doc] for query, documents in zip(queries, documents_list) for doc in documents]
+        if not pairs:
+            return [[] for _ in queries]
+        return self._scatter(documents_list, self.score_pairs(pairs), top_k)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["avg_batch_pairs"] = round(stats["pairs"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
 
 
 class CohereReranker(BaseReranker):
@@ -75,6 +444,7 @@ class CohereReranker(BaseReranker):
     ):
         self.api_key = api_key
         self.model = model
+        self.model_name = model
     
     def rerank(
         self,
@@ -126,7 +496,19 @@ class RerankerFactory:
         if reranker_type == "bge":
             return BGEReranker(
                 model_name=kwargs.get("model_name", "BAAI/bge-reranker-v2-m3"),
-                device=kwargs.get("device")
+                device=kwargs.get("device"),
+                batch_size=kwargs.get("batch_size", 32)
+            )
+        elif reranker_type == "onnx":
+            # 实验性后端：与BGEReranker的基准对比（scripts/benchmark_reranker.py）完成前不列入配置文档
+            return ONNXReranker(
+                model_path=kwargs.get("model_path") or "./models/bge-reranker-onnx",
+                model_name=kwargs.get("model_name", "BAAI/bge-reranker-v2-m3"),
+                quantized=kwargs.get("quantized", True),
+                intra_op_threads=kwargs.get("intra_op_threads", 0),
+                inter_op_threads=kwargs.get("inter_op_threads", 1),
+                batch_size=kwargs.get("batch_size", 16),
+                max_length=kwargs.get("max_length", 512)
             )
         elif reranker_type == "cohere":
             return CohereReranker(
@@ -137,6 +519,30 @@ class RerankerFactory:
             raise ValueError(f"不支持的重排序模型类型: {reranker_type}")
 
 
+_shared_rerankers: Dict[tuple, BatchingReranker] = {}
+_shared_rerankers_lock = threading.Lock()
+
+
+def get_batching_reranker(
+    reranker_type: str = "bge",
+    max_batch_size: int = 64,
+    max_wait_ms: float = 5.0,
+    **kwargs
+) -> BatchingReranker:
+    """进程内共享的微批重排序服务：同一模型只加载一次，所有知识库的并发请求在同一队列中合并"""
+    key = (reranker_type.lower(), tuple(sorted(kwargs.items())))
+    with _shared_rerankers_lock:
+        reranker = _shared_rerankers.get(key)
+        if reranker is None:
+            reranker = BatchingReranker(
+                RerankerFactory.create(reranker_type, **kwargs),
+                max_batch_size=max_batch_size,
+                max_wait_ms=max_wait_ms
+            )
+            _shared_rerankers[key] = reranker
+        return reranker
+
+
 class QueryRewriter:
     """查询改写器"""
     
@@ -201,52 +607,117 @@ class MultiPathRetriever:
         hybrid_retriever,
         reranker: Optional[BaseReranker] = None,
         query_rewriter: Optional[QueryRewriter] = None,
-        num_paths: int = 3
+        num_paths: int = 3,
+        score_cache: Optional[RerankScoreCache] = None
     ):
         self.hybrid_retriever = hybrid_retriever
         self.reranker = reranker
         self.query_rewriter = query_rewriter
         self.num_paths = num_paths
+        self.score_cache = score_cache
     
     def retrieve(
         self,
         query: str,
         vector_results: List[Dict[str, Any]],
-        top_k: int = 10
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        bm25_results: Optional[List[Dict[str, Any]]] = None
     ) -> List[Dict[str, Any]]:
-        """多路召回检索"""
+        """多路召回检索
+
+        bm25_results为原始查询已完成的BM25召回结果（top_k * 4），第一路直接使用。
+        """
         all_results = []
+        path_queries = self._path_queries(query)
         
-        for path_idx in range(self.num_paths):
-            if path_idx == 0:
-                current_query = query
-            else:
-                if self.query_rewriter:
-                    variations = self.query_rewriter.rewrite_query(query, num_variations=self.num_paths - 1)
-                    if path_idx - 1 < len(variations):
-                        current_query = variations[path_idx - 1]
-                    else:
-                        current_query = query
-                else:
-                    current_query = query
-            
-            path_results = self.hybrid_retriever.hybrid_search(
-                current_query,
-                vector_results,
-                top_k=top_k * 2
-            )
+        # 改写查询的BM25召回在hybrid_search内完成，计入融合阶段
+        with stage("fusion"):
+            for path_idx, current_query in enumerate(path_queries):
+                path_results = self.hybrid_retriever.hybrid_search(
+                    current_query,
+                    vector_results,
+                    top_k=top_k * 2,
+                    filters=filters,
+                    bm25_results=bm25_results if path_idx == 0 else None
+                )
+                
+                for result in path_results:
+                    all_results.append({**result, 'path': path_idx})
             
-            for result in path_results:
-                result['path'] = path_idx
-                all_results.append(result)
-        
-        fused_results = self._fuse_multi_path(all_results, top_k)
+            fused_results = self._fuse_multi_path(all_results, top_k)
         
         if self.reranker:
-            fused_results = self._rerank_results(query, fused_results, top_k)
+            with stage("rerank"):
+                fused_results = self._rerank_results(query, fused_results, top_k)
         
         return fused_results
     
+    def _path_queries(self, query: str) -> List[str]:
+        """每一路使用的查询：第一路为原始查询，其余为改写结果（改写不足时用原始查询补齐）"""
+        path_queries = [query]
+        if self.num_paths > 1 and self.query_rewriter:
+            with stage("expansion"):
+                variations = self.query_rewriter.rewrite_query(query, num_variations=self.num_paths - 1)
+            path_queries.extend(variations[:self.num_paths - 1])
+        path_queries.extend([query] * (self.num_paths - len(path_queries)))
+        return path_queries
+    
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        vector_results_list: List[List[Dict[str, Any]]],
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        bm25_results_list: Optional[List[List[Dict[str, Any]]]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """批量多路召回
+
+        各路查询中需要单独BM25召回的（去重后）合并为一次批量检索，融合后所有查询的候选一次重排序。
+        """
+        path_queries_list = [self._path_queries(query) for query in queries]
+        
+        pending = set()
+        for path_queries in path_queries_list:
+            for path_idx, current_query in enumerate(path_queries):
+                if path_idx > 0 or bm25_results_list is None:
+                    pending.add(current_query)
+        pending = sorted(pending)
+        with stage("bm25"):
+            bm25_by_query = dict(zip(
+                pending,
+                self.hybrid_retriever.batch_bm25_search(pending, top_k=top_k * 4, filters=filters)
+            ))
+        
+        fused_list = []
+        with stage("fusion"):
+            for idx, path_queries in enumerate(path_queries_list):
+                all_results = []
+                for path_idx, current_query in enumerate(path_queries):
+                    if path_idx == 0 and bm25_results_list is not None:
+                        bm25_results = bm25_results_list[idx]
+                    else:
+                        bm25_results = bm25_by_query[current_query]
+                    path_results = self.hybrid_retriever.hybrid_search(
+                        current_query,
+                        vector_results_list[idx],
+                        top_k=top_k * 2,
+                        filters=filters,
+                        bm25_results=bm25_results
+                    )
+                    all_results.extend({**result, 'path': path_idx} for result in path_results)
+                fused_list.append(self._fuse_multi_path(all_results, top_k))
+        
+        if self.reranker:
+            with stage("rerank"):
+                reranked_list = self._score(queries, fused_list, top_k)
+            fused_list = [
+                self._apply_rerank(results, reranked, top_k)
+                for results, reranked in zip(fused_list, reranked_list)
+            ]
+        
+        return fused_list
+    
     def _fuse_multi_path(
         self,
         results: List[Dict[str, Any]],
@@ -256,14 +727,15 @@ class MultiPathRetriever:
         fused = {}
         
         for result in results:
-            idx = result['index']
+            idx = result.get('key', result['index'])
             if idx not in fused:
                 fused[idx] = {
-                    'index': idx,
+                    **result,
                     'score': result['score'],
                     'paths': set(),
                     'content': result.get('content', '')
                 }
+                fused[idx].pop('path', None)
             else:
                 fused[idx]['score'] = max(fused[idx]['score'], result['score'])
             
@@ -286,9 +758,80 @@ class MultiPathRetriever:
         if not results:
             return []
         
-        documents = [r.get('content', '') for r in results]
-        reranked = self.reranker.rerank(query, documents, top_k)
+        reranked = self._score([query], [results], top_k)[0]
+        return self._apply_rerank(results, reranked, top_k)
+    
+    @staticmethod
+    def _chunk_id(result: Dict[str, Any]) -> Optional[str]:
+        """分块ID（入库时的vector_id）；仅由BM25召回的结果以vector_id为key"""
+        document = result.get('document')
+        if document is not None:
+            return document.metadata.get('vector_id')
+        return result.get('key')
+    
+    def _score(
+        self,
+        queries: List[str],
+        results_list: List[List[Dict[str, Any]]],
+        top_k: int
+    ) -> List[List[Dict[str, Any]]]:
+        """对各查询的候选打分；启用分数缓存时只把未命中的(查询, 分块)对送入模型（所有查询合并为一次调用）"""
+        documents_list = [[r.get('content', '') for r in results] for results in results_list]
+        if self.score_cache is None:
+            if len(queries) == 1:
+                return [self.reranker.rerank(queries[0], documents_list[0], top_k)]
+            return self.reranker.rerank_batch(queries, documents_list, top_k)
+        
+        model_name = getattr(self.reranker, "cache_key", None) or type(self.reranker).__name__
+        chunk_ids_list = [[self._chunk_id(r) for r in results] for results in results_list]
+        scores_list = []
+        pending = []
+        for query, chunk_ids in zip(queries, chunk_ids_list):
+            # 没有分块ID的候选不缓存，总是送入模型
+            positions = [pos for pos, chunk_id in enumerate(chunk_ids) if chunk_id]
+            cached: List[Optional[float]] = [None] * len(chunk_ids)
+            hits = self.score_cache.get_many(query, [chunk_ids[pos] for pos in positions], model_name)
+            for pos, score in zip(positions, hits):
+                cached[pos] = score
+            scores_list.append(cached)
+            pending.append([pos for pos, score in enumerate(cached) if score is None])
         
+        miss_queries = [query for query, missing in zip(queries, pending) if missing]
+        if miss_queries:
+            miss_positions = [idx for idx, missing in enumerate(pending) if missing]
+            miss_documents = [[documents_list[idx][pos] for pos in pending[idx]] for idx in miss_positions]
+            reranked_list = self.reranker.rerank_batch(
+                miss_queries,
+                miss_documents,
+                max(len(documents) for documents in miss_documents)
+            )
+            for idx, reranked in zip(miss_positions, reranked_list):
+                fresh = {}
+                for item in reranked:
+                    pos = pending[idx][item['index']]
+                    scores_list[idx][pos] = item['score']
+                    chunk_id = chunk_ids_list[idx][pos]
+                    if chunk_id:
+                        fresh[chunk_id] = item['score']
+                self.score_cache.set_many(queries[idx], fresh, model_name)
+        
+        reranked_list = []
+        for documents, scores in zip(documents_list, scores_list):
+            reranked = [
+                {'index': idx, 'content': documents[idx], 'score': float(score)}
+                for idx, score in enumerate(scores) if score is not None
+            ]
+            reranked.sort(key=lambda x: x['score'], reverse=True)
+            reranked_list.append(reranked[:top_k])
+        return reranked_list
+    
+    @staticmethod
+    def _apply_rerank(
+        results: List[Dict[str, Any]],
+        reranked: List[Dict[str, Any]],
+        top_k: int
+    ) -> List[Dict[str, Any]]:
+        """把重排序分数写回候选并按其排序"""
         for rerank_result in reranked:
             original_idx = rerank_result['index']
             if original_idx < len(results):
@@ -0,0 +1,159 @@
+from typing import List, Optional, Dict, Any, Callable
+import copy
+import threading
+import time
+import numpy as np
+
+
+# 进程内的知识库内容版本号，文档增删时由知识库服务递增；不依赖检索缓存，ENABLE_CACHE关闭时答案缓存也能失效
+_answer_versions: Dict[str, int] = {}
+_answer_versions_lock = threading.Lock()
+
+
+def get_answer_version(kb_id: str) -> int:
+    with _answer_versions_lock:
+        return _answer_versions.get(kb_id, 0)
+
+
+def bump_answer_version(kb_id: str) -> int:
+    with _answer_versions_lock:
+        _answer_versions[kb_id] = _answer_versions.get(kb_id, 0) + 1
+        return _answer_versions[kb_id]
+
+
+class SemanticAnswerCache:
+    """语义答案缓存
+
+    保存已回答问题的向量，新问题与同一作用域（检索参数相同）内的历史问题做余弦相似度最近邻查找，
+    超过阈值直接返回缓存的答案和来源，不再检索和调用大模型。
+    version_getter返回知识库内容版本号（可比较相等的任意值），版本变化时清空全部条目。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl: Optional[int] = 3600,
+        version_getter: Optional[Callable[[], Any]] = None
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_getter = version_getter
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._scope_ids = np.empty(0, dtype=np.int64)
+        self._expires = np.empty(0, dtype=np.float64)
+        self._entries: List[Dict[str, Any]] = []
+        self._scopes: Dict[str, int] = {}
+        self._version: Any = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+
+    def _clear_locked(self):
+        self._vectors = None
+        self._scope_ids = np.empty(0, dtype=np.int64)
+        self._expires = np.empty(0, dtype=np.float64)
+        self._entries = []
+        self._scopes = {}
+
+    def _keep_locked(self, keep):
+        self._entries = [self._entries[idx] for idx in keep] if isinstance(keep, list) else self._entries[keep]
+        self._vectors = self._vectors[keep] if len(self._entries) else None
+        self._scope_ids = self._scope_ids[keep]
+        self._expires = self._expires[keep]
+
+    def current_version(self) -> Any:
+        """读取知识库版本号，变化时使缓存失效；检索前调用，返回值在写入缓存时传回"""
+        if self.version_getter is None:
+            return None
+        version = self.version_getter()
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.stats["invalidations"] += 1
+                self._clear_locked()
+                self._version = version
+        return version
+
+    def lookup(self, embedding, scope: str) -> Optional[Dict[str, Any]]:
+        vector = self._normalize(embedding)
+        with self._lock:
+            if vector is None or self._vectors is None:
+                self.stats["misses"] += 1
+                return None
+            if self._vectors.shape[1] != vector.shape[0]:
+                # 嵌入模型变化，旧向量不可比
+                self._clear_locked()
+                self.stats["misses"] += 1
+                return None
+
+            scope_id = self._scopes.get(scope)
+            if scope_id is None:
+                self.stats["misses"] += 1
+                return None
+            similarities = self._vectors @ vector
+            similarities[(self._scope_ids != scope_id) | (self._expires <= time.time())] = -1.0
+
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            self.stats["hits"] += 1
+            entry = self._entries[best]
+            result = copy.deepcopy(entry["result"])
+        result["cached_question"] = entry["question"]
+        result["similarity"] = float(similarities[best])
+        return result
+
+    def store(self, embedding, scope: str, question: str, result: Dict[str, Any], version: Any = None):
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            # 检索期间知识库内容已变化，结果可能过期，不写入
+            if version != self._version:
+                return
+            if self._vectors is not None and self._vectors.shape[1] != vector.shape[0]:
+                self._clear_locked()
+
+            self._purge_expired_locked()
+            if len(self._entries) >= self.max_entries:
+                # 超出容量时淘汰最早写入的条目
+                self._keep_locked(slice(len(self._entries) - self.max_entries + 1, None))
+
+            self._entries.append({"question": question, "result": copy.deepcopy(result)})
+            row = vector[np.newaxis, :]
+            self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+            scope_id = self._scopes.setdefault(scope, len(self._scopes))
+            self._scope_ids = np.append(self._scope_ids, scope_id)
+            self._expires = np.append(self._expires, time.time() + self.ttl if self.ttl else np.inf)
+            self.stats["stores"] += 1
+
+    def _purge_expired_locked(self):
+        if not self._entries:
+            return
+        alive = self._expires > time.time()
+        if not alive.all():
+            self._keep_locked(np.flatnonzero(alive).tolist())
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0
+            }
@@ -0,0 +1,98 @@
+from typing import List, Optional, Dict, Any, Iterable
+import asyncio
+import threading
+
+
+class SourceMetadataResolver:
+    """来源文件元数据解析：file_path -> {file_name, document_id}
+
+    指定知识库时首次使用加载该知识库全部文档的映射（一次查询），之后由入库/删除时的add/remove保持同步；
+    映射中没有的路径（例如由其他副本入库）合并为一次IN查询补齐。
+    """
+
+    def __init__(self, db_manager, knowledge_base_id: Optional[str] = None):
+        self.db_manager = db_manager
+        self.knowledge_base_id = knowledge_base_id
+        self._map: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _query(self, file_paths: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        from src.models.database import Document as DBDocument
+
+        session = self.db_manager.get_session()
+        try:
+            query = session.query(DBDocument.file_path, DBDocument.file_name, DBDocument.id)
+            if self.knowledge_base_id:
+                query = query.filter(DBDocument.knowledge_base_id == self.knowledge_base_id)
+            if file_paths is not None:
+                query = query.filter(DBDocument.file_path.in_(file_paths))
+            return {
+                file_path: {"file_name": file_name, "document_id": doc_id}
+                for file_path, file_name, doc_id in query.all()
+                if file_path
+            }
+        finally:
+            session.close()
+
+    def _ensure_loaded(self):
+        if self._loaded or not self.knowledge_base_id:
+            return
+        mapping = self._query()
+        with self._lock:
+            if not self._loaded:
+                self._map.update(mapping)
+                self._loaded = True
+
+    def missing(self, file_paths: Iterable[str]) -> List[str]:
+        with self._lock:
+            if self.knowledge_base_id and not self._loaded:
+                return list(dict.fromkeys(path for path in file_paths if path))
+            return list(dict.fromkeys(path for path in file_paths if path and path not in self._map))
+
+    def resolve(self, file_paths: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        file_paths = [path for path in file_paths if path]
+        if not file_paths:
+            return {}
+        try:
+            self._ensure_loaded()
+            misses = self.missing(file_paths)
+            if misses:
+                found = self._query(misses)
+                with self._lock:
+                    self._map.update(found)
+        except Exception as e:
+            print(f"查询来源文件信息失败: {e}")
+        with self._lock:
+            return {path: self._map[path] for path in file_paths if path in self._map}
+
+    async def aresolve(self, file_paths: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """全部命中内存映射时直接返回，需要查库时放到线程中执行"""
+        file_paths = list(file_paths)
+        if self.missing(file_paths):
+            return await asyncio.to_thread(self.resolve, file_paths)
+        return self.resolve(file_paths)
+
+    def enrich(self, metadatas: List[Dict[str, Any]], resolved: Dict[str, Dict[str, Any]]) -> None:
+        """用解析结果补全元数据中的file_name和document_id"""
+        for metadata in metadatas:
+            info = resolved.get(metadata.get("source", ""))
+            if info:
+                metadata["file_name"] = info["file_name"]
+                if not metadata.get("document_id"):
+                    metadata["document_id"] = info["document_id"]
+
+    def add(self, file_path: str, file_name: str, document_id: str):
+        if not file_path:
+            return
+        with self._lock:
+            self._map[file_path] = {"file_name": file_name, "document_id": document_id}
+
+    def remove(self, file_path: str):
+        with self._lock:
+            self._map.pop(file_path, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._map.clear()
+            self._loaded = False
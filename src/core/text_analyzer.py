@@ -0,0 +1,150 @@
+from typing import List, Optional, Iterable, Set
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import hashlib
+import re
+import unicodedata
+
+
+CJK_RANGES = "㐀-䶿一-鿿豈-﫿"
+TOKEN_PATTERN = re.compile(f"([{CJK_RANGES}]+)|([^\\W{CJK_RANGES}]+)")
+CJK_PATTERN = re.compile(f"[{CJK_RANGES}]+")
+
+DEFAULT_STOPWORDS = {
+    "的", "了", "着", "是", "在", "和", "与", "及", "或", "而", "也", "都", "就", "把", "被",
+    "这", "那", "之", "其", "吗", "呢", "吧", "啊", "我", "你", "他", "她", "它",
+    "我们", "你们", "他们", "什么", "怎么", "如何", "哪些", "是否", "请问", "一个",
+    "the", "a", "an", "of", "to", "in", "on", "for", "and", "or", "is", "are", "was", "be",
+    "with", "as", "by", "at", "it", "this", "that", "from"
+}
+
+
+def normalize_text(text: str) -> str:
+    """全角转半角（NFKC）并转小写"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+class BaseAnalyzer(ABC):
+    """BM25分词器基类"""
+
+    def __init__(self, cache_size: int = 4096):
+        self._cached_analyze = lru_cache(maxsize=cache_size)(self._analyze_tuple)
+
+    @property
+    @abstractmethod
+    def signature(self) -> str:
+        """分词配置标识，入库时与分词结果一起保存，配置变化后需重新分词"""
+        pass
+
+    @abstractmethod
+    def _analyze(self, text: str) -> List[str]:
+        pass
+
+    def _analyze_tuple(self, text: str):
+        return tuple(self._analyze(text))
+
+    def analyze(self, text: str) -> List[str]:
+        """分词（短文本结果带缓存，主要用于重复查询）"""
+        if len(text) <= 512:
+            return list(self._cached_analyze(text))
+        return self._analyze(text)
+
+
+class StandardAnalyzer(BaseAnalyzer):
+    """按空白切分，去除标点"""
+
+    @property
+    def signature(self) -> str:
+        return "standard:v1"
+
+    def _analyze(self, text: str) -> List[str]:
+        text = normalize_text(text)
+        text = re.sub(r'[^\w\s]', '', text)
+        return text.split()
+
+
+class ChineseAnalyzer(BaseAnalyzer):
+    """中文分词器
+
+    中文片段切分为字符二元组（bigram），单字片段保留单字；可选叠加词典分词（jieba）结果。
+    非中文片段按字母数字切词。多字中文停用词（如“我们”“什么”）作为中文片段的切分点；
+    单字停用词（如“其”“在”“和”）常是普通复合词的一部分（其他、在线、和平），不作切分点，
+    只在切分后去掉本身是停用词的单字与二元组。
+    """
+
+    def __init__(
+        self,
+        use_dictionary: bool = False,
+        stopwords: Optional[Iterable[str]] = None,
+        cache_size: int = 4096
+    ):
+        super().__init__(cache_size=cache_size)
+        self.stopwords: Set[str] = set(DEFAULT_STOPWORDS if stopwords is None else stopwords)
+
+        # 只按多字停用词切分，长停用词优先匹配
+        cjk_stopwords = sorted(
+            (word for word in self.stopwords if len(word) > 1 and CJK_PATTERN.fullmatch(word)),
+            key=len,
+            reverse=True
+        )
+        self._separator = re.compile("|".join(map(re.escape, cjk_stopwords))) if cjk_stopwords else None
+
+        self._jieba = None
+        if use_dictionary:
+            try:
+                import jieba
+                self._jieba = jieba
+            except ImportError:
+                raise ImportError("请安装 jieba: pip install jieba")
+
+    @property
+    def signature(self) -> str:
+        # 停用词表内容变化（而不仅是数量变化）也需要重新分词
+        stop_hash = hashlib.md5("\n".join(sorted(self.stopwords)).encode("utf-8")).hexdigest()[:12]
+        return f"chinese:v2:dict={int(self._jieba is not None)}:stop={stop_hash}"
+
+    def _split_cjk(self, run: str) -> List[str]:
+        if self._separator is None:
+            return [run]
+        return [part for part in self._separator.split(run) if part]
+
+    def _analyze(self, text: str) -> List[str]:
+        text = normalize_text(text)
+        tokens: List[str] = []
+        for match in TOKEN_PATTERN.finditer(text):
+            cjk_run, word = match.group(1), match.group(2)
+            if word:
+                if word not in self.stopwords:
+                    tokens.append(word)
+                continue
+
+            for part in self._split_cjk(cjk_run):
+                if len(part) == 1:
+                    grams = [part]
+                else:
+                    grams = [part[i:i + 2] for i in range(len(part) - 1)]
+                tokens.extend(gram for gram in grams if gram not in self.stopwords)
+            if self._jieba is not None:
+                tokens.extend(
+                    word for word in self._jieba.lcut_for_search(cjk_run)
+                    if len(word) > 2 and word not in self.stopwords
+                )
+        return tokens
+
+
+class AnalyzerFactory:
+    """分词器工厂"""
+
+    @staticmethod
+    def create(analyzer_type: str = "chinese", **kwargs) -> BaseAnalyzer:
+        analyzer_type = analyzer_type.lower()
+
+        if analyzer_type == "chinese":
+            return ChineseAnalyzer(
+                use_dictionary=kwargs.get("use_dictionary", False),
+                stopwords=kwargs.get("stopwords")
+            )
+        elif analyzer_type == "standard":
+            return StandardAnalyzer()
+        else:
+            raise ValueError(f"不支持的分词器类型: {analyzer_type}")
@@ -0,0 +1,130 @@
+from typing import Optional, Dict, Tuple, Iterator, AsyncIterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+import threading
+
+try:
+    from prometheus_client import Histogram, generate_latest, CONTENT_TYPE_LATEST
+except ImportError:
+    Histogram = None
+    generate_latest = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+STAGES = (
+    "expansion",
+    "embedding",
+    "vector_search",
+    "bm25",
+    "mmr",
+    "fusion",
+    "rerank",
+    "neighbor_expansion",
+    "compression",
+    "context_build",
+    "llm_first_token",
+    "llm_completion",
+    "db_log"
+)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_stage_histogram = None
+if Histogram is not None:
+    _stage_histogram = Histogram(
+        "rag_stage_duration_seconds",
+        "RAG请求各阶段耗时（秒）",
+        ["stage"],
+        buckets=STAGE_BUCKETS
+    )
+
+
+class Trace:
+    """一次请求的分阶段耗时，同一阶段多次执行（如批量、多路召回）时累加"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds, 6) for name, seconds in self.timings.items()}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("rag_trace", default=None)
+
+
+def start_trace() -> Trace:
+    """为当前请求（当前上下文）开始记录；之后在同一上下文及其派生的任务/线程中执行的阶段都计入该Trace"""
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def _check_stage(name: str):
+    """阶段名即Prometheus标签值，只允许STAGES中的固定取值，避免标签基数无界增长"""
+    if name not in STAGES:
+        raise ValueError(f"未知的阶段名: {name}，可选: {', '.join(STAGES)}")
+
+
+def record(name: str, seconds: float):
+    """记录一个阶段的耗时：写入直方图，并计入当前请求的Trace（如有）"""
+    _check_stage(name)
+    if _stage_histogram is not None:
+        _stage_histogram.labels(stage=name).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    _check_stage(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def timed_stream(chunks: Iterator[str]) -> Iterator[str]:
+    """大模型流式输出计时：首个片段到达记为llm_first_token，输出结束记为llm_completion"""
+    started = time.perf_counter()
+    first = True
+    try:
+        for chunk in chunks:
+            if first:
+                record("llm_first_token", time.perf_counter() - started)
+                first = False
+            yield chunk
+    finally:
+        record("llm_completion", time.perf_counter() - started)
+
+
+async def atimed_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    started = time.perf_counter()
+    first = True
+    try:
+        async for chunk in chunks:
+            if first:
+                record("llm_first_token", time.perf_counter() - started)
+                first = False
+            yield chunk
+    finally:
+        record("llm_completion", time.perf_counter() - started)
+
+
+def export_metrics() -> Tuple[bytes, str]:
+    """Prometheus文本格式的指标及其Content-Type"""
+    if generate_latest is None:
+        raise ImportError("请安装 prometheus-client: pip install prometheus-client")
+    return generate_latest(), CONTENT_TYPE_LATEST
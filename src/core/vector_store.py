@@ -5,6 +5,7 @@ from typing import List, Optional, Dict, Any, Tuple
 from abc import ABC, abstractmethod
 from src.config.settings import get_settings
 from src.core.embeddings import BaseEmbeddings
+import asyncio
 import os
 
 settings = get_settings()
@@ -35,6 +36,101 @@ class BaseVectorStore(ABC):
     ) -> List[Tuple[Document, float]]:
         pass
 
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> List[Tuple[Document, float]]:
+        """异步相似度检索；默认在线程中调用同步接口"""
+        return await asyncio.to_thread(self.similarity_search_with_score, query, k, filter, **kwargs)
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        """按已计算好的查询向量检索，分数含义与similarity_search_with_score一致"""
+        raise NotImplementedError(f"{type(self).__name__} 不支持按向量检索")
+
+    async def asimilarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        return await asyncio.to_thread(self.similarity_search_by_vector_with_score, embedding, k, filter)
+
+    def batch_similarity_search_by_vector_with_score(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """多向量检索，返回与embeddings一一对应的结果；默认逐个检索，支持多向量查询的后端覆盖"""
+        return [self.similarity_search_by_vector_with_score(embedding, k, filter) for embedding in embeddings]
+
+    def similarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float, List[float]]]:
+        """按向量检索并返回候选自身的向量 (document, score, vector)，用于MMR等无需重新嵌入的后处理"""
+        raise NotImplementedError(f"{type(self).__name__} 不支持返回候选向量")
+
+    async def asimilarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float, List[float]]]:
+        return await asyncio.to_thread(self.similarity_search_with_vectors_by_vector, embedding, k, filter)
+
+    def batch_similarity_search_with_vectors_by_vector(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[Document, float, List[float]]]]:
+        return [self.similarity_search_with_vectors_by_vector(embedding, k, filter) for embedding in embeddings]
+
+    def batch_similarity_search_with_score(
+        self,
+        queries: List[str],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """多查询相似度检索，返回与queries一一对应的结果：查询向量一次批量计算后按向量检索"""
+        embedding_function = getattr(self, "embedding_function", None)
+        if embedding_function is None:
+            return [self.similarity_search_with_score(query, k, filter) for query in queries]
+        if not queries:
+            return []
+        return self.batch_similarity_search_by_vector_with_score(embedding_function.embed_queries(queries), k, filter)
+
+    @staticmethod
+    def _with_vector_id(document: Document, record_id: Optional[Any] = None) -> Document:
+        """用向量库记录ID补全metadata中的vector_id
+
+        记录ID即入库时DocumentChunk.vector_id和BM25索引的key；早期入库的分块metadata中没有vector_id，
+        不补全时同一分块在向量与BM25两路中的key不一致，混合检索会重复返回。
+        """
+        if document.metadata.get("vector_id"):
+            return document
+        record_id = record_id or getattr(document, "id", None) or document.metadata.get("_id")
+        if record_id:
+            document.metadata = {**document.metadata, "vector_id": str(record_id)}
+        return document
+
+    @classmethod
+    def _with_vector_ids(cls, results: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        for document, _ in results:
+            cls._with_vector_id(document)
+        return results
+
     @abstractmethod
     def delete(self, ids: List[str], **kwargs) -> None:
         pass
@@ -87,12 +183,90 @@ class ChromaVectorStore(BaseVectorStore):
         filter: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> List[Tuple[Document, float]]:
-        return self.vector_store.similarity_search_with_score(
+        return self._with_vector_ids(self.vector_store.similarity_search_with_score(
             query=query,
             k=k,
             filter=filter,
             **kwargs
+        ))
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> List[Tuple[Document, float]]:
+        return self._with_vector_ids(await self.vector_store.asimilarity_search_with_score(
+            query=query,
+            k=k,
+            filter=filter,
+            **kwargs
+        ))
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        return self.batch_similarity_search_by_vector_with_score([embedding], k, filter)[0]
+
+    def batch_similarity_search_by_vector_with_score(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """Chroma一次请求完成多向量查询"""
+        return [
+            [(doc, distance) for doc, distance, _ in results]
+            for results in self._query(embeddings, k, filter, with_vectors=False)
+        ]
+
+    def similarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float, List[float]]]:
+        return self._query([embedding], k, filter, with_vectors=True)[0]
+
+    def batch_similarity_search_with_vectors_by_vector(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[Document, float, List[float]]]]:
+        return self._query(embeddings, k, filter, with_vectors=True)
+
+    def _query(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        filter: Optional[Dict[str, Any]],
+        with_vectors: bool
+    ) -> List[List[Tuple[Document, float, Optional[List[float]]]]]:
+        if not embeddings:
+            return []
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_vectors else [])
+        results = self.vector_store._collection.query(
+            query_embeddings=embeddings,
+            n_results=k,
+            where=filter or None,
+            include=include
         )
+        output = []
+        for idx in range(len(embeddings)):
+            vectors = results["embeddings"][idx] if with_vectors else [None] * len(results["documents"][idx])
+            output.append([
+                (self._with_vector_id(Document(page_content=content, metadata=metadata or {}), record_id), distance, vector)
+                for record_id, content, metadata, distance, vector in zip(
+                    results["ids"][idx], results["documents"][idx], results["metadatas"][idx],
+                    results["distances"][idx], vectors
+                )
+            ])
+        return output
 
     def delete(self, ids: List[str], **kwargs) -> None:
         self.vector_store.delete(ids=ids, **kwargs)
@@ -156,12 +330,66 @@ class PineconeVectorStore(BaseVectorStore):
         filter: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> List[Tuple[Document, float]]:
-        return self.vector_store.similarity_search_with_score(
+        return self._with_vector_ids(self.vector_store.similarity_search_with_score(
             query=query,
             k=k,
             filter=filter,
             **kwargs
+        ))
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> List[Tuple[Document, float]]:
+        return self._with_vector_ids(await self.vector_store.asimilarity_search_with_score(
+            query=query,
+            k=k,
+            filter=filter,
+            **kwargs
+        ))
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        # Pinecone单次查询只接受一个向量，批量时逐个检索
+        return [(doc, score) for doc, score, _ in self._query(embedding, k, filter, with_vectors=False)]
+
+    def similarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float, List[float]]]:
+        return self._query(embedding, k, filter, with_vectors=True)
+
+    def _query(
+        self,
+        embedding: List[float],
+        k: int,
+        filter: Optional[Dict[str, Any]],
+        with_vectors: bool
+    ) -> List[Tuple[Document, float, Optional[List[float]]]]:
+        response = self.vector_store._index.query(
+            vector=embedding,
+            top_k=k,
+            include_metadata=True,
+            include_values=with_vectors,
+            filter=filter
         )
+        text_key = self.vector_store._text_key
+        results = []
+        for match in response["matches"]:
+            metadata = dict(match.get("metadata") or {})
+            content = metadata.pop(text_key, "")
+            document = self._with_vector_id(Document(page_content=content, metadata=metadata), match["id"])
+            results.append((document, match["score"], match["values"] if with_vectors else None))
+        return results
 
     def delete(self, ids: List[str], **kwargs) -> None:
         self.vector_store.delete(ids=ids, **kwargs)
@@ -227,12 +455,70 @@ class QdrantVectorStore(BaseVectorStore):
         filter: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> List[Tuple[Document, float]]:
-        return self.vector_store.similarity_search_with_score(
+        return self._with_vector_ids(self.vector_store.similarity_search_with_score(
+            query=query,
+            k=k,
+            filter=filter,
+            **kwargs
+        ))
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> List[Tuple[Document, float]]:
+        return self._with_vector_ids(await self.vector_store.asimilarity_search_with_score(
             query=query,
             k=k,
             filter=filter,
             **kwargs
+        ))
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        return self._with_vector_ids(self.vector_store.similarity_search_with_score_by_vector(embedding, k=k, filter=filter))
+
+    async def asimilarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        return self._with_vector_ids(
+            await self.vector_store.asimilarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+        )
+
+    def similarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float, List[float]]]:
+        store = self.vector_store
+        points = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=(store.vector_name, embedding) if store.vector_name else embedding,
+            query_filter=store._qdrant_filter_from_dict(filter),
+            limit=k,
+            with_payload=True,
+            with_vectors=True
         )
+        results = []
+        for point in points:
+            payload = point.payload or {}
+            vector = point.vector[store.vector_name] if store.vector_name else point.vector
+            document = self._with_vector_id(Document(
+                page_content=payload.get(store.content_payload_key, ""),
+                metadata=payload.get(store.metadata_payload_key) or {}
+            ), point.id)
+            results.append((document, point.score, vector))
+        return results
 
     def delete(self, ids: List[str], **kwargs) -> None:
         self.vector_store.delete(ids=ids, **kwargs)
@@ -39,6 +39,7 @@ class KnowledgeBase(Base):
     chunk_size = Column(Integer, default=1000)
     chunk_overlap = Column(Integer, default=200)
     retrieval_top_k = Column(Integer, default=4)
+    query_expansion_mode = Column(String(20))
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -74,6 +75,8 @@ class DocumentChunk(Base):
     content = Column(Text, nullable=False)
     vector_id = Column(String(255))
     chunk_metadata = Column(JSON)
+    tokens = Column(JSON)
+    token_analyzer = Column(String(100))
     created_at = Column(DateTime, default=datetime.utcnow)
 
     document = relationship("Document", back_populates="chunks")
@@ -136,6 +136,7 @@ class KnowledgeBaseCreate(BaseModel):
     chunk_size: Optional[int] = Field(default=1000, ge=100, le=4000)
     chunk_overlap: Optional[int] = Field(default=200, ge=0, le=1000)
     retrieval_top_k: Optional[int] = Field(default=4, ge=1, le=20)
+    query_expansion_mode: Optional[str] = Field(default=None, pattern="^(sync|speculative|off)$")
 
 
 class KnowledgeBaseUpdate(BaseModel):
@@ -146,6 +147,7 @@ class KnowledgeBaseUpdate(BaseModel):
     chunk_size: Optional[int] = Field(None, ge=100, le=4000)
     chunk_overlap: Optional[int] = Field(None, ge=0, le=1000)
     retrieval_top_k: Optional[int] = Field(None, ge=1, le=20)
+    query_expansion_mode: Optional[str] = Field(None, pattern="^(sync|speculative|off)$")
     is_active: Optional[bool] = None
 
 
@@ -158,6 +160,7 @@ class KnowledgeBaseResponse(BaseModel):
     chunk_size: int
     chunk_overlap: int
     retrieval_top_k: int
+    query_expansion_mode: Optional[str] = None
     is_active: bool
     created_at: datetime
     updated_at: datetime
@@ -204,7 +207,8 @@ class ChunkResponse(BaseModel):
 
 class SearchRequest(BaseModel):
     query: str = Field(..., min_length=1)
-    knowledge_base_id: str
+    knowledge_base_id: Optional[str] = None
+    knowledge_base_ids: Optional[List[str]] = Field(default=None, min_length=1, max_length=20)
     top_k: Optional[int] = Field(default=4, ge=1, le=20)
     score_threshold: Optional[float] = Field(default=0.0, ge=0.0, le=1.0)
     filters: Optional[Dict[str, Any]] = None
@@ -223,11 +227,13 @@ class SearchResponse(BaseModel):
     results: List[SearchResult]
     total_count: int
     retrieval_time: float
+    failed_knowledge_bases: Optional[List[str]] = None
 
 
 class QARequest(BaseModel):
     question: str = Field(..., min_length=1)
-    knowledge_base_id: str
+    knowledge_base_id: Optional[str] = None
+    knowledge_base_ids: Optional[List[str]] = Field(default=None, min_length=1, max_length=20)
     top_k: Optional[int] = Field(default=4, ge=1, le=20)
     score_threshold: Optional[float] = Field(default=0.0, ge=0.0, le=1.0)
     llm_provider: Optional[LLMProvider] = LLMProvider.OPENAI
@@ -236,6 +242,31 @@ class QARequest(BaseModel):
     max_tokens: Optional[int] = Field(default=2048, ge=1, le=8192)
     use_rerank: Optional[bool] = False
     conversation_history: Optional[List[Dict[str, str]]] = None
+    stream_mode: Optional[str] = Field(default="cumulative", pattern="^(cumulative|delta)$")
+    preliminary_sources: Optional[bool] = False
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=10000)
+    knowledge_base_id: Optional[str] = None
+    knowledge_base_ids: Optional[List[str]] = Field(default=None, min_length=1, max_length=20)
+    top_k: Optional[int] = Field(default=4, ge=1, le=20)
+    score_threshold: Optional[float] = Field(default=0.0, ge=0.0, le=1.0)
+    filters: Optional[Dict[str, Any]] = None
+
+
+class BatchQARequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=10000)
+    knowledge_base_id: Optional[str] = None
+    knowledge_base_ids: Optional[List[str]] = Field(default=None, min_length=1, max_length=20)
+    top_k: Optional[int] = Field(default=4, ge=1, le=20)
+    score_threshold: Optional[float] = Field(default=0.0, ge=0.0, le=1.0)
+    llm_provider: Optional[LLMProvider] = LLMProvider.OPENAI
+    llm_model: Optional[str] = None
+    temperature: Optional[float] = Field(default=0.1, ge=0.0, le=2.0)
+    max_tokens: Optional[int] = Field(default=2048, ge=1, le=8192)
+    use_rerank: Optional[bool] = False
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64)
 
 
 class QAResponse(BaseModel):
@@ -1,18 +1,32 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from src.models.database import Base, KnowledgeBase, Document, DocumentChunk, QueryLog
 from src.core.document_processor import DocumentProcessor
 from src.core.vector_store import BaseVectorStore, get_vector_store
 from src.core.embeddings import BaseEmbeddings, get_embedding_service
 from src.core.llm import BaseLLM, get_llm
 from src.core.rag_engine import RAGEngine
+from src.core.federated_engine import FederatedRAGEngine
+from src.core.hybrid_retriever import BM25Retriever
+from src.core.text_analyzer import AnalyzerFactory
+from src.core.cache import get_cache, bump_kb_version
+from src.core.semantic_cache import bump_answer_version
+from src.core.source_metadata import SourceMetadataResolver
 from src.config.settings import get_settings
 import os
 import shutil
+import uuid
 
 settings = get_settings()
 
+# 在已有表上新增的列：create_all不会修改已存在的表，旧库升级时由upgrade_schema补齐
+# （与scripts/migrate_db.sql一致）
+ADDED_COLUMNS = {
+    "knowledge_bases": ["query_expansion_mode"],
+    "document_chunks": ["tokens", "token_analyzer"],
+}
+
 
 class DatabaseManager:
     def __init__(self, database_url: Optional[str] = None):
@@ -28,6 +42,23 @@ class DatabaseManager:
 
     def create_tables(self):
         Base.metadata.create_all(bind=self.engine)
+        self.upgrade_schema()
+
+    def upgrade_schema(self):
+        """为已有的表补齐后续版本新增的列（幂等，列已存在时跳过）"""
+        inspector = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table_name, column_names in ADDED_COLUMNS.items():
+                if not inspector.has_table(table_name):
+                    continue
+                existing = {column["name"] for column in inspector.get_columns(table_name)}
+                table = Base.metadata.tables[table_name]
+                for column_name in column_names:
+                    if column_name in existing:
+                        continue
+                    column_type = table.columns[column_name].type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+                    print(f"数据库升级: {table_name} 新增列 {column_name}")
 
     def drop_tables(self):
         Base.metadata.drop_all(bind=self.engine)
@@ -44,6 +75,14 @@ class KnowledgeBaseService:
         self.db_manager = db_manager or DatabaseManager()
         self.db_manager.create_tables()
         self._rag_engines: Dict[str, RAGEngine] = {}
+        self._federated_engines: Dict[Tuple[str, ...], FederatedRAGEngine] = {}
+        self._bm25_indexes: Dict[str, BM25Retriever] = {}
+        self._source_resolvers: Dict[str, SourceMetadataResolver] = {}
+        self.cache = get_cache()
+        self.analyzer = AnalyzerFactory.create(
+            settings.bm25_analyzer,
+            use_dictionary=settings.bm25_use_dictionary
+        )
 
     def create_knowledge_base(
         self,
@@ -53,7 +92,8 @@ class KnowledgeBaseService:
         llm_model: Optional[str] = None,
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
-        retrieval_top_k: int = 4
+        retrieval_top_k: int = 4,
+        query_expansion_mode: Optional[str] = None
     ) -> KnowledgeBase:
         session = self.db_manager.get_session()
         try:
@@ -64,7 +104,8 @@ class KnowledgeBaseService:
                 llm_model=llm_model,
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap,
-                retrieval_top_k=retrieval_top_k
+                retrieval_top_k=retrieval_top_k,
+                query_expansion_mode=query_expansion_mode
             )
             session.add(kb)
             session.commit()
@@ -104,8 +145,7 @@ class KnowledgeBaseService:
                         setattr(kb, key, value)
                 session.commit()
                 session.refresh(kb)
-                if kb_id in self._rag_engines:
-                    del self._rag_engines[kb_id]
+                self._drop_rag_engine(kb_id)
             return kb
         finally:
             session.close()
@@ -117,8 +157,11 @@ class KnowledgeBaseService:
             if kb:
                 session.delete(kb)
                 session.commit()
-                if kb_id in self._rag_engines:
-                    del self._rag_engines[kb_id]
+                self._drop_rag_engine(kb_id)
+                self._bm25_indexes.pop(kb_id, None)
+                self._source_resolvers.pop(kb_id, None)
+                BM25Retriever.remove_files(self._bm25_index_path(kb_id))
+                self._bump_kb_version(kb_id)
                 return True
             return False
         finally:
@@ -155,7 +198,7 @@ class KnowledgeBaseService:
                 embedding_function=embedding_service
             )
 
-            vector_ids = vector_store.add_documents(chunks)
+            vector_ids = vector_store.add_documents(chunks, ids=self._assign_vector_ids(chunks))
 
             file_info = processor.get_file_info(file_path)
             
@@ -176,18 +219,26 @@ class KnowledgeBaseService:
             
             doc_id = doc.id
 
+            indexed_chunks = []
             for idx, (chunk, vector_id) in enumerate(zip(chunks, vector_ids)):
+                tokens = self.analyzer.analyze(chunk.page_content)
                 doc_chunk = DocumentChunk(
                     document_id=doc_id,
                     chunk_index=idx,
                     content=chunk.page_content,
                     vector_id=vector_id,
-                    chunk_metadata=chunk.metadata
+                    chunk_metadata=chunk.metadata,
+                    tokens=tokens,
+                    token_analyzer=self.analyzer.signature
                 )
                 session.add(doc_chunk)
+                indexed_chunks.append((chunk, vector_id, doc_id, tokens))
 
             session.commit()
             session.refresh(doc)
+            self.get_source_resolver(kb_id).add(file_path, display_filename, doc_id)
+            self._add_to_bm25_index(kb_id, indexed_chunks)
+            self._bump_kb_version(kb_id)
             return doc
         finally:
             session.close()
@@ -222,9 +273,11 @@ class KnowledgeBaseService:
                 embedding_function=embedding_service
             )
 
-            vector_ids = vector_store.add_documents(chunks)
+            vector_ids = vector_store.add_documents(chunks, ids=self._assign_vector_ids(chunks))
 
             documents = []
+            document_sources = []
+            indexed_chunks = []
             current_doc_id = None
             chunk_idx = 0
 
@@ -251,22 +304,33 @@ class KnowledgeBaseService:
                     session.flush()
                     session.refresh(doc)
                     documents.append(doc)
+                    document_sources.append((source, file_name, doc.id))
                     current_doc_id = source
                     chunk_idx = 0
 
+                tokens = self.analyzer.analyze(chunk.page_content)
                 doc_chunk = DocumentChunk(
                     document_id=doc.id,
                     chunk_index=chunk_idx,
                     content=chunk.page_content,
                     vector_id=vector_id,
-                    chunk_metadata=chunk.metadata
+                    chunk_metadata=chunk.metadata,
+                    tokens=tokens,
+                    token_analyzer=self.analyzer.signature
                 )
                 session.add(doc_chunk)
+                indexed_chunks.append((chunk, vector_id, doc.id, tokens))
                 chunk_idx += 1
 
                 doc.chunk_count = chunk_idx
 
             session.commit()
+            resolver = self.get_source_resolver(kb_id)
+            for source, file_name, doc_id in document_sources:
+                resolver.add(source, file_name, doc_id)
+            self._add_to_bm25_index(kb_id, indexed_chunks)
+            if documents:
+                self._bump_kb_version(kb_id)
             return documents
         finally:
             session.close()
@@ -285,6 +349,7 @@ class KnowledgeBaseService:
             if doc:
                 chunks = session.query(DocumentChunk).filter(DocumentChunk.document_id == doc_id).all()
                 vector_ids = [chunk.vector_id for chunk in chunks if chunk.vector_id]
+                index_keys = [chunk.vector_id or chunk.id for chunk in chunks]
 
                 if vector_ids:
                     embedding_provider = doc.knowledge_base.embedding_model or "alibaba"
@@ -295,8 +360,13 @@ class KnowledgeBaseService:
                     )
                     vector_store.delete(vector_ids)
 
+                kb_id = doc.knowledge_base_id
+                file_path = doc.file_path
                 session.delete(doc)
                 session.commit()
+                self.get_source_resolver(kb_id).remove(file_path)
+                self._remove_from_bm25_index(kb_id, index_keys)
+                self._bump_kb_version(kb_id)
                 return True
             return False
         finally:
@@ -318,6 +388,110 @@ class KnowledgeBaseService:
         finally:
             session.close()
 
+    @staticmethod
+    def _assign_vector_ids(chunks) -> List[str]:
+        """预先生成向量ID并写入分块元数据，使向量检索结果可与BM25索引按同一key融合"""
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        for chunk, vector_id in zip(chunks, ids):
+            chunk.metadata["vector_id"] = vector_id
+        return ids
+
+    def _bm25_index_path(self, kb_id: str) -> str:
+        return os.path.join(settings.bm25_index_dir, f"{kb_id}.bm25")
+
+    def build_bm25_index(self, kb_id: str) -> BM25Retriever:
+        """从DocumentChunk全量构建知识库的BM25倒排索引并持久化
+
+        优先使用入库时保存的分词结果，只有分词配置变化过的分块才重新分词。
+        """
+        session = self.db_manager.get_session()
+        try:
+            rows = session.query(DocumentChunk).join(Document).filter(
+                Document.knowledge_base_id == kb_id
+            ).order_by(DocumentChunk.document_id, DocumentChunk.chunk_index).all()
+
+            signature = self.analyzer.signature
+            retriever = BM25Retriever(analyzer=self.analyzer)
+            retriever.initialize(
+                [row.content for row in rows],
+                doc_ids=[row.vector_id or row.id for row in rows],
+                metadatas=[
+                    {**(row.chunk_metadata or {}), "document_id": row.document_id}
+                    for row in rows
+                ],
+                tokens=[
+                    row.tokens if row.token_analyzer == signature else None
+                    for row in rows
+                ]
+            )
+        finally:
+            session.close()
+
+        retriever.save(self._bm25_index_path(kb_id))
+        return retriever
+
+    def get_bm25_index(self, kb_id: str) -> BM25Retriever:
+        """获取知识库BM25索引（进程内共享），未加载时读取快照与日志，不存在时从数据库重建；
+        已加载时回放其他worker进程追加的日志"""
+        if kb_id not in self._bm25_indexes:
+            retriever = BM25Retriever.load(self._bm25_index_path(kb_id), analyzer=self.analyzer)
+            if retriever is None:
+                retriever = self.build_bm25_index(kb_id)
+            self._bm25_indexes[kb_id] = retriever
+        else:
+            self._bm25_indexes[kb_id].refresh()
+        return self._bm25_indexes[kb_id]
+
+    def _add_to_bm25_index(self, kb_id: str, indexed_chunks):
+        """把新分块增量写入BM25索引；索引尚未建立时无需处理，首次加载会从数据库全量构建"""
+        if not indexed_chunks:
+            return
+        if kb_id not in self._bm25_indexes and not os.path.exists(self._bm25_index_path(kb_id)):
+            return
+        try:
+            self.get_bm25_index(kb_id).add_documents(
+                [chunk.page_content for chunk, _, _, _ in indexed_chunks],
+                [vector_id for _, vector_id, _, _ in indexed_chunks],
+                [{**chunk.metadata, "document_id": doc_id} for chunk, _, doc_id, _ in indexed_chunks],
+                [tokens for _, _, _, tokens in indexed_chunks]
+            )
+        except Exception as e:
+            print(f"更新BM25索引失败，将在下次加载时重建: {e}")
+            self._reset_bm25_index(kb_id)
+
+    def _remove_from_bm25_index(self, kb_id: str, index_keys: List[str]):
+        if not index_keys:
+            return
+        if kb_id not in self._bm25_indexes and not os.path.exists(self._bm25_index_path(kb_id)):
+            return
+        try:
+            self.get_bm25_index(kb_id).remove_documents(index_keys)
+        except Exception as e:
+            print(f"更新BM25索引失败，将在下次加载时重建: {e}")
+            self._reset_bm25_index(kb_id)
+
+    def _bump_kb_version(self, kb_id: str):
+        """知识库内容变化：检索缓存（共享缓存中的版本号）与语义答案缓存（进程内版本号）都随之失效"""
+        bump_kb_version(self.cache, kb_id)
+        bump_answer_version(kb_id)
+
+    def _reset_bm25_index(self, kb_id: str):
+        self._bm25_indexes.pop(kb_id, None)
+        BM25Retriever.remove_files(self._bm25_index_path(kb_id))
+        self._drop_rag_engine(kb_id)
+
+    def _drop_rag_engine(self, kb_id: str):
+        """丢弃知识库的引擎，包含该知识库的联邦引擎一并丢弃"""
+        self._rag_engines.pop(kb_id, None)
+        for key in [key for key in self._federated_engines if kb_id in key]:
+            del self._federated_engines[key]
+
+    def get_source_resolver(self, kb_id: str) -> SourceMetadataResolver:
+        """知识库的来源文件映射，随文档入库/删除更新"""
+        if kb_id not in self._source_resolvers:
+            self._source_resolvers[kb_id] = SourceMetadataResolver(self.db_manager, kb_id)
+        return self._source_resolvers[kb_id]
+
     def get_rag_engine(self, kb_id: str) -> RAGEngine:
         if kb_id not in self._rag_engines:
             kb = self.get_knowledge_base(kb_id)
@@ -335,6 +509,8 @@ class KnowledgeBaseService:
             llm_provider = kb.llm_model or "alibaba"
             llm = get_llm(llm_provider)
 
+            bm25_retriever = self.get_bm25_index(kb_id) if settings.use_hybrid_search else None
+
             if settings.use_rerank:
                 self._rag_engines[kb_id] = RAGEngine(
                     vector_store=vector_store,
@@ -344,7 +520,13 @@ class KnowledgeBaseService:
                     use_rerank=True,
                     use_query_rewrite=settings.use_query_rewrite,
                     num_paths=settings.num_paths,
-                    db_manager=self.db_manager
+                    db_manager=self.db_manager,
+                    bm25_retriever=bm25_retriever,
+                    query_expansion_mode=kb.query_expansion_mode,
+                    enable_caching=settings.enable_cache,
+                    knowledge_base_id=kb_id,
+                    cache=self.cache,
+                    source_resolver=self.get_source_resolver(kb_id)
                 )
             else:
                 self._rag_engines[kb_id] = RAGEngine(
@@ -355,11 +537,27 @@ class KnowledgeBaseService:
                     use_rerank=False,
                     use_query_rewrite=False,
                     num_paths=settings.num_paths,
-                    db_manager=self.db_manager
+                    db_manager=self.db_manager,
+                    bm25_retriever=bm25_retriever,
+                    query_expansion_mode=kb.query_expansion_mode,
+                    enable_caching=settings.enable_cache,
+                    knowledge_base_id=kb_id,
+                    cache=self.cache,
+                    source_resolver=self.get_source_resolver(kb_id)
                 )
 
         return self._rag_engines[kb_id]
 
+    def get_federated_engine(self, kb_ids: List[str]) -> FederatedRAGEngine:
+        """多知识库联邦检索引擎，按排序后的知识库ID缓存，同一组知识库的请求复用同一个引擎
+
+        知识库按ID排序后组合（生成答案使用排序后第一个知识库的大模型）；任一知识库的引擎被丢弃时联邦引擎随之失效。
+        """
+        key = tuple(sorted(set(kb_ids)))
+        if key not in self._federated_engines:
+            self._federated_engines[key] = FederatedRAGEngine({kb_id: self.get_rag_engine(kb_id) for kb_id in key})
+        return self._federated_engines[key]
+
     def get_stats(self) -> Dict[str, Any]:
         session = self.db_manager.get_session()
         try: